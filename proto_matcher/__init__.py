@@ -1,4 +1,6 @@
 from proto_matcher.matcher.matcher import equals_proto
+from proto_matcher.matcher.matcher import equals_proto_file
+from proto_matcher.matcher.matcher import equals_any_proto
 from proto_matcher.matcher.matcher import approximately
 from proto_matcher.matcher.matcher import ignoring_field_paths
 from proto_matcher.matcher.matcher import ignoring_repeated_field_ordering
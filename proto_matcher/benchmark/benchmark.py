@@ -0,0 +1,240 @@
+import argparse
+import dataclasses
+import itertools
+import json
+import sys
+import time
+import tracemalloc
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from google.protobuf import descriptor
+from google.protobuf import message
+
+from proto_matcher.benchmark import shapes
+from proto_matcher.compare import compare
+from proto_matcher.compare.options import ProtoComparisonOptions
+from proto_matcher.compare.options import ProtoComparisonScope
+from proto_matcher.compare.options import ProtoFloatComparison
+from proto_matcher.compare.options import RepeatedFieldComparison
+
+_FieldDescriptor = descriptor.FieldDescriptor
+
+_DEFAULT_MIN_TIME = 0.1
+_DEFAULT_REPEATS = 3
+# Slowdown relative to the baseline, as a fraction of its ops/sec, above
+# which a benchmark counts as regressed.
+_DEFAULT_TOLERANCE = 0.1
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    # '<shape>/<equal|modified>/<options>', e.g.
+    # 'map/modified/FULL,EXACT,AS_LIST,IGNORING'.
+    name: str
+    ops_per_sec: float
+    # Peak of memory allocated during one comparison.
+    peak_bytes: int
+    # Messages and field values in both compared messages.
+    nodes: int
+
+    @property
+    def ns_per_node(self) -> float:
+        return 1e9 / self.ops_per_sec / max(self.nodes, 1)
+
+
+def iter_options(
+        shape: shapes.Shape) -> Iterator[Tuple[str, ProtoComparisonOptions]]:
+    """Yields every combination of options to compare |shape| with."""
+    for scope, float_comp, repeated_field_comp, ignoring in itertools.product(
+            ProtoComparisonScope, ProtoFloatComparison,
+            RepeatedFieldComparison, (False, True)):
+        label = ','.join(
+            [scope.name, float_comp.name, repeated_field_comp.name] +
+            (['IGNORING'] if ignoring else []))
+        yield label, ProtoComparisonOptions(
+            scope=scope,
+            float_comp=float_comp,
+            repeated_field_comp=repeated_field_comp,
+            ignore_field_paths=shape.ignore_field_paths if ignoring else ())
+
+
+def count_nodes(msg: message.Message) -> int:
+    """Counts |msg|, its submessages and the values of their set fields."""
+    nodes = 0
+    pending = [msg]
+    while pending:
+        nodes += 1
+        for field_desc, value in pending.pop().ListFields():
+            if (field_desc.message_type is not None and
+                    field_desc.message_type.GetOptions().map_entry):
+                nodes += len(value)
+                value_desc = field_desc.message_type.fields_by_name['value']
+                if value_desc.cpp_type == _FieldDescriptor.CPPTYPE_MESSAGE:
+                    pending.extend(value.values())
+            elif field_desc.cpp_type == _FieldDescriptor.CPPTYPE_MESSAGE:
+                if field_desc.label == _FieldDescriptor.LABEL_REPEATED:
+                    pending.extend(value)
+                else:
+                    pending.append(value)
+            elif field_desc.label == _FieldDescriptor.LABEL_REPEATED:
+                nodes += len(value)
+            else:
+                nodes += 1
+    return nodes
+
+
+def run_benchmark(name: str,
+                  actual: message.Message,
+                  expected: message.Message,
+                  opts: ProtoComparisonOptions,
+                  min_time: float = _DEFAULT_MIN_TIME,
+                  repeats: int = _DEFAULT_REPEATS) -> BenchmarkResult:
+    """Measures proto_compare(actual, expected, opts).
+
+    Comparisons run for at least |min_time| seconds, |repeats| times, and the
+    fastest run counts. A first comparison warms up the caches of compiled
+    plans, outside of any measurement.
+    """
+    compare.proto_compare(actual, expected, opts)
+    ops_per_sec = 0.0
+    for _ in range(repeats):
+        ops = 0
+        elapsed = 0.0
+        start = time.perf_counter()
+        while elapsed < min_time:
+            compare.proto_compare(actual, expected, opts)
+            ops += 1
+            elapsed = time.perf_counter() - start
+        ops_per_sec = max(ops_per_sec, ops / elapsed)
+    # Measured apart, as tracing slows down allocations a lot.
+    tracemalloc.start()
+    try:
+        compare.proto_compare(actual, expected, opts)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return BenchmarkResult(name=name,
+                           ops_per_sec=ops_per_sec,
+                           peak_bytes=peak_bytes,
+                           nodes=count_nodes(actual) + count_nodes(expected))
+
+
+def run_benchmarks(shape_names: Optional[Sequence[str]] = None,
+                   scale: int = 1,
+                   min_time: float = _DEFAULT_MIN_TIME,
+                   repeats: int = _DEFAULT_REPEATS) -> List[BenchmarkResult]:
+    """Runs the benchmarks of every option combination on each shape.
+
+    Each shape is compared equal and with one modified value. Runs all
+    shapes.SHAPES unless |shape_names| picks some of them.
+    """
+    results = []
+    for shape in shapes.SHAPES:
+        if shape_names and shape.name not in shape_names:
+            continue
+        for modified in (False, True):
+            actual, expected = shape.make_pair(scale, modified)
+            variant = 'modified' if modified else 'equal'
+            for label, opts in iter_options(shape):
+                results.append(
+                    run_benchmark(f'{shape.name}/{variant}/{label}', actual,
+                                  expected, opts, min_time, repeats))
+    return results
+
+
+def find_regressions(
+        results: Sequence[BenchmarkResult],
+        baseline: Dict[str, BenchmarkResult],
+        tolerance: float = _DEFAULT_TOLERANCE) -> Dict[str, float]:
+    """Returns the speed relative to |baseline| of regressed benchmarks.
+
+    Benchmarks missing from |baseline| are skipped.
+    """
+    regressions = {}
+    for result in results:
+        base = baseline.get(result.name)
+        if base is None:
+            continue
+        speed = result.ops_per_sec / base.ops_per_sec
+        if speed < 1.0 - tolerance:
+            regressions[result.name] = speed
+    return regressions
+
+
+def save_results(results: Sequence[BenchmarkResult], path: str):
+    with open(path, 'w') as f:
+        json.dump({result.name: dataclasses.asdict(result)
+                   for result in results},
+                  f,
+                  indent=2,
+                  sort_keys=True)
+
+
+def load_results(path: str) -> Dict[str, BenchmarkResult]:
+    with open(path) as f:
+        return {
+            name: BenchmarkResult(**fields)
+            for name, fields in json.load(f).items()
+        }
+
+
+def format_report(
+        results: Sequence[BenchmarkResult],
+        baseline: Optional[Dict[str, BenchmarkResult]] = None) -> str:
+    name_width = max([len(result.name) for result in results] + [9])
+    header = (f'{"benchmark":<{name_width}} {"ops/sec":>12} '
+              f'{"peak KiB":>10} {"ns/node":>10}')
+    if baseline is not None:
+        header += f' {"vs base":>8}'
+    lines = [header]
+    for result in results:
+        line = (f'{result.name:<{name_width}} {result.ops_per_sec:>12.1f} '
+                f'{result.peak_bytes / 1024:>10.1f} '
+                f'{result.ns_per_node:>10.1f}')
+        if baseline is not None:
+            base = baseline.get(result.name)
+            line += (f' {result.ops_per_sec / base.ops_per_sec:>7.2f}x'
+                     if base else f' {"-":>8}')
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description='Benchmarks proto_compare on generated messages.')
+    parser.add_argument('--shape',
+                        action='append',
+                        choices=[shape.name for shape in shapes.SHAPES],
+                        help='Only run this shape; may be repeated.')
+    parser.add_argument('--scale',
+                        type=int,
+                        default=1,
+                        help='Grows repeated fields and maps linearly.')
+    parser.add_argument('--min_time', type=float, default=_DEFAULT_MIN_TIME)
+    parser.add_argument('--repeats', type=int, default=_DEFAULT_REPEATS)
+    parser.add_argument('--baseline',
+                        help='Results to compare against, from --save.')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=_DEFAULT_TOLERANCE,
+                        help='Slowdown against --baseline that fails the run.')
+    parser.add_argument('--save', help='Where to save results as JSON.')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.shape, args.scale, args.min_time,
+                             args.repeats)
+    baseline = load_results(args.baseline) if args.baseline else None
+    print(format_report(results, baseline))
+    if args.save:
+        save_results(results, args.save)
+    if baseline is None:
+        return 0
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for name, speed in sorted(regressions.items()):
+        print(f'Regressed: {name} runs at {speed:.2f}x the baseline',
+              file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
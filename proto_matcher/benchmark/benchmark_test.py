@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from proto_matcher.benchmark import benchmark
+from proto_matcher.benchmark import shapes
+from proto_matcher.compare import compare
+from proto_matcher.testdata import test_pb2
+
+
+class ShapesTest(unittest.TestCase):
+
+    def test_pairs(self):
+        for shape in shapes.SHAPES:
+            with self.subTest(shape.name):
+                actual, expected = shape.make_pair()
+                self.assertEqual(actual, expected)
+                self.assertEqual(shape.make_pair()[1], expected)
+                actual, expected = shape.make_pair(modified=True)
+                self.assertFalse(
+                    compare.proto_compare(actual, expected).is_equal)
+
+    def test_ignore_field_paths_compile(self):
+        for shape in shapes.SHAPES:
+            with self.subTest(shape.name):
+                for _, opts in benchmark.iter_options(shape):
+                    compare.proto_compare(*shape.make_pair(), opts)
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def test_count_nodes(self):
+        foo = test_pb2.Foo(mapping={1: 'a', 2: 'b'})
+        foo.bars.add(notes=['a', 'b', 'c'], size=1)
+        # foo, 2 map entries, the bar, its 3 notes and its size.
+        self.assertEqual(benchmark.count_nodes(foo), 8)
+
+    def test_run_benchmarks(self):
+        results = benchmark.run_benchmarks(['test_proto'],
+                                           min_time=0.001,
+                                           repeats=1)
+        self.assertEqual(len(results), 32)
+        self.assertEqual(results[0].name, 'test_proto/equal/FULL,EXACT,AS_LIST')
+        self.assertEqual(results[-1].name,
+                         'test_proto/modified/PARTIAL,APPROXIMATE,AS_SET,'
+                         'IGNORING')
+        for result in results:
+            self.assertGreater(result.ops_per_sec, 0)
+            self.assertGreater(result.nodes, 0)
+
+    def test_baseline(self):
+        results = [
+            benchmark.BenchmarkResult('a', 100.0, 10, 5),
+            benchmark.BenchmarkResult('b', 100.0, 10, 5),
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'baseline.json')
+            benchmark.save_results(results, path)
+            baseline = benchmark.load_results(path)
+        self.assertEqual(baseline, {result.name: result for result in results})
+
+        slower = [
+            benchmark.BenchmarkResult('a', 95.0, 10, 5),
+            benchmark.BenchmarkResult('b', 50.0, 10, 5),
+            benchmark.BenchmarkResult('c', 1.0, 10, 5),
+        ]
+        self.assertEqual(benchmark.find_regressions(slower, baseline),
+                         {'b': 0.5})
+        report = benchmark.format_report(slower, baseline)
+        self.assertIn('0.50x', report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import dataclasses
+import functools
+import random
+from typing import Callable, FrozenSet, Tuple
+
+from google.protobuf import descriptor_pb2
+from google.protobuf import descriptor_pool
+from google.protobuf import message
+from google.protobuf import text_format
+
+from proto_matcher.compare import message_util
+from proto_matcher.testdata import test_pb2
+
+_SEED = 20201017
+
+_WIDE_FIELDS = 256
+# One in this many fields of a wide message is set.
+_WIDE_SPARSITY = 7
+
+# The message of test_pb2 used by the unit tests.
+_TEST_PROTO = """
+bars {
+    short_id: -123
+    name: "a bar"
+    size: 1
+    notes: "hehe"
+    notes: "123"
+}
+bars {
+    long_id: 888899990000
+    progress: 0.31415926
+    checked: True
+    notes: "photo"
+}
+baz {
+    status: ERROR
+}
+mapping {
+    key: 5
+    value: "haha"
+}
+mapping {
+    key: 10
+    value: "hello world!"
+}
+"""
+
+_FieldDescriptorProto = descriptor_pb2.FieldDescriptorProto
+
+
+@dataclasses.dataclass(frozen=True)
+class Shape:
+    """A kind of message the benchmarks compare.
+
+    Messages are generated from a fixed seed, so runs are reproducible.
+    """
+    name: str
+    # Builds a message of this shape from a random generator; |scale| grows
+    # the number of elements linearly.
+    build: Callable[[random.Random, int], message.Message] = (
+        dataclasses.field(repr=False))
+    # Changes one value of a built message, as late in it as possible.
+    modify: Callable[[message.Message], None] = dataclasses.field(repr=False)
+    # Ignored paths of the benchmarks that ignore fields.
+    ignore_field_paths: FrozenSet[Tuple[str, ...]] = frozenset()
+
+    def make_pair(
+            self,
+            scale: int = 1,
+            modified: bool = False) -> Tuple[message.Message, message.Message]:
+        """Returns (actual, expected) messages sharing no submessage.
+
+        They are equal, unless |modified|. Equal messages are mostly told
+        apart by the runtime's own ==, while a late difference makes the
+        comparison walk both messages.
+        """
+        expected = self.build(random.Random(_SEED), scale)
+        actual = type(expected)()
+        actual.CopyFrom(expected)
+        if modified:
+            self.modify(actual)
+        return actual, expected
+
+
+def _build_test_proto(rng: random.Random, scale: int) -> message.Message:
+    del rng, scale  # The unit test message has a fixed size.
+    return text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+
+
+def _modify_test_proto(foo: message.Message):
+    foo.mapping[10] = 'modified'
+
+
+@functools.lru_cache(maxsize=None)
+def _wide_message_class():
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name='proto_matcher/benchmark/wide.proto',
+        package='proto_matcher.benchmark',
+        syntax='proto3')
+    msg_proto = file_proto.message_type.add(name='Wide')
+    for i in range(_WIDE_FIELDS):
+        msg_proto.field.add(name=f'f{i}',
+                            number=i + 1,
+                            label=_FieldDescriptorProto.LABEL_OPTIONAL,
+                            type=(_FieldDescriptorProto.TYPE_INT64 if i % 2 else
+                                  _FieldDescriptorProto.TYPE_STRING))
+    # A pool of its own keeps the type out of the default pool.
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    return message_util.get_message_class(
+        pool.FindMessageTypeByName('proto_matcher.benchmark.Wide'))
+
+
+def _build_wide_sparse(rng: random.Random, scale: int) -> message.Message:
+    del scale  # The number of fields is fixed by the type.
+    msg = _wide_message_class()()
+    for i in range(0, _WIDE_FIELDS, _WIDE_SPARSITY):
+        if i % 2:
+            setattr(msg, f'f{i}', rng.getrandbits(48))
+        else:
+            setattr(msg, f'f{i}', f'value {rng.getrandbits(32)}')
+    return msg
+
+
+def _modify_wide_sparse(msg: message.Message):
+    last = (_WIDE_FIELDS - 1) // _WIDE_SPARSITY * _WIDE_SPARSITY
+    setattr(msg, f'f{last}', type(getattr(msg, f'f{last}'))())
+
+
+def _build_deep(rng: random.Random, scale: int) -> message.Message:
+    # Deep enough to be expensive, shallow enough for the recursive engine.
+    root = test_pb2.Node(value=rng.getrandbits(31))
+    node = root
+    for _ in range(100):
+        node = node.next
+        node.value = rng.getrandbits(31)
+        for _ in range(scale):
+            node.children.add(value=rng.getrandbits(31))
+    return root
+
+
+def _modify_deep(node: message.Message):
+    while node.HasField('next'):
+        node = node.next
+    node.value += 1
+
+
+def _build_repeated_scalars(rng: random.Random,
+                            scale: int) -> message.Message:
+    bar = test_pb2.Bar(name='repeated scalars')
+    bar.notes.extend(f'note {rng.getrandbits(32)}' for _ in range(1000 * scale))
+    return bar
+
+
+def _modify_repeated_scalars(bar: message.Message):
+    bar.notes[-1] = 'modified'
+
+
+def _build_repeated_messages(rng: random.Random,
+                             scale: int) -> message.Message:
+    foo = test_pb2.Foo()
+    for i in range(200 * scale):
+        bar = foo.bars.add(short_id=i, name=f'bar {rng.getrandbits(32)}')
+        bar.size = rng.getrandbits(16)
+        bar.notes.extend(['a', 'b'])
+    return foo
+
+
+def _modify_repeated_messages(foo: message.Message):
+    foo.bars[-1].size += 1
+
+
+def _build_map(rng: random.Random, scale: int) -> message.Message:
+    foo = test_pb2.Foo()
+    for i in range(1000 * scale):
+        foo.mapping[i] = f'value {rng.getrandbits(32)}'
+    return foo
+
+
+def _modify_map(foo: message.Message):
+    foo.mapping[len(foo.mapping) - 1] = 'modified'
+
+
+def _build_float_heavy(rng: random.Random, scale: int) -> message.Message:
+    bar = test_pb2.Bar(progress=rng.random(), precision=rng.random())
+    bar.samples.extend(rng.random() for _ in range(1000 * scale))
+    bar.weights.extend(rng.random() for _ in range(1000 * scale))
+    return bar
+
+
+def _modify_float_heavy(bar: message.Message):
+    bar.samples[-1] += 1.0
+
+
+SHAPES: Tuple[Shape, ...] = (
+    Shape('test_proto', _build_test_proto, _modify_test_proto,
+          frozenset({('bars', 'name'), ('baz',)})),
+    Shape('wide_sparse', _build_wide_sparse, _modify_wide_sparse,
+          frozenset({('f0',), ('f7',)})),
+    Shape('deep', _build_deep, _modify_deep,
+          frozenset({('next', 'children')})),
+    Shape('repeated_scalars', _build_repeated_scalars,
+          _modify_repeated_scalars, frozenset({('name',)})),
+    Shape('repeated_messages', _build_repeated_messages,
+          _modify_repeated_messages, frozenset({('bars', 'size')})),
+    Shape('map', _build_map, _modify_map, frozenset({('mapping[5]',)})),
+    Shape('float_heavy', _build_float_heavy, _modify_float_heavy,
+          frozenset({('weights',)})),
+)
@@ -1,6 +1,21 @@
 from proto_matcher.compare.compare import RepeatedFieldComparison
+from proto_matcher.compare.compare import ProtoComparisonEngine
 from proto_matcher.compare.compare import ProtoComparisonOptions
 from proto_matcher.compare.compare import ProtoComparisonResult
 from proto_matcher.compare.compare import ProtoComparisonScope
 from proto_matcher.compare.compare import ProtoFloatComparison
 from proto_matcher.compare.compare import proto_compare
+from proto_matcher.compare.compare import proto_equal
+from proto_matcher.compare.compare import DifferenceKind
+from proto_matcher.compare.compare import ProtoDifference
+from proto_matcher.compare.fingerprint import proto_fingerprint
+from proto_matcher.compare.index import ExpectationIndex
+from proto_matcher.compare.memo import ComparisonMemo
+from proto_matcher.compare.profile import ComparisonStats
+from proto_matcher.compare.profile import FieldStats
+from proto_matcher.compare.profile import add_stats_hook
+from proto_matcher.compare.profile import remove_stats_hook
+from proto_matcher.compare.batch import iter_proto_compare_many
+from proto_matcher.compare.batch import proto_compare_many
+from proto_matcher.compare.stream import RecordComparison
+from proto_matcher.compare.stream import compare_streams
@@ -0,0 +1,138 @@
+import collections
+import concurrent.futures
+import itertools
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from google.protobuf import descriptor
+from google.protobuf import message
+
+from proto_matcher.compare import compare
+from proto_matcher.compare import message_util
+from proto_matcher.compare.memo import ComparisonMemo
+from proto_matcher.compare.options import ProtoComparisonOptions
+
+# (actual, expected), in the order proto_compare takes them.
+MessagePair = Tuple[message.Message, message.Message]
+# (actual full name, actual bytes, expected full name, expected bytes).
+_SerializedPair = Tuple[str, bytes, str, bytes]
+
+_DEFAULT_CHUNK_SIZE = 256
+# Chunks submitted to the executor ahead of the one being yielded, which
+# bounds memory when streaming.
+_DEFAULT_PREFETCH_CHUNKS = 16
+
+
+def proto_compare_many(
+        pairs: Iterable[MessagePair],
+        opts: Optional[ProtoComparisonOptions] = None,
+        executor: Optional[concurrent.futures.Executor] = None,
+        chunk_size: int = _DEFAULT_CHUNK_SIZE,
+        memo: Optional[ComparisonMemo] = None
+) -> List[compare.ProtoComparisonResult]:
+    """Runs proto_compare over (actual, expected) pairs, in input order.
+
+    See iter_proto_compare_many.
+    """
+    return list(
+        iter_proto_compare_many(pairs,
+                                opts,
+                                executor=executor,
+                                chunk_size=chunk_size,
+                                memo=memo))
+
+
+def iter_proto_compare_many(
+    pairs: Iterable[MessagePair],
+    opts: Optional[ProtoComparisonOptions] = None,
+    executor: Optional[concurrent.futures.Executor] = None,
+    chunk_size: int = _DEFAULT_CHUNK_SIZE,
+    prefetch_chunks: int = _DEFAULT_PREFETCH_CHUNKS,
+    memo: Optional[ComparisonMemo] = None
+) -> Iterator[compare.ProtoComparisonResult]:
+    """Lazily runs proto_compare over (actual, expected) pairs.
+
+    Pairs are consumed in chunks of |chunk_size|. Each chunk is compared with
+    one MessageDifferencer per message type, on |executor| if given, and
+    results are yielded in input order. At most |prefetch_chunks| chunks are
+    in flight at a time, so |pairs| may be an unbounded stream.
+
+    With a ProcessPoolExecutor, messages are sent to workers as serialized
+    bytes plus their type's full name. Their types must be in the default
+    descriptor pool of the workers, e.g. by importing the generated modules
+    in the executor's initializer.
+
+    A |memo| is shared by the comparisons of the batch, so that pairs of
+    messages met again, e.g. a reused expectation against the same actual,
+    are not walked again. Workers of a ProcessPoolExecutor compare copies of
+    the messages and skip it.
+    """
+    if not opts:
+        opts = ProtoComparisonOptions()
+    chunks = _chunked(pairs, chunk_size)
+    if executor is None:
+        for chunk in chunks:
+            yield from _compare_chunk(chunk, opts, memo)
+        return
+
+    if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+        submit = lambda chunk: executor.submit(_compare_serialized_chunk,
+                                               _serialize_chunk(chunk), opts)
+    else:
+        submit = lambda chunk: executor.submit(_compare_chunk, chunk, opts,
+                                               memo)
+    pending: Deque[concurrent.futures.Future] = collections.deque(
+        submit(chunk) for chunk in itertools.islice(chunks, prefetch_chunks))
+    while pending:
+        results = pending.popleft().result()
+        for chunk in itertools.islice(chunks, 1):
+            pending.append(submit(chunk))
+        yield from results
+
+
+def _chunked(pairs: Iterable[MessagePair],
+             chunk_size: int) -> Iterator[List[MessagePair]]:
+    if chunk_size < 1:
+        raise ValueError(f'Invalid chunk size {chunk_size}')
+    pairs = iter(pairs)
+    while True:
+        chunk = list(itertools.islice(pairs, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _compare_chunk(
+    chunk: List[MessagePair],
+    opts: ProtoComparisonOptions,
+    memo: Optional[ComparisonMemo] = None
+) -> List[compare.ProtoComparisonResult]:
+    differencers: Dict[descriptor.Descriptor,
+                       compare.MessageDifferencer] = {}
+    results = []
+    for actual, expected in chunk:
+        if not compare.proto_comparable(actual, expected):
+            results.append(compare.proto_compare(actual, expected, opts))
+            continue
+        desc = actual.DESCRIPTOR
+        if desc not in differencers:
+            differencers[desc] = compare.make_differencer(
+                compare.ProtoComparisonEngine.RECURSIVE, opts, desc, memo=memo)
+        results.append(differencers[desc].compare(expected, actual))
+    return results
+
+
+def _serialize_chunk(chunk: List[MessagePair]) -> List[_SerializedPair]:
+    return [(actual.DESCRIPTOR.full_name, actual.SerializePartialToString(),
+             expected.DESCRIPTOR.full_name,
+             expected.SerializePartialToString())
+            for actual, expected in chunk]
+
+
+def _compare_serialized_chunk(
+        chunk: List[_SerializedPair],
+        opts: ProtoComparisonOptions) -> List[compare.ProtoComparisonResult]:
+    parse = message_util.parse_message
+    return _compare_chunk([(parse(actual_type, actual_bytes),
+                            parse(expected_type, expected_bytes))
+                           for actual_type, actual_bytes, expected_type,
+                           expected_bytes in chunk], opts)
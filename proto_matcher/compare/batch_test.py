@@ -0,0 +1,124 @@
+import concurrent.futures
+import itertools
+import pickle
+import unittest
+
+from google.protobuf import text_format
+
+from proto_matcher.compare import batch
+from proto_matcher.compare import compare
+from proto_matcher.compare import memo
+from proto_matcher.compare import profile
+from proto_matcher.testdata import test_pb2
+
+_TEST_PROTO = """
+bars {
+    short_id: -123
+    name: "a bar"
+    notes: "hehe"
+}
+baz {
+    status: ERROR
+}
+mapping {
+    key: 5
+    value: "haha"
+}
+"""
+
+
+def _make_pairs(n):
+    pairs = []
+    for i in range(n):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        if i % 3 == 0:
+            actual.bars[0].size = i
+        if i % 5 == 0:
+            actual.mapping[i] = str(i)
+        pairs.append((actual, expected))
+    pairs.append((test_pb2.Bar(), test_pb2.Foo()))
+    return pairs
+
+
+class ProtoCompareManyTest(unittest.TestCase):
+
+    def assertSameAsProtoCompare(self, results, pairs, opts=None):
+        self.assertEqual(len(results), len(pairs))
+        for result, (actual, expected) in zip(results, pairs):
+            expected_result = compare.proto_compare(actual, expected, opts)
+            self.assertEqual(result.is_equal, expected_result.is_equal)
+            self.assertEqual(result.explanation, expected_result.explanation)
+
+    def test_serial(self):
+        pairs = _make_pairs(50)
+        self.assertSameAsProtoCompare(
+            batch.proto_compare_many(pairs, chunk_size=7), pairs)
+
+    def test_with_options(self):
+        pairs = _make_pairs(20)
+        opts = compare.ProtoComparisonOptions(
+            scope=compare.ProtoComparisonScope.PARTIAL)
+        self.assertSameAsProtoCompare(
+            batch.proto_compare_many(pairs, opts), pairs, opts)
+
+    def test_memo(self):
+        pairs = _make_pairs(20)
+        comparison_memo = memo.ComparisonMemo()
+        for _ in range(2):
+            self.assertSameAsProtoCompare(
+                batch.proto_compare_many(pairs, memo=comparison_memo), pairs)
+        self.assertGreater(len(comparison_memo), 0)
+
+    def test_stats_hook(self):
+        totals = profile.ComparisonStats()
+        profile.add_stats_hook(totals.merge)
+        try:
+            batch.proto_compare_many(_make_pairs(5))
+        finally:
+            profile.remove_stats_hook(totals.merge)
+        # The pair of different types is not compared by a differencer.
+        self.assertEqual(totals.comparisons, 5)
+
+    def test_thread_pool(self):
+        pairs = _make_pairs(50)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            results = batch.proto_compare_many(pairs,
+                                               executor=executor,
+                                               chunk_size=4)
+        self.assertSameAsProtoCompare(results, pairs)
+
+    def test_process_pool(self):
+        pairs = _make_pairs(50)
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=2) as executor:
+            results = batch.proto_compare_many(pairs,
+                                               executor=executor,
+                                               chunk_size=8)
+        self.assertSameAsProtoCompare(results, pairs)
+        self.assertEqual(results[3].differences[0].field_path,
+                         ('bars', 'size'))
+
+    def test_streaming(self):
+        pairs = itertools.cycle(_make_pairs(10))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            results = batch.iter_proto_compare_many(pairs,
+                                                    executor=executor,
+                                                    chunk_size=3,
+                                                    prefetch_chunks=2)
+            first_results = list(itertools.islice(results, 25))
+        self.assertEqual(len(first_results), 25)
+        self.assertSameAsProtoCompare(first_results[:11], _make_pairs(10))
+
+    def test_results_can_be_pickled(self):
+        (actual, expected), = _make_pairs(1)[:1]
+        result = compare.proto_compare(actual, expected)
+        restored = pickle.loads(pickle.dumps(result))
+        self.assertEqual(restored.is_equal, result.is_equal)
+        self.assertEqual(restored.explanation, result.explanation)
+        self.assertIs(restored.differences[0].field_desc,
+                      result.differences[0].field_desc)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+from typing import List, Optional, Sequence
+
+
+def max_matching(adjacency: Sequence[Sequence[int]],
+                 num_right: int) -> List[Optional[int]]:
+    """Finds a maximum matching in a bipartite graph.
+
+    |adjacency| lists, for each left vertex, the right vertices in
+    [0, num_right) it may be matched with. Returns, for each left vertex, its
+    matched right vertex or None.
+
+    Uses a greedy pass followed by augmenting paths (Kuhn's algorithm), which
+    is close to linear for the sparse graphs that bucketing produces.
+    """
+    left_match: List[Optional[int]] = [None] * len(adjacency)
+    right_match: List[Optional[int]] = [None] * num_right
+    for left, rights in enumerate(adjacency):
+        for right in rights:
+            if right_match[right] is None:
+                left_match[left] = right
+                right_match[right] = left
+                break
+    for left, rights in enumerate(adjacency):
+        if left_match[left] is None and rights:
+            _augment(left, adjacency, left_match, right_match)
+    return left_match
+
+
+def _augment(root: int, adjacency: Sequence[Sequence[int]],
+             left_match: List[Optional[int]],
+             right_match: List[Optional[int]]) -> bool:
+    # Iterative depth-first search for an augmenting path, so long paths
+    # don't hit the recursion limit.
+    visited = set()
+    path = [root]
+    rights_to_try = [iter(adjacency[root])]
+    chosen_rights: List[Optional[int]] = [None]
+    while path:
+        right = next((r for r in rights_to_try[-1] if r not in visited), None)
+        if right is None:
+            path.pop()
+            rights_to_try.pop()
+            chosen_rights.pop()
+            continue
+        visited.add(right)
+        chosen_rights[-1] = right
+        next_left = right_match[right]
+        if next_left is None:
+            for left, chosen_right in zip(path, chosen_rights):
+                left_match[left] = chosen_right
+                right_match[chosen_right] = left
+            return True
+        path.append(next_left)
+        rights_to_try.append(iter(adjacency[next_left]))
+        chosen_rights.append(None)
+    return False
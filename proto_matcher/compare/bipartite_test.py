@@ -0,0 +1,34 @@
+import unittest
+
+from proto_matcher.compare import bipartite
+
+
+class MaxMatchingTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(bipartite.max_matching([], 0), [])
+        self.assertEqual(bipartite.max_matching([[], []], 3), [None, None])
+
+    def test_perfect_matching(self):
+        self.assertEqual(bipartite.max_matching([[1], [0], [2]], 3),
+                         [1, 0, 2])
+
+    def test_augmenting_path(self):
+        # Greedily matching 0 -> 0 leaves 1 unmatched.
+        self.assertEqual(bipartite.max_matching([[0, 1], [0]], 2), [1, 0])
+
+    def test_long_augmenting_path(self):
+        n = 10000
+        adjacency = [[i, i + 1] for i in range(n - 1)] + [[0]]
+        matches = bipartite.max_matching(adjacency, n)
+        self.assertNotIn(None, matches)
+        self.assertEqual(len(set(matches)), n)
+
+    def test_maximum_not_perfect(self):
+        matches = bipartite.max_matching([[0], [0], [1]], 2)
+        self.assertEqual(matches.count(None), 1)
+        self.assertEqual(matches[2], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
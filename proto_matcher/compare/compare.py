@@ -1,58 +1,159 @@
 import collections
-import copy
+import concurrent.futures
 import dataclasses
 import enum
+import itertools
 import math
-import sys
-from typing import Any, Generic, Iterable, List, Mapping, Optional, Set, TypeVar, Tuple
+import time
+from typing import (Any, Counter, Generator, Generic, Iterable, List,
+                    Mapping, Optional, TypeVar, Tuple)
 
 from google.protobuf import descriptor
+from google.protobuf import descriptor_pool
 from google.protobuf import message
 
+from proto_matcher.compare import bipartite
+from proto_matcher.compare import fingerprint
+from proto_matcher.compare import ignore
 from proto_matcher.compare import iter_util
+from proto_matcher.compare import message_util
+from proto_matcher.compare import plan
+from proto_matcher.compare import profile
+from proto_matcher.compare import vectorized
+from proto_matcher.compare.memo import ComparisonMemo
+from proto_matcher.compare.options import ProtoComparisonOptions
+from proto_matcher.compare.options import ProtoComparisonScope
+from proto_matcher.compare.options import ProtoFloatComparison
+from proto_matcher.compare.options import RepeatedFieldComparison
 
 _FieldDescriptor = descriptor.FieldDescriptor
-_FLT_EPSILON = 1.19209e-07
-_DBL_EPSILON = sys.float_info.epsilon
+_FieldKind = plan.FieldKind
 
+# Repeated message fields with fewer elements on either side are compared in
+# the calling thread even when an executor is given, as handing elements to
+# workers costs more than it saves.
+_PARALLEL_MIN_ELEMENTS = 10000
+# Elements per task handed to an executor.
+_PARALLEL_SHARD_SIZE = 2500
 
-class RepeatedFieldComparison(enum.Enum):
-    AS_LIST = enum.auto()
-    AS_SET = enum.auto()
 
+class ProtoComparisonEngine(enum.Enum):
+    # Recurses into nested messages.
+    RECURSIVE = enum.auto()
+    # Walks nested messages with an explicit stack; see
+    # IterativeMessageDifferencer.
+    ITERATIVE = enum.auto()
 
-class ProtoComparisonScope(enum.Enum):
-    FULL = enum.auto()
-    PARTIAL = enum.auto()
 
-
-class ProtoFloatComparison(enum.Enum):
-    EXACT = enum.auto()
-    APPROXIMATE = enum.auto()
+class DifferenceKind(enum.Enum):
+    ADDED = enum.auto()
+    DELETED = enum.auto()
+    MODIFIED = enum.auto()
 
 
 @dataclasses.dataclass
-class ProtoComparisonOptions:
-    repeated_field_comp: RepeatedFieldComparison = RepeatedFieldComparison.AS_LIST
-    scope: ProtoComparisonScope = ProtoComparisonScope.FULL
-    ignore_field_paths: Optional[Set[Tuple[str]]] = None
-    treating_nan_as_equal: bool = False
-    float_comp: ProtoFloatComparison = ProtoFloatComparison.EXACT
-    # |float_margin| and |float_fraction| are only used when
-    # float_comp = APPROXIMATE.
-    float_margin: Optional[float] = None
-    float_fraction: Optional[float] = None
+class ProtoDifference:
+    field_path: Tuple[str, ...]
+    kind: DifferenceKind
+    # References to the differing values; None on the side a value is missing.
+    expected: Any
+    actual: Any
+    field_desc: _FieldDescriptor = dataclasses.field(repr=False)
+    # Parallel to |field_path|: the index or map key of the element of each
+    # field on the path, or None for singular fields.
+    field_keys: Tuple[Any, ...] = ()
+
+    def __reduce__(self):
+        # Field descriptors can't be pickled, e.g. to return results from a
+        # process pool, so they are looked up again by name.
+        return (_restore_difference,
+                (self.field_path, self.kind, self.expected, self.actual,
+                 self.field_desc.full_name, self.field_keys))
+
+
+def _restore_difference(field_path: Tuple[str, ...],
+                        kind: DifferenceKind,
+                        expected: Any,
+                        actual: Any,
+                        field_full_name: str,
+                        field_keys: Tuple[Any, ...] = ()) -> ProtoDifference:
+    field_desc = descriptor_pool.Default().FindFieldByName(field_full_name)
+    return ProtoDifference(field_path=field_path,
+                           kind=kind,
+                           expected=expected,
+                           actual=actual,
+                           field_desc=field_desc,
+                           field_keys=field_keys)
 
 
-@dataclasses.dataclass
 class ProtoComparisonResult:
-    is_equal: bool = True
-    explanation: str = ''
-
-
-def proto_compare(actual: message.Message,
-                  expected: message.Message,
-                  opts: ProtoComparisonOptions = None) -> ProtoComparisonResult:
+    """Outcome of a comparison.
+
+    Differences are kept as ProtoDifference records and only rendered into
+    text when |explanation| is accessed. Differences past the max_differences
+    or max_explanation_bytes budget of the options are only counted in
+    |omitted_differences|, by top-level field name.
+    """
+
+    def __init__(self,
+                 is_equal: bool = True,
+                 differences: Optional[List[ProtoDifference]] = None,
+                 explanation: Optional[str] = None,
+                 stats: Optional[profile.ComparisonStats] = None,
+                 omitted_differences: Optional[Counter[str]] = None,
+                 max_explanation_bytes: Optional[int] = None):
+        self.is_equal = is_equal
+        self.differences = differences if differences is not None else []
+        self._explanation = explanation
+        # Only set for instrumented comparisons; see proto_compare.
+        self.stats = stats
+        self.omitted_differences = (omitted_differences if omitted_differences
+                                    is not None else collections.Counter())
+        self._max_explanation_bytes = max_explanation_bytes
+
+    @property
+    def explanation(self) -> str:
+        if self._explanation is None:
+            self._explanation = _explain_diffs(self.differences,
+                                               self.omitted_differences,
+                                               self._max_explanation_bytes)
+        return self._explanation
+
+    def __eq__(self, other: Any) -> bool:
+        # Stats describe how a comparison ran, not its outcome.
+        if not isinstance(other, ProtoComparisonResult):
+            return NotImplemented
+        return (self.is_equal == other.is_equal and
+                self.differences == other.differences and
+                self.omitted_differences == other.omitted_differences and
+                self.explanation == other.explanation)
+
+    def __repr__(self) -> str:
+        return (f'ProtoComparisonResult(is_equal={self.is_equal}, '
+                f'differences={self.differences!r})')
+
+
+def proto_compare(
+        actual: message.Message,
+        expected: message.Message,
+        opts: ProtoComparisonOptions = None,
+        *,
+        executor: Optional[concurrent.futures.Executor] = None,
+        engine: ProtoComparisonEngine = ProtoComparisonEngine.RECURSIVE,
+        collect_stats: bool = False,
+        memo: Optional[ComparisonMemo] = None) -> ProtoComparisonResult:
+    """Compares |actual| against |expected|.
+
+    If |executor| is given, large repeated message fields are split into
+    shards of elements that are compared on it; see MessageDifferencer.
+
+    With a |memo|, pairs of messages already compared in it are not walked
+    again; see ComparisonMemo.
+
+    With |collect_stats|, or while a stats hook is registered, the comparison
+    is instrumented and the result holds its ComparisonStats; see
+    ProfilingMessageDifferencer. Only the RECURSIVE engine is instrumented.
+    """
     if not proto_comparable(actual, expected):
         return ProtoComparisonResult(
             is_equal=False,
@@ -64,7 +165,12 @@ def proto_compare(actual: message.Message,
     if not opts:
         opts = ProtoComparisonOptions()
 
-    differencer = MessageDifferencer(opts, actual.DESCRIPTOR)
+    differencer = make_differencer(engine,
+                                   opts,
+                                   actual.DESCRIPTOR,
+                                   executor=executor,
+                                   memo=memo,
+                                   collect_stats=collect_stats)
     # It's important for 'expected' to be the first argument here, as
     # compare() is not symmetric.  When we do a partial comparison,
     # only fields present in the first argument of compare() are
@@ -72,6 +178,34 @@ def proto_compare(actual: message.Message,
     return differencer.compare(expected, actual)
 
 
+def proto_equal(
+        actual: message.Message,
+        expected: message.Message,
+        opts: ProtoComparisonOptions = None,
+        *,
+        executor: Optional[concurrent.futures.Executor] = None,
+        engine: ProtoComparisonEngine = ProtoComparisonEngine.RECURSIVE,
+        memo: Optional[ComparisonMemo] = None) -> bool:
+    """Like proto_compare, but only tells whether the messages are equal.
+
+    Stops at the first difference and never builds an explanation, which makes
+    it much cheaper than proto_compare for messages that differ.
+    """
+    if not proto_comparable(actual, expected):
+        return False
+
+    if not opts:
+        opts = ProtoComparisonOptions()
+
+    differencer = make_differencer(engine,
+                                   opts,
+                                   actual.DESCRIPTOR,
+                                   explain=False,
+                                   executor=executor,
+                                   memo=memo)
+    return differencer.compare(expected, actual).is_equal
+
+
 def proto_comparable(actual: message.Message,
                      expected: message.Message) -> bool:
     return actual.DESCRIPTOR == expected.DESCRIPTOR
@@ -79,24 +213,111 @@ def proto_comparable(actual: message.Message,
 
 T = TypeVar("T")
 
+# (key, expected value, actual value) of a map entry; a value is None on the
+# side the key is missing from.
+_MapEntry = Tuple[Any, Any, Any]
+
+
+class FieldPath():
+    """A field path, as a node linked to the path of its parent message.
+
+    Extending a path costs one node whatever its depth. Paths are only turned
+    into tuples when a difference is recorded. The empty path is None.
+    """
+    __slots__ = ('parent', 'name', 'key')
+
+    def __init__(self,
+                 parent: Optional['FieldPath'],
+                 name: str,
+                 key: Any = None):
+        self.parent = parent
+        self.name = name
+        # Index or map key of an element of the field, if any.
+        self.key = key
+
+    @classmethod
+    def from_names(cls, names: Iterable[str]) -> Optional['FieldPath']:
+        path = None
+        for name in names:
+            path = cls(path, name)
+        return path
+
+    def element(self, key: Any) -> 'FieldPath':
+        """Returns the path of the element at |key| of this field."""
+        return FieldPath(self.parent, self.name, key)
+
+    def root_name(self) -> str:
+        """Returns the name of the top-level field of the path."""
+        path = self
+        while path.parent is not None:
+            path = path.parent
+        return path.name
+
+    def materialize(self) -> Tuple[Tuple[str, ...], Tuple[Any, ...]]:
+        """Returns the (names, keys) of the fields on the path, root first."""
+        names = []
+        keys = []
+        path = self
+        while path is not None:
+            names.append(path.name)
+            keys.append(path.key)
+            path = path.parent
+        return tuple(reversed(names)), tuple(reversed(keys))
+
 
 @dataclasses.dataclass
 class ProtoFieldComparisonArgs(Generic[T]):
     expected: T
     actual: T
     field_desc: _FieldDescriptor
-    field_path: Tuple[str]
+    field_path: Optional[FieldPath]
 
 
 class MessageDifferencer():
-
-    def __init__(self, opts: ProtoComparisonOptions,
-                 desc: descriptor.Descriptor):
+    """Compares messages of one type under fixed options.
+
+    With an |executor|, repeated message fields compared AS_LIST whose both
+    sides have at least |parallel_min_elements| elements are split by index
+    range into shards that are compared on the executor, and the differences
+    of the shards are merged back in index order. Results are the same as
+    without an executor. Pure-Python comparisons hold the GIL, so a
+    ProcessPoolExecutor is usually what pays off; elements are then sent to
+    workers serialized, and their type must be in the default descriptor pool
+    of the workers. Differences found by workers refer to copies of the
+    elements.
+
+    A message is equal to itself without a walk, unless it may hold a NaN
+    that is not treated as equal. With a |memo|, outcomes of comparing pairs
+    of messages are recorded in it, and pairs recorded before are settled
+    without a walk; an unequal pair is still walked when explaining, to
+    record its differences. Elements compared on an executor skip the memo.
+
+    A |msg_plan| already compiled for |desc| is used instead of compiling
+    one from |opts|.
+    """
+
+    def __init__(self,
+                 opts: ProtoComparisonOptions,
+                 desc: descriptor.Descriptor,
+                 explain: bool = True,
+                 executor: Optional[concurrent.futures.Executor] = None,
+                 parallel_min_elements: int = _PARALLEL_MIN_ELEMENTS,
+                 memo: Optional[ComparisonMemo] = None,
+                 msg_plan: Optional[plan.MessagePlan] = None):
         self._opts = opts
-        if not self._opts.ignore_field_paths:
-            self._opts.ignore_field_paths = set()
-        # should expand ignored field paths using desc...
         self._desc = desc
+        self._plan = msg_plan or plan.get_message_plan(desc, opts)
+        # Without |explain|, comparison stops at the first difference and no
+        # difference is ever recorded.
+        self._explain = explain
+        self._differences: Optional[List[ProtoDifference]] = None
+        # Differences past the max_differences budget, by top-level field.
+        self._omitted_differences: Optional[Counter[str]] = None
+        # UTF-8 size of the explanation of the recorded differences.
+        self._explanation_bytes = 0
+        self._executor = executor
+        self._parallel_min_elements = parallel_min_elements
+        self._memo = memo
 
     def compare(
         self,
@@ -104,173 +325,929 @@ class MessageDifferencer():
         actual: message.Message,
         field_path: Tuple[str] = ()
     ) -> ProtoComparisonResult:
-        return _combine_results([
-            self._compare(
+        if _natively_equal(expected, actual, self._opts):
+            return ProtoComparisonResult()
+
+        self._start_recording()
+        is_equal = self._compare_memoized(
+            ProtoFieldComparisonArgs(
+                expected=expected,
+                actual=actual,
+                field_desc=None,
+                field_path=FieldPath.from_names(field_path)), self._plan)
+        return self._make_result(is_equal)
+
+    def _compare_elements(self, expected_values: List[message.Message],
+                          actual_values: List[message.Message],
+                          field_path: FieldPath, start: int,
+                          msg_plan: plan.MessagePlan) -> ProtoComparisonResult:
+        """Compares elements pairwise, as a shard of a repeated field that
+        starts at index |start|.
+        """
+        self._start_recording()
+        is_equal = self._all_equal(
+            self._compare_messages(
                 ProtoFieldComparisonArgs(expected=expected,
                                          actual=actual,
                                          field_desc=None,
-                                         field_path=field_path))
-        ])
-
-    def _compare(
-        self, args: ProtoFieldComparisonArgs[message.Message]
-    ) -> ProtoComparisonResult:
-        return _combine_results([
-            self._compare_field(
-                ProtoFieldComparisonArgs(expected=args.expected,
-                                         actual=args.actual,
-                                         field_desc=field_desc,
-                                         field_path=args.field_path))
-            for field_desc in args.actual.DESCRIPTOR.fields
-        ])
-
-    def _compare_field(
-            self, args: ProtoFieldComparisonArgs[Any]) -> ProtoComparisonResult:
-        cmp_args = copy.copy(args)
-        field_name = cmp_args.field_desc.name
-        cmp_args.field_path = cmp_args.field_path + (field_name,)
-        if cmp_args.field_path in self._opts.ignore_field_paths:
-            return _equality_result()
-
-        cmp_args.expected = getattr(cmp_args.expected, field_name, None)
-        cmp_args.actual = getattr(cmp_args.actual, field_name, None)
-
-        # Repeated field
-        if cmp_args.field_desc.label == _FieldDescriptor.LABEL_REPEATED:
-            # Map field
-            if isinstance(cmp_args.expected, collections.abc.Mapping):
-                return self._compare_map(cmp_args)
-            return self._compare_repeated_field(cmp_args)
-
-        # Singular field
-        if (self._opts.scope == ProtoComparisonScope.PARTIAL and
-                not _is_field_set(cmp_args.expected, cmp_args.field_desc)):
-            return _equality_result()
-
-        return self._compare_value(cmp_args)
+                                         field_path=field_path.element(i)),
+                msg_plan) for i, expected, actual in zip(
+                    itertools.count(start), expected_values, actual_values))
+        return self._make_result(is_equal)
+
+    def _start_recording(self):
+        self._differences = [] if self._explain else None
+        self._omitted_differences = collections.Counter()
+        self._explanation_bytes = 0
+
+    def _make_result(self, is_equal: bool) -> ProtoComparisonResult:
+        differences, self._differences = self._differences, None
+        omitted, self._omitted_differences = self._omitted_differences, None
+        return ProtoComparisonResult(
+            is_equal=is_equal,
+            differences=differences,
+            omitted_differences=omitted,
+            max_explanation_bytes=self._opts.max_explanation_bytes)
+
+    def _compare_memoized(self,
+                          args: ProtoFieldComparisonArgs[message.Message],
+                          msg_plan: plan.MessagePlan) -> bool:
+        if self._memo is None:
+            return self._compare(args, msg_plan)
+        is_equal = self._memo.get(args.expected, args.actual, msg_plan)
+        if is_equal is None or (not is_equal and self._explain):
+            is_equal = self._compare(args, msg_plan)
+            self._memo.put(args.expected, args.actual, msg_plan, is_equal)
+        return is_equal
+
+    def _compare(self, args: ProtoFieldComparisonArgs[message.Message],
+                 msg_plan: plan.MessagePlan) -> bool:
+        return self._all_equal(
+            self._compare_field(args, field_plan)
+            for field_plan in self._fields_to_compare(args.expected,
+                                                      args.actual, msg_plan))
+
+    def _fields_to_compare(self, expected: message.Message,
+                           actual: message.Message,
+                           msg_plan: plan.MessagePlan) -> List[plan.FieldPlan]:
+        # Fields unset on both sides are equal, so only populated fields are
+        # visited. In PARTIAL scope, only fields populated in |expected| count.
+        field_numbers = {
+            field_desc.number for field_desc, _ in expected.ListFields()
+        }
+        if self._opts.scope != ProtoComparisonScope.PARTIAL:
+            field_numbers.update(
+                field_desc.number for field_desc, _ in actual.ListFields())
+        fields_by_number = msg_plan.fields_by_number
+        # Extensions are not part of the plan and are not compared.
+        return [
+            fields_by_number[number]
+            for number in sorted(field_numbers)
+            if number in fields_by_number
+        ]
+
+    def _compare_field(self, args: ProtoFieldComparisonArgs[message.Message],
+                       field_plan: plan.FieldPlan) -> bool:
+        if field_plan.is_ignored:
+            return True
+
+        cmp_args = self._field_args(args, field_plan)
+        if field_plan.is_map:
+            return self._compare_map(cmp_args, field_plan)
+        if field_plan.is_repeated:
+            return self._compare_repeated_field(cmp_args, field_plan)
+
+        # Singular field, which is only missing on one side if it tracks
+        # presence.
+        if cmp_args.expected is None or cmp_args.actual is None:
+            return self._add_difference(cmp_args)
+        return self._compare_value(cmp_args, field_plan)
+
+    def _field_args(
+            self, args: ProtoFieldComparisonArgs[message.Message],
+            field_plan: plan.FieldPlan) -> ProtoFieldComparisonArgs[Any]:
+        return ProtoFieldComparisonArgs(
+            expected=_get_field(args.expected, field_plan),
+            actual=_get_field(args.actual, field_plan),
+            field_desc=field_plan.desc,
+            field_path=FieldPath(args.field_path, field_plan.name))
 
     def _compare_repeated_field(
-            self, cmp_args: ProtoFieldComparisonArgs[Iterable]
-    ) -> ProtoComparisonResult:
-        as_set_key = lambda x: str(x)
+            self, cmp_args: ProtoFieldComparisonArgs[Iterable],
+            field_plan: plan.FieldPlan) -> bool:
         if self._opts.repeated_field_comp == RepeatedFieldComparison.AS_SET:
-            cmp_args.expected.sort(key=as_set_key)
-            cmp_args.actual.sort(key=as_set_key)
-        return _combine_results([
+            return self._compare_repeated_field_as_set(cmp_args, field_plan)
+        if field_plan.element_plans:
+            return self._compare_repeated_field_by_element(cmp_args, field_plan)
+        if (field_plan.kind == _FieldKind.FLOAT and
+                vectorized.can_compare_floats(cmp_args.expected,
+                                              cmp_args.actual)):
+            return self._compare_repeated_floats_vectorized(
+                cmp_args, field_plan)
+        if self._compare_in_parallel(cmp_args, field_plan):
+            return self._compare_repeated_messages_in_parallel(
+                cmp_args, field_plan)
+        return self._all_equal(
             self._compare_value(
+                ProtoFieldComparisonArgs(
+                    expected=expected,
+                    actual=actual,
+                    field_desc=cmp_args.field_desc,
+                    field_path=cmp_args.field_path.element(i)), field_plan)
+            for i, (expected, actual) in enumerate(
+                iter_util.zip_pairs(cmp_args.expected, cmp_args.actual)))
+
+    def _compare_in_parallel(self, cmp_args: ProtoFieldComparisonArgs[Iterable],
+                             field_plan: plan.FieldPlan) -> bool:
+        return (self._executor is not None and
+                field_plan.kind == _FieldKind.MESSAGE and
+                min(len(cmp_args.expected), len(cmp_args.actual)) >=
+                self._parallel_min_elements)
+
+    def _compare_repeated_field_by_element(
+            self, cmp_args: ProtoFieldComparisonArgs[Iterable],
+            field_plan: plan.FieldPlan) -> bool:
+        # Some elements are ignored, or have their own ignored paths.
+        return self._all_equal(
+            element_plan is None or self._compare_value(
+                ProtoFieldComparisonArgs(
+                    expected=expected,
+                    actual=actual,
+                    field_desc=cmp_args.field_desc,
+                    field_path=cmp_args.field_path.element(i)), element_plan)
+            for i, (expected, actual) in enumerate(
+                iter_util.zip_pairs(cmp_args.expected, cmp_args.actual))
+            for element_plan in (field_plan.plan_for_element(i),))
+
+    def _compare_repeated_floats_vectorized(
+            self, cmp_args: ProtoFieldComparisonArgs[Iterable],
+            field_plan: plan.FieldPlan) -> bool:
+        expected_size = len(cmp_args.expected)
+        actual_size = len(cmp_args.actual)
+        if expected_size != actual_size and not self._explain:
+            return False
+        mismatched_indices = vectorized.mismatched_float_indices(
+            cmp_args.expected, cmp_args.actual, field_plan)
+        if not self._explain:
+            return not mismatched_indices
+        # Only offending elements are visited, plus any extra ones.
+        extra_indices = range(min(expected_size, actual_size),
+                              max(expected_size, actual_size))
+        for i in itertools.chain(mismatched_indices, extra_indices):
+            self._add_difference(
+                ProtoFieldComparisonArgs(
+                    expected=(cmp_args.expected[i]
+                              if i < expected_size else None),
+                    actual=cmp_args.actual[i] if i < actual_size else None,
+                    field_desc=cmp_args.field_desc,
+                    field_path=cmp_args.field_path.element(i)))
+        return not mismatched_indices and expected_size == actual_size
+
+    def _compare_repeated_messages_in_parallel(
+            self, cmp_args: ProtoFieldComparisonArgs[Iterable],
+            field_plan: plan.FieldPlan) -> bool:
+        expected_size = len(cmp_args.expected)
+        actual_size = len(cmp_args.actual)
+        if expected_size != actual_size and not self._explain:
+            return False
+        size = min(expected_size, actual_size)
+        futures = [
+            self._submit_shard(cmp_args, field_plan, start,
+                               min(start + _PARALLEL_SHARD_SIZE, size))
+            for start in range(0, size, _PARALLEL_SHARD_SIZE)
+        ]
+        is_equal = True
+        try:
+            for future in futures:
+                result = future.result()
+                if result.is_equal:
+                    continue
+                is_equal = False
+                if not self._explain:
+                    return False
+                for diff in result.differences:
+                    self._record_difference(diff, diff.field_path[0])
+                self._omitted_differences.update(result.omitted_differences)
+        finally:
+            # Shards not started yet are not needed after a failure.
+            for future in futures:
+                future.cancel()
+        for i in range(size, max(expected_size, actual_size)):
+            self._add_difference(
+                ProtoFieldComparisonArgs(
+                    expected=(cmp_args.expected[i]
+                              if i < expected_size else None),
+                    actual=cmp_args.actual[i] if i < actual_size else None,
+                    field_desc=cmp_args.field_desc,
+                    field_path=cmp_args.field_path.element(i)))
+        return is_equal and expected_size == actual_size
+
+    def _submit_shard(self, cmp_args: ProtoFieldComparisonArgs[Iterable],
+                      field_plan: plan.FieldPlan, start: int,
+                      stop: int) -> concurrent.futures.Future:
+        expected_values = cmp_args.expected[start:stop]
+        actual_values = cmp_args.actual[start:stop]
+        if isinstance(self._executor, concurrent.futures.ProcessPoolExecutor):
+            return self._executor.submit(
+                _compare_serialized_shard, self._opts, self._explain,
+                field_plan.desc.message_type.full_name,
+                field_plan.ignore_trie, cmp_args.field_path, start,
+                [value.SerializePartialToString() for value in expected_values],
+                [value.SerializePartialToString() for value in actual_values])
+        return self._executor.submit(_compare_shard, self._opts, self._explain,
+                                     field_plan.message_plan,
+                                     cmp_args.field_path, start,
+                                     expected_values, actual_values)
+
+    def _compare_repeated_field_as_set(
+            self, cmp_args: ProtoFieldComparisonArgs[Iterable],
+            field_plan: plan.FieldPlan) -> bool:
+        approximate = (
+            self._opts.float_comp == ProtoFloatComparison.APPROXIMATE and
+            _may_hold_floats(field_plan))
+        # Elements with different keys can still be equal under partial or
+        # approximate comparison.
+        keys_are_exact = not (
+            self._opts.scope == ProtoComparisonScope.PARTIAL or approximate)
+
+        # Indices of elements without a partner, on each side.
+        if approximate:
+            # Approximate equality is not transitive, so pairing up elements
+            # with equal keys first could take the only partner of another
+            # element. All elements are assigned at once instead.
+            unmatched_expected = list(range(len(cmp_args.expected)))
+            unmatched_actual = list(range(len(cmp_args.actual)))
+        else:
+            # Pair up elements with equal keys first, as multisets. Neither
+            # field is reordered.
+            actual_indices_by_key = collections.defaultdict(list)
+            for i, actual in enumerate(cmp_args.actual):
+                actual_indices_by_key[fingerprint.element_key(
+                    actual, field_plan)].append(i)
+            unmatched_expected = []
+            for i, expected in enumerate(cmp_args.expected):
+                actual_indices = actual_indices_by_key.get(
+                    fingerprint.element_key(expected, field_plan))
+                if actual_indices:
+                    actual_indices.pop()
+                else:
+                    unmatched_expected.append(i)
+                    if keys_are_exact and not self._explain:
+                        return False
+            unmatched_actual = sorted(
+                i for indices in actual_indices_by_key.values()
+                for i in indices)
+        if not unmatched_expected and not unmatched_actual:
+            return True
+
+        if not keys_are_exact:
+            unmatched_expected, unmatched_actual = self._pair_inexact(
+                unmatched_expected, unmatched_actual, cmp_args, field_plan)
+
+        for i in unmatched_expected:
+            self._add_difference(
+                ProtoFieldComparisonArgs(
+                    expected=cmp_args.expected[i],
+                    actual=None,
+                    field_desc=cmp_args.field_desc,
+                    field_path=cmp_args.field_path.element(i)))
+        for i in unmatched_actual:
+            self._add_difference(
+                ProtoFieldComparisonArgs(
+                    expected=None,
+                    actual=cmp_args.actual[i],
+                    field_desc=cmp_args.field_desc,
+                    field_path=cmp_args.field_path.element(i)))
+        return not unmatched_expected and not unmatched_actual
+
+    def _pair_inexact(
+        self, expected_indices: List[int], actual_indices: List[int],
+        cmp_args: ProtoFieldComparisonArgs, field_plan: plan.FieldPlan
+    ) -> Tuple[List[int], List[int]]:
+        """Pairs up elements that are equal even though their keys differ.
+
+        Takes and returns the indices of elements without a partner.
+        """
+        expected_values = [cmp_args.expected[i] for i in expected_indices]
+        actual_values = [cmp_args.actual[i] for i in actual_indices]
+        if (self._opts.scope == ProtoComparisonScope.PARTIAL and
+                field_plan.kind == _FieldKind.MESSAGE):
+            # Any actual element may have what a partial expected one needs.
+            candidates = [range(len(actual_values))] * len(expected_values)
+        else:
+            candidates = _approximate_candidates(expected_values,
+                                                 actual_values, field_plan)
+        adjacency = []
+        for expected_index, expected, expected_candidates in zip(
+                expected_indices, expected_values, candidates):
+            adjacency.append([
+                i for i in expected_candidates if self._values_equal(
+                    expected, actual_values[i], cmp_args, field_plan)
+            ])
+            if not adjacency[-1] and not self._explain:
+                return [expected_index], []
+        matches = bipartite.max_matching(adjacency, len(actual_values))
+        matched_actual = {i for i in matches if i is not None}
+        return ([
+            expected_index
+            for expected_index, i in zip(expected_indices, matches)
+            if i is None
+        ], [
+            actual_index for i, actual_index in enumerate(actual_indices)
+            if i not in matched_actual
+        ])
+
+    def _values_equal(self, expected: Any, actual: Any,
+                      cmp_args: ProtoFieldComparisonArgs,
+                      field_plan: plan.FieldPlan) -> bool:
+        """Compares two values without recording any difference."""
+        explain, self._explain = self._explain, False
+        try:
+            return self._compare_value(
                 ProtoFieldComparisonArgs(expected=expected,
                                          actual=actual,
                                          field_desc=cmp_args.field_desc,
-                                         field_path=cmp_args.field_path))
-            for expected, actual in iter_util.zip_pairs(cmp_args.expected,
-                                                        cmp_args.actual)
-        ])
-
-    def _compare_map(
-            self, cmp_args: ProtoFieldComparisonArgs[Mapping]
-    ) -> ProtoComparisonResult:
-        desc = cmp_args.expected.GetEntryClass().DESCRIPTOR
-        key_desc = desc.fields_by_name['key']
-        value_desc = desc.fields_by_name['value']
-
-        return _combine_results([
-            _combine_results([
-                self._compare_value(
-                    ProtoFieldComparisonArgs(expected=expected_kv and
-                                             expected_kv[0],
-                                             actual=actual_kv and actual_kv[0],
-                                             field_desc=key_desc,
-                                             field_path=cmp_args.field_path)),
-                self._compare_value(
-                    ProtoFieldComparisonArgs(expected=expected_kv and
-                                             expected_kv[1],
-                                             actual=actual_kv and actual_kv[1],
-                                             field_desc=value_desc,
-                                             field_path=cmp_args.field_path))
-            ]) for expected_kv, actual_kv in iter_util.zip_pairs(
-                cmp_args.expected.items(),
-                cmp_args.actual.items(),
-                key=lambda kv: kv[0])
-        ])
-
-    def _compare_value(self, cmp_args: ProtoFieldComparisonArgs[Any]):
-        if _is_message(cmp_args.field_desc):
-            if cmp_args.expected and cmp_args.actual:
-                return self._compare(cmp_args)
-            return _inequality_result(cmp_args)
-        if _is_float(cmp_args.field_desc):
-            return self._compare_float(cmp_args)
-        return _equality_result() if cmp_args.expected == cmp_args.actual \
-            else _inequality_result(cmp_args)
-
-    def _compare_float(
-            self, cmp_args: ProtoFieldComparisonArgs) -> ProtoComparisonResult:
+                                         field_path=cmp_args.field_path),
+                field_plan)
+        finally:
+            self._explain = explain
+
+    def _compare_map(self, cmp_args: ProtoFieldComparisonArgs[Mapping],
+                     field_plan: plan.FieldPlan) -> bool:
+        entries = self._join_map(cmp_args, field_plan)
+        if entries is None:
+            return False
+        return self._all_equal(
+            self._compare_map_entry(entry, cmp_args, field_plan)
+            for entry in entries)
+
+    def _join_map(self, cmp_args: ProtoFieldComparisonArgs[Mapping],
+                  field_plan: plan.FieldPlan) -> Optional[List[_MapEntry]]:
+        """Hash-joins two maps on their keys.
+
+        Returns the entries left to compare, sorted by key: those with a key
+        on one side only, and those with values unequal by ==. Without an
+        explanation, returns None as soon as a key is on one side only. In
+        PARTIAL scope, keys only in |actual| don't count.
+        """
+        expected_map = cmp_args.expected
+        actual_map = cmp_args.actual
+        values_are_messages = field_plan.map_value.kind == _FieldKind.MESSAGE
+        entries = []
+        matched_keys = 0
+        for key, expected_value in expected_map.items():
+            actual_value = actual_map.get(key)
+            if actual_value is None:
+                if (not self._explain and
+                        field_plan.plan_for_element(key) is not None):
+                    return None
+            else:
+                matched_keys += 1
+                # Values equal by == are equal under any options.
+                if (_natively_equal(expected_value, actual_value, self._opts)
+                        if values_are_messages else
+                        expected_value == actual_value):
+                    continue
+            entries.append((key, expected_value, actual_value))
+        if (self._opts.scope != ProtoComparisonScope.PARTIAL and
+                len(actual_map) > matched_keys):
+            for key, actual_value in actual_map.items():
+                if key in expected_map:
+                    continue
+                if (not self._explain and
+                        field_plan.plan_for_element(key) is not None):
+                    return None
+                entries.append((key, None, actual_value))
+        # Usually only a few entries are left, so sorting them is cheap.
+        entries.sort(key=lambda entry: entry[0])
+        return entries
+
+    def _compare_map_entry(self, entry: _MapEntry,
+                           cmp_args: ProtoFieldComparisonArgs[Mapping],
+                           field_plan: plan.FieldPlan) -> bool:
+        key, expected_value, actual_value = entry
+        value_plan = field_plan.plan_for_element(key)
+        if value_plan is None:
+            return True
+        key_args, value_args = _map_entry_args(entry, cmp_args, field_plan,
+                                               value_plan)
+        return self._all_equal(
+            self._compare_value(args, entry_plan)
+            for args, entry_plan in ((key_args, field_plan.map_key),
+                                     (value_args, value_plan)))
+
+    def _compare_value(self, cmp_args: ProtoFieldComparisonArgs[Any],
+                       field_plan: plan.FieldPlan) -> bool:
+        if cmp_args.expected is None or cmp_args.actual is None:
+            return self._add_difference(cmp_args)
+        if field_plan.kind == _FieldKind.MESSAGE:
+            return self._compare_messages(cmp_args, field_plan.message_plan)
+        if field_plan.kind == _FieldKind.FLOAT:
+            return self._compare_float(cmp_args, field_plan)
+        return cmp_args.expected == cmp_args.actual or self._add_difference(
+            cmp_args)
+
+    def _compare_messages(self,
+                          cmp_args: ProtoFieldComparisonArgs[message.Message],
+                          msg_plan: plan.MessagePlan) -> bool:
+        if _identical(cmp_args.expected, cmp_args.actual, self._opts):
+            return True
+        if (not msg_plan.options_affect_subtree and
+                _natively_equal(cmp_args.expected, cmp_args.actual,
+                                self._opts)):
+            return True
+        return self._compare_memoized(cmp_args, msg_plan)
+
+    def _compare_float(self, cmp_args: ProtoFieldComparisonArgs,
+                       field_plan: plan.FieldPlan) -> bool:
         if cmp_args.expected == cmp_args.actual:
-            return _equality_result()
-        if (self._opts.treating_nan_as_equal and math.isnan(expected) and
-                math.isnan(actual)):
-            return _equality_result()
+            return True
+        if (self._opts.treating_nan_as_equal and
+                math.isnan(cmp_args.expected) and math.isnan(cmp_args.actual)):
+            return True
 
         if self._opts.float_comp == ProtoFloatComparison.EXACT:
-            return _inequality_result(cmp_args)
+            return self._add_difference(cmp_args)
 
         # float_comp == APPROXIMATE
-        fraction = self._opts.float_fraction or 0.0
-        margin = self._opts.float_margin or _get_float_comparison_epsilon(
-            cmp_args.field_desc)
         is_equal = _within_fraction_or_margin(cmp_args.expected,
-                                              cmp_args.actual, fraction, margin)
-        return _equality_result() if is_equal else _inequality_result(cmp_args)
-
-
-def _combine_results(
-        results: List[ProtoComparisonResult]) -> ProtoComparisonResult:
-    return ProtoComparisonResult(
-        is_equal=all([res.is_equal for res in results]),
-        explanation='\n'.join(
-            [res.explanation for res in results if res.explanation]),
-    )
-
+                                              cmp_args.actual,
+                                              field_plan.float_fraction,
+                                              field_plan.float_margin)
+        return is_equal or self._add_difference(cmp_args)
+
+    def _all_equal(self, results: Iterable[bool]) -> bool:
+        if not self._explain:
+            # all() stops pulling from |results| at the first difference.
+            return all(results)
+        return all([res for res in results])
+
+    def _add_difference(self, cmp_args: ProtoFieldComparisonArgs) -> bool:
+        if self._explain:
+            root_name = (cmp_args.field_path.root_name()
+                         if cmp_args.field_path else '')
+            if self._within_budget():
+                self._record_difference(_make_difference(cmp_args), root_name)
+            else:
+                # Past the budget, differences are only counted, which keeps
+                # them from being materialized and formatted.
+                self._omitted_differences[root_name] += 1
+        return False
 
-def _is_message(field_desc: _FieldDescriptor) -> bool:
-    return field_desc.cpp_type == _FieldDescriptor.CPPTYPE_MESSAGE
+    def _record_difference(self, diff: ProtoDifference, root_name: str):
+        if self._within_budget() and self._fits_explanation(diff):
+            self._differences.append(diff)
+        else:
+            self._omitted_differences[root_name] += 1
+
+    def _within_budget(self) -> bool:
+        max_bytes = self._opts.max_explanation_bytes
+        return ((self._opts.max_differences is None or
+                 len(self._differences) < self._opts.max_differences) and
+                (max_bytes is None or self._explanation_bytes <= max_bytes))
+
+    def _fits_explanation(self, diff: ProtoDifference) -> bool:
+        """Adds the explanation of |diff| to the explanation size, and tells
+        whether it is still within max_explanation_bytes.
+
+        Once a difference does not fit, the budget stays used up, as the
+        explanation is cut there.
+        """
+        max_bytes = self._opts.max_explanation_bytes
+        if max_bytes is None:
+            return True
+        # Lines are joined by newlines.
+        self._explanation_bytes += (len(_explain_diff(diff).encode()) +
+                                    (1 if self._differences else 0))
+        return self._explanation_bytes <= max_bytes
+
+
+class ProfilingMessageDifferencer(MessageDifferencer):
+    """A MessageDifferencer that collects ComparisonStats by field path.
+
+    Stats are attached to each result and passed to the stats hooks; see
+    profile.add_stats_hook. Elements compared on an executor only count
+    towards the time spent waiting for them. MessageDifferencer itself has no
+    instrumentation, so comparisons cost nothing extra unless profiled.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats: Optional[profile.ComparisonStats] = None
 
+    def compare(
+        self,
+        expected: message.Message,
+        actual: message.Message,
+        field_path: Tuple[str] = ()
+    ) -> ProtoComparisonResult:
+        self._stats = profile.ComparisonStats(comparisons=1)
+        start = time.perf_counter()
+        try:
+            result = super().compare(expected, actual, field_path)
+        finally:
+            stats, self._stats = self._stats, None
+        stats.total_seconds = time.perf_counter() - start
+        result.stats = stats
+        profile.report(stats)
+        return result
+
+    def _field_stats(self,
+                     field_path: Optional[FieldPath]) -> profile.FieldStats:
+        return self._stats.field(
+            field_path.materialize()[0] if field_path else ())
+
+    def _compare_field(self, args: ProtoFieldComparisonArgs[message.Message],
+                       field_plan: plan.FieldPlan) -> bool:
+        if field_plan.is_ignored:
+            return True
+        start = time.perf_counter()
+        try:
+            return super()._compare_field(args, field_plan)
+        finally:
+            self._field_stats(FieldPath(
+                args.field_path, field_plan.name)).cumulative_seconds += (
+                    time.perf_counter() - start)
 
-def _is_float(field_desc: _FieldDescriptor) -> bool:
-    return field_desc.cpp_type in (_FieldDescriptor.CPPTYPE_DOUBLE,
-                                   _FieldDescriptor.CPPTYPE_FLOAT)
+    def _compare_repeated_field(
+            self, cmp_args: ProtoFieldComparisonArgs[Iterable],
+            field_plan: plan.FieldPlan) -> bool:
+        self._field_stats(cmp_args.field_path).elements_compared += max(
+            len(cmp_args.expected), len(cmp_args.actual))
+        return super()._compare_repeated_field(cmp_args, field_plan)
+
+    def _compare_repeated_floats_vectorized(
+            self, cmp_args: ProtoFieldComparisonArgs[Iterable],
+            field_plan: plan.FieldPlan) -> bool:
+        self._field_stats(cmp_args.field_path).float_comparisons += min(
+            len(cmp_args.expected), len(cmp_args.actual))
+        return super()._compare_repeated_floats_vectorized(
+            cmp_args, field_plan)
+
+    def _compare_map(self, cmp_args: ProtoFieldComparisonArgs[Mapping],
+                     field_plan: plan.FieldPlan) -> bool:
+        self._field_stats(cmp_args.field_path).elements_compared += max(
+            len(cmp_args.expected), len(cmp_args.actual))
+        return super()._compare_map(cmp_args, field_plan)
+
+    def _compare_value(self, cmp_args: ProtoFieldComparisonArgs[Any],
+                       field_plan: plan.FieldPlan) -> bool:
+        self._field_stats(cmp_args.field_path).nodes_visited += 1
+        return super()._compare_value(cmp_args, field_plan)
+
+    def _compare_float(self, cmp_args: ProtoFieldComparisonArgs,
+                       field_plan: plan.FieldPlan) -> bool:
+        self._field_stats(cmp_args.field_path).float_comparisons += 1
+        return super()._compare_float(cmp_args, field_plan)
+
+
+# A nested message to compare, and its plan.
+_NestedComparison = Tuple[ProtoFieldComparisonArgs[message.Message],
+                          plan.MessagePlan]
+# Walks the fields of one message. Yields nested messages to compare, is sent
+# back whether they are equal, and returns whether the message is equal.
+_MessageWalk = Generator[_NestedComparison, bool, bool]
+
+
+class IterativeMessageDifferencer(MessageDifferencer):
+    """A MessageDifferencer that walks nested messages with an explicit stack.
+
+    Results, down to the order of differences, are the same as those of
+    MessageDifferencer, but nesting costs no Python frames: messages nested
+    far deeper than the recursion limit, e.g. long linked lists or expression
+    trees, can be compared, and fields equal by == are skipped without any
+    bookkeeping. Repeated fields compared AS_SET or in parallel are handed to
+    MessageDifferencer and still recurse through their elements.
+    """
+
+    def _compare(self, args: ProtoFieldComparisonArgs[message.Message],
+                 msg_plan: plan.MessagePlan) -> bool:
+        # (walk, levels left before the next native check, spacing of native
+        # checks, compared messages and their plan) per message being
+        # compared, innermost last.
+        stack = [(self._walk(args, msg_plan), 0, 1, args, msg_plan)]
+        is_equal = None
+        while stack:
+            walk, skip, spacing, _, _ = stack[-1]
+            try:
+                nested_args, nested_plan = walk.send(is_equal)
+            except StopIteration as stop:
+                _, _, _, done_args, done_plan = stack.pop()
+                is_equal = stop.value
+                if self._memo is not None:
+                    self._memo.put(done_args.expected, done_args.actual,
+                                   done_plan, is_equal)
+                if not is_equal and not self._explain:
+                    # Every message enclosing this one is unequal too.
+                    return False
+                continue
+            is_equal = None
+            if _identical(nested_args.expected, nested_args.actual,
+                          self._opts):
+                is_equal = True
+                continue
+            if self._memo is not None:
+                is_equal = self._memo.get(nested_args.expected,
+                                          nested_args.actual, nested_plan)
+                if is_equal or (is_equal is False and not self._explain):
+                    continue
+                is_equal = None
+            if nested_plan.options_affect_subtree or skip:
+                stack.append((self._walk(nested_args, nested_plan),
+                              max(skip - 1, 0), spacing, nested_args,
+                              nested_plan))
+                continue
+            if _natively_equal(nested_args.expected, nested_args.actual,
+                               self._opts):
+                is_equal = True
+                continue
+            # A failed native check is only repeated at exponentially spaced
+            # depths below, which keeps long chains of nested messages from
+            # paying for it quadratically.
+            stack.append((self._walk(nested_args, nested_plan), spacing,
+                          spacing * 2, nested_args, nested_plan))
+        return is_equal
+
+    def _walk(self, args: ProtoFieldComparisonArgs[message.Message],
+              msg_plan: plan.MessagePlan) -> _MessageWalk:
+        is_equal = True
+        for field_plan in self._fields_to_compare(args.expected, args.actual,
+                                                  msg_plan):
+            if field_plan.is_ignored:
+                continue
+            value_plan = (field_plan.map_value
+                          if field_plan.is_map else field_plan)
+            if value_plan.kind != _FieldKind.MESSAGE:
+                expected = _get_field(args.expected, field_plan)
+                # Values equal by == are equal under any options, except for
+                # floats, where a NaN may be treated as equal to itself.
+                if (value_plan.kind != _FieldKind.FLOAT and
+                        expected is not None and
+                        expected == _get_field(args.actual, field_plan)):
+                    continue
+                field_equal = self._compare_field(args, field_plan)
+            else:
+                field_equal = yield from self._walk_field(
+                    self._field_args(args, field_plan), field_plan)
+            if not field_equal:
+                if not self._explain:
+                    return False
+                is_equal = False
+        return is_equal
+
+    def _walk_field(self, cmp_args: ProtoFieldComparisonArgs[Any],
+                    field_plan: plan.FieldPlan) -> _MessageWalk:
+        if field_plan.is_map:
+            return (yield from self._walk_map(cmp_args, field_plan))
+        if not field_plan.is_repeated:
+            return (yield from self._walk_message(cmp_args, field_plan))
+        if (self._opts.repeated_field_comp == RepeatedFieldComparison.AS_SET or
+            (not field_plan.element_plans and
+             self._compare_in_parallel(cmp_args, field_plan))):
+            return self._compare_repeated_field(cmp_args, field_plan)
+        is_equal = True
+        for i, (expected, actual) in enumerate(
+                iter_util.zip_pairs(cmp_args.expected, cmp_args.actual)):
+            element_plan = field_plan.plan_for_element(i)
+            if element_plan is None:
+                continue
+            element_equal = yield from self._walk_message(
+                ProtoFieldComparisonArgs(
+                    expected=expected,
+                    actual=actual,
+                    field_desc=cmp_args.field_desc,
+                    field_path=cmp_args.field_path.element(i)), element_plan)
+            if not element_equal:
+                if not self._explain:
+                    return False
+                is_equal = False
+        return is_equal
+
+    def _walk_map(self, cmp_args: ProtoFieldComparisonArgs[Mapping],
+                  field_plan: plan.FieldPlan) -> _MessageWalk:
+        entries = self._join_map(cmp_args, field_plan)
+        if entries is None:
+            return False
+        is_equal = True
+        for entry in entries:
+            value_plan = field_plan.plan_for_element(entry[0])
+            if value_plan is None:
+                continue
+            key_args, value_args = _map_entry_args(entry, cmp_args,
+                                                   field_plan, value_plan)
+            entry_equal = self._compare_value(key_args, field_plan.map_key)
+            if entry_equal or self._explain:
+                value_equal = yield from self._walk_message(
+                    value_args, value_plan)
+                entry_equal = entry_equal and value_equal
+            if not entry_equal:
+                if not self._explain:
+                    return False
+                is_equal = False
+        return is_equal
+
+    def _walk_message(self, cmp_args: ProtoFieldComparisonArgs[Any],
+                      field_plan: plan.FieldPlan) -> _MessageWalk:
+        if cmp_args.expected is None or cmp_args.actual is None:
+            return self._add_difference(cmp_args)
+        return (yield cmp_args, field_plan.message_plan)
+
+
+def _map_entry_args(
+    entry: _MapEntry, cmp_args: ProtoFieldComparisonArgs[Mapping],
+    field_plan: plan.FieldPlan, value_plan: plan.FieldPlan
+) -> Tuple[ProtoFieldComparisonArgs[Any], ProtoFieldComparisonArgs[Any]]:
+    key, expected_value, actual_value = entry
+    field_path = cmp_args.field_path.element(key)
+    # Like values, a key is None on the side it is missing from.
+    key_args = ProtoFieldComparisonArgs(
+        expected=None if expected_value is None else key,
+        actual=None if actual_value is None else key,
+        field_desc=field_plan.map_key.desc,
+        field_path=field_path)
+    value_args = ProtoFieldComparisonArgs(expected=expected_value,
+                                          actual=actual_value,
+                                          field_desc=value_plan.desc,
+                                          field_path=field_path)
+    return key_args, value_args
+
+
+def make_differencer(engine: ProtoComparisonEngine,
+                     *args,
+                     collect_stats: bool = False,
+                     **kwargs) -> MessageDifferencer:
+    """Returns a differencer of |engine|, constructed from |args|.
+
+    With |collect_stats|, or while a stats hook is registered, the differencer
+    is a ProfilingMessageDifferencer.
+    """
+    if engine == ProtoComparisonEngine.ITERATIVE:
+        if collect_stats:
+            raise ValueError('Stats are only collected by the RECURSIVE engine')
+        return IterativeMessageDifferencer(*args, **kwargs)
+    if collect_stats or profile.has_stats_hooks():
+        return ProfilingMessageDifferencer(*args, **kwargs)
+    return MessageDifferencer(*args, **kwargs)
+
+
+def _compare_shard(
+        opts: ProtoComparisonOptions, explain: bool,
+        msg_plan: plan.MessagePlan, field_path: FieldPath, start: int,
+        expected_values: List[message.Message],
+        actual_values: List[message.Message]) -> ProtoComparisonResult:
+    # Shards are compared without an executor, so workers never wait on tasks
+    # queued behind them.
+    differencer = MessageDifferencer(opts,
+                                     msg_plan.desc,
+                                     explain=explain,
+                                     msg_plan=msg_plan)
+    return differencer._compare_elements(expected_values, actual_values,
+                                         field_path, start, msg_plan)
+
+
+def _compare_serialized_shard(
+        opts: ProtoComparisonOptions, explain: bool, full_name: str,
+        ignore_trie: ignore.IgnoreTrie, field_path: FieldPath, start: int,
+        expected_values: List[bytes],
+        actual_values: List[bytes]) -> ProtoComparisonResult:
+    msg_plan = plan.get_message_plan(
+        descriptor_pool.Default().FindMessageTypeByName(full_name), opts,
+        ignore_trie)
+    parse = lambda value: message_util.parse_message(full_name, value)
+    return _compare_shard(opts, explain, msg_plan, field_path, start,
+                          [parse(value) for value in expected_values],
+                          [parse(value) for value in actual_values])
+
+
+def _natively_equal(expected: message.Message, actual: message.Message,
+                    opts: ProtoComparisonOptions) -> bool:
+    """Tries to settle equality in the protobuf runtime, without a field walk.
+
+    Every comparison option only relaxes what counts as equal, so messages that
+    the runtime's own == finds equal are equal under any options. A False
+    answer is not conclusive and means a field walk is needed.
+    """
+    if expected is actual:
+        # == is trivially True here, even if the message holds a NaN.
+        return _identical(expected, actual, opts)
+    if expected == actual:
+        return True
+    if opts.treating_nan_as_equal:
+        # == never finds NaN equal to NaN, but identical encodings are equal
+        # once NaNs are.
+        return (expected.SerializePartialToString(deterministic=True) ==
+                actual.SerializePartialToString(deterministic=True))
+    return False
+
+
+def _identical(expected: message.Message, actual: message.Message,
+               opts: ProtoComparisonOptions) -> bool:
+    """Whether |expected| is |actual|, which makes them equal under any
+    options unless they may hold a NaN.
+
+    By default, the field walk never finds a NaN equal to itself.
+    """
+    return expected is actual and (
+        opts.treating_nan_as_equal or
+        not plan.has_float_fields(expected.DESCRIPTOR))
 
 
 def _is_enum(field_desc: _FieldDescriptor) -> bool:
     return field_desc.enum_type is not None
 
 
-def _is_field_set(value: Any, field_desc: _FieldDescriptor) -> bool:
-    if _is_enum(field_desc):
-        return value != 0
-    return bool(value)
-
-
-def _equality_result() -> ProtoComparisonResult:
-    return ProtoComparisonResult()
-
-
-def _inequality_result(
-        cmp_args: ProtoFieldComparisonArgs) -> ProtoComparisonResult:
-    return ProtoComparisonResult(
-        is_equal=False,
-        explanation=_explain_diff(cmp_args),
-    )
-
-
-def _explain_diff(cmp_args: ProtoFieldComparisonArgs):
-    expected = _readable(cmp_args.expected, cmp_args.field_desc)
-    actual = _readable(cmp_args.actual, cmp_args.field_desc)
-    # TODO: add index here.
-    field_path_with_index = '.'.join(cmp_args.field_path)
-    if expected and not actual:
+def _get_field(msg: message.Message, field_plan: plan.FieldPlan) -> Any:
+    if field_plan.has_presence and not msg.HasField(field_plan.name):
+        return None
+    return getattr(msg, field_plan.name)
+
+
+def _may_hold_floats(field_plan: plan.FieldPlan) -> bool:
+    if field_plan.kind == _FieldKind.MESSAGE:
+        return plan.has_float_fields(field_plan.desc.message_type)
+    return field_plan.kind == _FieldKind.FLOAT
+
+
+def _approximate_candidates(expected_values: List[Any],
+                            actual_values: List[Any],
+                            field_plan: plan.FieldPlan) -> List[List[int]]:
+    """Finds, per expected element, actual elements that may approximately
+    equal it: those with the same float-free key and a neighbouring bucket of
+    their first float.
+    """
+    actual_indices_by_bucket = collections.defaultdict(list)
+    for i, actual in enumerate(actual_values):
+        actual_indices_by_bucket[fingerprint.approximate_element_key(
+            actual, field_plan)].append(i)
+    candidates = []
+    for expected in expected_values:
+        key, bucket = fingerprint.approximate_element_key(expected, field_plan)
+        buckets = ((bucket - 1, bucket, bucket + 1) if isinstance(bucket, int)
+                   else (bucket,))
+        candidates.append([
+            i for neighbour in buckets
+            for i in actual_indices_by_bucket.get((key, neighbour), ())
+        ])
+    return candidates
+
+
+def _make_difference(cmp_args: ProtoFieldComparisonArgs) -> ProtoDifference:
+    if cmp_args.actual is None:
+        kind = DifferenceKind.DELETED
+    elif cmp_args.expected is None:
+        kind = DifferenceKind.ADDED
+    else:
+        kind = DifferenceKind.MODIFIED
+    field_path, field_keys = (cmp_args.field_path.materialize()
+                              if cmp_args.field_path else ((), ()))
+    return ProtoDifference(field_path=field_path,
+                           kind=kind,
+                           expected=cmp_args.expected,
+                           actual=cmp_args.actual,
+                           field_desc=cmp_args.field_desc,
+                           field_keys=field_keys)
+
+
+def _explain_diffs(differences: List[ProtoDifference],
+                   omitted: Counter[str],
+                   max_bytes: Optional[int] = None) -> str:
+    """Explains |differences|, within |max_bytes| of UTF-8 if given.
+
+    Differences that don't fit, and those in |omitted|, are summed up by
+    top-level field after the explanation; the summary is not counted against
+    |max_bytes|.
+    """
+    lines = []
+    size = 0
+    omitted = collections.Counter(omitted)
+    for i, diff in enumerate(differences):
+        line = _explain_diff(diff)
+        if max_bytes is not None:
+            # Lines are joined by newlines.
+            size += len(line.encode()) + (1 if lines else 0)
+            if size > max_bytes:
+                # The rest is not even formatted.
+                omitted.update(diff.field_path[0] if diff.field_path else ''
+                               for diff in differences[i:])
+                break
+        lines.append(line)
+    for root_name, count in sorted(omitted.items()):
+        noun = 'difference' if count == 1 else 'differences'
+        lines.append(f'…and {count} more {noun} under {root_name}\n'
+                     if root_name else f'…and {count} more {noun}\n')
+    return '\n'.join(lines)
+
+
+def _explain_diff(diff: ProtoDifference) -> str:
+    expected = _readable(diff.expected, diff.field_desc)
+    actual = _readable(diff.actual, diff.field_desc)
+    field_keys = diff.field_keys or (None,) * len(diff.field_path)
+    field_path_with_index = '.'.join(
+        name if key is None else f'{name}[{_readable_key(key)}]'
+        for name, key in zip(diff.field_path, field_keys))
+    if diff.kind == DifferenceKind.DELETED:
         return f'deleted: {field_path_with_index}: {expected}\n'
-    if actual and not expected:
+    if diff.kind == DifferenceKind.ADDED:
         return f'added: {field_path_with_index}: {actual}\n'
     return f'modified: {field_path_with_index}: {expected} -> {actual}\n'
 
@@ -289,22 +1266,20 @@ def _readable(value: Any,
     return str(value)
 
 
-def _get_enum_name(enum_value: int, field_desc: _FieldDescriptor) -> str:
-    return field_desc.enum_type.values[enum_value].name
+def _readable_key(key: Any) -> str:
+    if isinstance(key, str):
+        return f'"{key}"'
+    return str(key)
 
 
-def _get_float_comparison_epsilon(field_desc: _FieldDescriptor):
-    if field_desc.cpp_type == _FieldDescriptor.CPPTYPE_DOUBLE:
-        return _DBL_EPSILON * 32
-    if field_desc.cpp_type == _FieldDescriptor.CPPTYPE_FLOAT:
-        return _FLT_EPSILON * 32
-    raise TypeError('Float comparison called on non-float types')
+def _get_enum_name(enum_value: int, field_desc: _FieldDescriptor) -> str:
+    enum_value_desc = field_desc.enum_type.values_by_number.get(enum_value)
+    return enum_value_desc.name if enum_value_desc else str(enum_value)
 
 
 def _within_fraction_or_margin(x: float, y: float, fraction: float,
                                margin: float) -> bool:
-    if not (fraction >= 0.0 and fraction < 1.0 and margin >= .0):
-        raise ValueError(f'Invalid fraction {fraction} or margin {margin}')
+    # |fraction| and |margin| are validated when the plan is compiled.
     if math.isinf(x) or math.isinf(y):
         return False
     relative_margin = fraction * max(abs(x), abs(y))
@@ -1,8 +1,15 @@
+import concurrent.futures
 import unittest
+from unittest import mock
 
+from google.protobuf import descriptor_pb2
+from google.protobuf import descriptor_pool
 from google.protobuf import text_format
 
 from proto_matcher.compare import compare
+from proto_matcher.compare import memo
+from proto_matcher.compare import message_util
+from proto_matcher.compare import profile
 from proto_matcher.testdata import test_pb2
 
 _TEST_PROTO = """
@@ -32,6 +39,44 @@ mapping {
 }
 """
 
+# A repeated message with a map, which test.proto lacks.
+_NESTED_MAP_PROTO = """
+name: "proto_matcher/compare/nested_map.proto"
+package: "proto_matcher.compare"
+syntax: "proto3"
+message_type {
+    name: "M"
+    field {
+        name: "items" number: 1 label: LABEL_REPEATED type: TYPE_MESSAGE
+        type_name: ".proto_matcher.compare.M.ItemsEntry"
+    }
+    nested_type {
+        name: "ItemsEntry"
+        field { name: "key" number: 1 label: LABEL_OPTIONAL type: TYPE_STRING }
+        field {
+            name: "value" number: 2 label: LABEL_OPTIONAL type: TYPE_STRING
+        }
+        options { map_entry: true }
+    }
+}
+message_type {
+    name: "Outer"
+    field {
+        name: "ms" number: 1 label: LABEL_REPEATED type: TYPE_MESSAGE
+        type_name: ".proto_matcher.compare.M"
+    }
+}
+"""
+
+
+def _nested_map_class():
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(
+        text_format.Parse(_NESTED_MAP_PROTO,
+                          descriptor_pb2.FileDescriptorProto()))
+    return message_util.get_message_class(
+        pool.FindMessageTypeByName('proto_matcher.compare.Outer'))
+
 
 class ProtoCompareTest(unittest.TestCase):
 
@@ -84,6 +129,39 @@ class ProtoCompareTest(unittest.TestCase):
         self.assertProtoCompareToBe(compare.proto_compare(actual, expected),
                                     False)
 
+    def test_map_differences_are_sorted_by_key(self):
+        expected = test_pb2.Foo()
+        actual = test_pb2.Foo()
+        for key in range(1000):
+            expected.mapping[key] = str(key)
+            actual.mapping[key] = str(key)
+        actual.mapping[700] = 'changed'
+        del actual.mapping[300]
+        actual.mapping[-1] = 'added'
+        result = compare.proto_compare(actual, expected)
+        self.assertEqual(
+            [(d.field_keys, d.kind) for d in result.differences],
+            [((-1,), compare.DifferenceKind.ADDED),
+             ((-1,), compare.DifferenceKind.ADDED),
+             ((300,), compare.DifferenceKind.DELETED),
+             ((300,), compare.DifferenceKind.DELETED),
+             ((700,), compare.DifferenceKind.MODIFIED)])
+        self.assertFalse(compare.proto_equal(actual, expected))
+
+    def test_partial_map_only_looks_up_expected_keys(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.mapping[15] = 'luck'
+        opts = compare.ProtoComparisonOptions(
+            scope=compare.ProtoComparisonScope.PARTIAL)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts), True)
+
+        del actual.mapping[5]
+        result = compare.proto_compare(actual, expected, opts)
+        self.assertEqual([(d.field_keys, d.kind) for d in result.differences],
+                         [((5,), compare.DifferenceKind.DELETED)] * 2)
+
     def test_basic_partial_equality(self):
         expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
         actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
@@ -269,6 +347,76 @@ class ProtoCompareTest(unittest.TestCase):
         self.assertProtoCompareToBe(
             compare.proto_compare(actual, expected, opts=opts), True)
 
+    def test_ignore_field_wildcard(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.bars[0].size = 2
+        actual.baz.status = test_pb2.Baz.OK
+
+        opts = compare.ProtoComparisonOptions(ignore_field_paths={('*',
+                                                                   'size')})
+        result = compare.proto_compare(actual, expected, opts=opts)
+        self.assertEqual([d.field_path for d in result.differences],
+                         [('baz', 'status')])
+        opts = compare.ProtoComparisonOptions(
+            ignore_field_paths={('*', 'size'), ('*', 'status')})
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), True)
+
+    def test_ignore_repeated_field_element(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.bars[1].notes.append('extra')
+        actual.bars[0].size = 2
+
+        opts = compare.ProtoComparisonOptions(
+            ignore_field_paths={('bars[1]',)})
+        result = compare.proto_compare(actual, expected, opts=opts)
+        self.assertEqual([d.field_path for d in result.differences],
+                         [('bars', 'size')])
+        opts = compare.ProtoComparisonOptions(
+            ignore_field_paths={('bars[1]',), ('bars[0]', 'size')})
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), True)
+        opts = compare.ProtoComparisonOptions(
+            ignore_field_paths={('bars[1]', 'notes'), ('bars[1]', 'size')})
+        result = compare.proto_compare(actual, expected, opts=opts)
+        self.assertEqual([d.field_path for d in result.differences],
+                         [('bars', 'size')])
+
+    def test_ignore_trailing_repeated_field_element(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.bars.add(name='extra')
+        opts = compare.ProtoComparisonOptions(
+            ignore_field_paths={('bars[2]',)})
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), True)
+        self.assertTrue(compare.proto_equal(actual, expected, opts=opts))
+
+    def test_ignore_map_entry(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.mapping[5] = 'changed'
+        actual.mapping[7] = 'added'
+
+        opts = compare.ProtoComparisonOptions(
+            ignore_field_paths={('mapping[5]',)})
+        result = compare.proto_compare(actual, expected, opts=opts)
+        self.assertEqual([d.actual for d in result.differences],
+                         [7, 'added'])
+        opts = compare.ProtoComparisonOptions(
+            ignore_field_paths={('mapping[5]',), ('mapping[7]',)})
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), True)
+
+    def test_ignore_element_as_set_is_invalid(self):
+        opts = compare.ProtoComparisonOptions(
+            repeated_field_comp=compare.RepeatedFieldComparison.AS_SET,
+            ignore_field_paths={('bars[0]',)})
+        with self.assertRaisesRegex(ValueError, 'picked by index'):
+            compare.proto_compare(test_pb2.Foo(), test_pb2.Foo(), opts=opts)
+
     def test_compare_proto_repeated_fields_ignoring_order(self):
         expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
         actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
@@ -283,6 +431,765 @@ class ProtoCompareTest(unittest.TestCase):
         self.assertProtoCompareToBe(
             compare.proto_compare(actual, expected, opts=opts), True)
 
+    def test_proto_equal(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        self.assertTrue(compare.proto_equal(actual, expected))
+
+        expected.bars[0].size = 2
+        expected.mapping[15] = 'luck'
+        with mock.patch.object(compare, '_explain_diff') as explain_diff:
+            self.assertFalse(compare.proto_equal(actual, expected))
+            explain_diff.assert_not_called()
+
+        self.assertFalse(compare.proto_equal(test_pb2.Foo(), test_pb2.Bar()))
+
+    def test_proto_equal_with_options(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        expected.baz.Clear()
+        expected.bars[0].progress = 2.300005
+        actual.bars[0].progress = 2.300006
+        reversed_bars = actual.bars[::-1]
+        del actual.bars[:]
+        actual.bars.extend(reversed_bars)
+        actual.bars[0].size = 7
+        self.assertFalse(compare.proto_equal(actual, expected))
+
+        opts = compare.ProtoComparisonOptions(
+            scope=compare.ProtoComparisonScope.PARTIAL,
+            float_comp=compare.ProtoFloatComparison.APPROXIMATE,
+            repeated_field_comp=compare.RepeatedFieldComparison.AS_SET,
+            ignore_field_paths={('bars', 'size')})
+        self.assertTrue(compare.proto_equal(actual, expected, opts=opts))
+
+    def test_differences(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        expected.bars[0].size = 2
+        del actual.bars[1:]
+        result = compare.proto_compare(actual, expected)
+        self.assertFalse(result.is_equal)
+        self.assertEqual(
+            [(diff.field_path, diff.kind) for diff in result.differences],
+            [(('bars', 'size'), compare.DifferenceKind.MODIFIED),
+             (('bars',), compare.DifferenceKind.DELETED)])
+        self.assertEqual(result.differences[0].expected, 2)
+        self.assertEqual(result.differences[0].actual, 1)
+        self.assertIs(result.differences[1].expected, expected.bars[1])
+        self.assertIsNone(result.differences[1].actual)
+
+    def test_results_compare_by_value(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        expected.baz.status = test_pb2.Baz.OK
+        self.assertEqual(compare.proto_compare(actual, expected),
+                         compare.proto_compare(actual, expected))
+        self.assertNotEqual(compare.proto_compare(actual, expected),
+                            compare.proto_compare(actual, actual))
+        self.assertEqual(compare.proto_compare(actual, test_pb2.Bar()),
+                         compare.proto_compare(actual, test_pb2.Bar()))
+
+    def test_explanation_is_rendered_lazily(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        expected.baz.status = test_pb2.Baz.OK
+        with mock.patch.object(compare,
+                               '_explain_diff',
+                               wraps=compare._explain_diff) as explain_diff:
+            result = compare.proto_compare(actual, expected)
+            explain_diff.assert_not_called()
+            self.assertIn('modified: baz.status: OK -> ERROR',
+                          result.explanation)
+            explain_diff.assert_called_once()
+
+    def test_explanation_has_indices_and_map_keys(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.bars[1].notes[0] = 'video'
+        actual.bars.add(name='extra')
+        actual.mapping[10] = 'bye'
+
+        result = compare.proto_compare(actual, expected)
+        self.assertEqual(
+            [(diff.field_path, diff.field_keys) for diff in result.differences],
+            [(('bars', 'notes'), (1, 0)), (('bars',), (2,)),
+             (('mapping',), (10,))])
+        for line in ('modified: bars[1].notes[0]: "photo" -> "video"',
+                     'added: bars[2]: name: "extra"',
+                     'modified: mapping[10]: "hello world!" -> "bye"'):
+            self.assertIn(line, result.explanation.splitlines())
+
+    def test_explanation_has_indices_as_set(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.bars[0].notes.insert(0, 'new')
+        opts = compare.ProtoComparisonOptions(
+            repeated_field_comp=compare.RepeatedFieldComparison.AS_SET)
+        result = compare.proto_compare(actual, expected, opts)
+        self.assertEqual(
+            [(diff.kind, diff.field_keys) for diff in result.differences],
+            [(compare.DifferenceKind.DELETED, (0,)),
+             (compare.DifferenceKind.ADDED, (0,))])
+        self.assertTrue(
+            result.explanation.startswith('deleted: bars[0]: short_id: -123'))
+
+    def test_equal_messages_skip_field_walk(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        with mock.patch.object(compare.MessageDifferencer,
+                               '_compare') as field_walk:
+            self.assertProtoCompareToBe(
+                compare.proto_compare(actual, expected), True)
+            opts = compare.ProtoComparisonOptions(
+                scope=compare.ProtoComparisonScope.PARTIAL)
+            self.assertTrue(compare.proto_equal(actual, expected, opts=opts))
+            field_walk.assert_not_called()
+
+    def test_nan_equality(self):
+        expected = test_pb2.Bar(progress=float('nan'))
+        actual = test_pb2.Bar(progress=float('nan'))
+        self.assertProtoCompareToBe(compare.proto_compare(actual, expected),
+                                    False)
+        self.assertProtoCompareToBe(compare.proto_compare(actual, actual),
+                                    False)
+
+        opts = compare.ProtoComparisonOptions(treating_nan_as_equal=True)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), True)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, actual, opts=opts), True)
+
+    def test_unaffected_subtrees_are_compared_natively(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        expected.bars[0].progress = 2.300005
+        actual.bars[0].progress = 2.300006
+        opts = compare.ProtoComparisonOptions(
+            float_comp=compare.ProtoFloatComparison.APPROXIMATE)
+        with mock.patch.object(compare.MessageDifferencer,
+                               '_compare',
+                               autospec=True,
+                               side_effect=compare.MessageDifferencer._compare
+                              ) as field_walk:
+            self.assertProtoCompareToBe(
+                compare.proto_compare(actual, expected, opts=opts), True)
+        walked_types = [
+            call.args[2].desc.name for call in field_walk.call_args_list
+        ]
+        self.assertEqual(walked_types, ['Foo', 'Bar', 'Bar'])
+
+    def test_partial_equality_ignores_unset_repeated_field(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        del expected.bars[:]
+        expected.mapping.clear()
+        opts = compare.ProtoComparisonOptions(
+            scope=compare.ProtoComparisonScope.PARTIAL)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), True)
+
+    def test_field_presence(self):
+        expected = text_format.Parse('short_id: 0', test_pb2.Bar())
+        actual = text_format.Parse('long_id: 0', test_pb2.Bar())
+        result = compare.proto_compare(actual, expected)
+        self.assertProtoCompareToBe(result, False)
+        self.assertEqual(
+            [(diff.field_path, diff.kind) for diff in result.differences],
+            [(('short_id',), compare.DifferenceKind.DELETED),
+             (('long_id',), compare.DifferenceKind.ADDED)])
+
+        opts = compare.ProtoComparisonOptions(
+            scope=compare.ProtoComparisonScope.PARTIAL)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), False)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(expected, actual, opts=opts), False)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, test_pb2.Bar(), opts=opts), True)
+
+    def test_empty_submessage_presence(self):
+        expected = text_format.Parse('baz {}', test_pb2.Foo())
+        actual = test_pb2.Foo()
+        self.assertProtoCompareToBe(compare.proto_compare(actual, expected),
+                                    False)
+        self.assertProtoCompareToBe(compare.proto_compare(actual, actual),
+                                    True)
+
+    def test_repeated_fields_ignoring_order_do_not_reorder_inputs(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        reversed_bars = actual.bars[::-1]
+        del actual.bars[:]
+        actual.bars.extend(reversed_bars)
+        actual_copy = test_pb2.Foo()
+        actual_copy.CopyFrom(actual)
+        expected_copy = test_pb2.Foo()
+        expected_copy.CopyFrom(expected)
+
+        opts = compare.ProtoComparisonOptions(
+            repeated_field_comp=compare.RepeatedFieldComparison.AS_SET)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), True)
+        self.assertEqual(actual, actual_copy)
+        self.assertEqual(expected, expected_copy)
+
+    def test_repeated_fields_ignoring_order_reports_unmatched(self):
+        expected = text_format.Parse(
+            'notes: "a" notes: "b" notes: "b" notes: "c"', test_pb2.Bar())
+        actual = text_format.Parse(
+            'notes: "c" notes: "b" notes: "d" notes: "a"', test_pb2.Bar())
+        opts = compare.ProtoComparisonOptions(
+            repeated_field_comp=compare.RepeatedFieldComparison.AS_SET)
+        result = compare.proto_compare(actual, expected, opts=opts)
+        self.assertProtoCompareToBe(result, False)
+        self.assertEqual(
+            [(diff.kind, diff.expected, diff.actual)
+             for diff in result.differences],
+            [(compare.DifferenceKind.DELETED, 'b', None),
+             (compare.DifferenceKind.ADDED, None, 'd')])
+
+    def test_repeated_fields_ignoring_order_nested(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.bars[0].notes.reverse()
+        reversed_bars = actual.bars[::-1]
+        del actual.bars[:]
+        actual.bars.extend(reversed_bars)
+        opts = compare.ProtoComparisonOptions(
+            repeated_field_comp=compare.RepeatedFieldComparison.AS_SET)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), True)
+
+        actual.bars[1].notes.append('extra')
+        result = compare.proto_compare(actual, expected, opts=opts)
+        self.assertProtoCompareToBe(result, False)
+        self.assertEqual([diff.kind for diff in result.differences], [
+            compare.DifferenceKind.DELETED, compare.DifferenceKind.ADDED
+        ])
+
+    def test_repeated_fields_ignoring_order_approximately(self):
+        # Many elements share a name, and values land on bucket edges.
+        values = [i * 0.25 for i in range(2000)]
+        foo_expected = test_pb2.Foo()
+        foo_actual = test_pb2.Foo()
+        for i, value in enumerate(values):
+            foo_expected.bars.add(name=str(i % 7), progress=value)
+        for i, value in reversed(list(enumerate(values))):
+            foo_actual.bars.add(name=str(i % 7), progress=value + 1e-7)
+        opts = compare.ProtoComparisonOptions(
+            repeated_field_comp=compare.RepeatedFieldComparison.AS_SET)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(foo_actual, foo_expected, opts=opts), False)
+
+        opts = compare.ProtoComparisonOptions(
+            repeated_field_comp=compare.RepeatedFieldComparison.AS_SET,
+            float_comp=compare.ProtoFloatComparison.APPROXIMATE,
+            float_margin=1e-6)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(foo_actual, foo_expected, opts=opts), True)
+
+        foo_actual.bars[0].name = 'other'
+        result = compare.proto_compare(foo_actual, foo_expected, opts=opts)
+        self.assertProtoCompareToBe(result, False)
+        self.assertEqual([diff.kind for diff in result.differences], [
+            compare.DifferenceKind.DELETED, compare.DifferenceKind.ADDED
+        ])
+        self.assertEqual(result.differences[1].actual.name, 'other')
+
+    def test_repeated_fields_ignoring_order_approximately_needs_assignment(
+            self):
+        expected = text_format.Parse('bars { progress: 1.5 name: "x" }'
+                                     'bars { progress: 1.0 name: "x" }',
+                                     test_pb2.Foo())
+        actual = text_format.Parse('bars { progress: 1.4 name: "x" }'
+                                   'bars { progress: 2.0 name: "x" }',
+                                   test_pb2.Foo())
+        opts = compare.ProtoComparisonOptions(
+            repeated_field_comp=compare.RepeatedFieldComparison.AS_SET,
+            float_comp=compare.ProtoFloatComparison.APPROXIMATE,
+            float_margin=0.6)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), True)
+
+    def test_repeated_fields_ignoring_order_with_ignored_map_entries(self):
+        outer_class = _nested_map_class()
+        expected = outer_class()
+        expected.ms.add()
+        actual = outer_class()
+        actual.ms.add().items['j'] = 'v'
+        for repeated_field_comp in compare.RepeatedFieldComparison:
+            with self.subTest(repeated_field_comp):
+                opts = compare.ProtoComparisonOptions(
+                    repeated_field_comp=repeated_field_comp,
+                    ignore_field_paths={('ms', 'items["j"]')})
+                self.assertProtoCompareToBe(
+                    compare.proto_compare(actual, expected, opts=opts), True)
+
+    def test_repeated_fields_ignoring_order_approximately_not_exact_first(
+            self):
+        # Pairing the equal 1.0s first would leave 0.0 and 2.0 unpaired.
+        opts = compare.ProtoComparisonOptions(
+            repeated_field_comp=compare.RepeatedFieldComparison.AS_SET,
+            float_comp=compare.ProtoFloatComparison.APPROXIMATE,
+            float_margin=1.0)
+        self.assertProtoCompareToBe(
+            compare.proto_compare(test_pb2.Bar(samples=[1.0, 2.0]),
+                                  test_pb2.Bar(samples=[0.0, 1.0]),
+                                  opts=opts), True)
+        expected = text_format.Parse(
+            'bars { precision: 0.0 } bars { precision: 1.0 }', test_pb2.Foo())
+        actual = text_format.Parse(
+            'bars { precision: 1.0 } bars { precision: 2.0 }', test_pb2.Foo())
+        self.assertProtoCompareToBe(
+            compare.proto_compare(actual, expected, opts=opts), True)
+        self.assertTrue(compare.proto_equal(actual, expected, opts=opts))
+
+
+def _make_many_bars(n):
+    foo = test_pb2.Foo()
+    for i in range(n):
+        foo.bars.add(short_id=i, size=i, name=str(i))
+    return foo
+
+
+class ParallelCompareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.expected = _make_many_bars(40)
+        self.actual = _make_many_bars(40)
+        self.actual.bars[3].name = 'three'
+        self.actual.bars[37].size = 0
+        self.actual.bars.add(short_id=40)
+
+    def assertSameAsSerial(self, executor, opts=None):
+        opts = opts or compare.ProtoComparisonOptions()
+        serial = compare.MessageDifferencer(opts, test_pb2.Foo.DESCRIPTOR)
+        parallel = compare.MessageDifferencer(opts,
+                                              test_pb2.Foo.DESCRIPTOR,
+                                              executor=executor,
+                                              parallel_min_elements=10)
+        with mock.patch.object(compare, '_PARALLEL_SHARD_SIZE', 7):
+            result = parallel.compare(self.expected, self.actual)
+        expected_result = serial.compare(self.expected, self.actual)
+        self.assertEqual(result.is_equal, expected_result.is_equal)
+        self.assertEqual(result.explanation, expected_result.explanation)
+        return result
+
+    def test_difference_budget(self):
+        opts = compare.ProtoComparisonOptions(max_differences=1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            result = self.assertSameAsSerial(executor, opts)
+        self.assertEqual(len(result.differences), 1)
+        self.assertEqual(result.omitted_differences, {'bars': 2})
+
+    def test_thread_pool(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            with mock.patch.object(compare,
+                                   '_compare_shard',
+                                   wraps=compare._compare_shard) as shard:
+                result = self.assertSameAsSerial(executor)
+        self.assertEqual(shard.call_count, 6)
+        self.assertEqual([d.field_path for d in result.differences],
+                         [('bars', 'name'), ('bars', 'size'), ('bars',)])
+
+    def test_thread_pool_reuses_element_plan(self):
+        # notes is not a field of Foo, so the path is never used; a plan for
+        # Bar compiled against the root paths would reject its selector.
+        opts = compare.ProtoComparisonOptions(
+            ignore_field_paths={('notes[x]',)})
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            self.assertSameAsSerial(executor, opts)
+
+    def test_thread_pool_ignoring_field_paths(self):
+        opts = compare.ProtoComparisonOptions(
+            ignore_field_paths={('bars', 'size')})
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            result = self.assertSameAsSerial(executor, opts)
+        self.assertEqual([d.field_path for d in result.differences],
+                         [('bars', 'name'), ('bars',)])
+
+    def test_process_pool(self):
+        opts = compare.ProtoComparisonOptions(
+            ignore_field_paths={('bars', 'name')})
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=2) as executor:
+            result = self.assertSameAsSerial(executor, opts)
+        self.assertEqual([d.field_path for d in result.differences],
+                         [('bars', 'size'), ('bars',)])
+
+    def test_equal_only(self):
+        opts = compare.ProtoComparisonOptions()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            differencer = compare.MessageDifferencer(opts,
+                                                     test_pb2.Foo.DESCRIPTOR,
+                                                     explain=False,
+                                                     executor=executor,
+                                                     parallel_min_elements=10)
+            self.assertFalse(
+                differencer.compare(self.expected, self.actual).is_equal)
+            self.actual.bars.pop()
+            self.assertFalse(
+                differencer.compare(self.expected, self.actual).is_equal)
+            self.assertTrue(
+                differencer.compare(self.expected,
+                                    _make_many_bars(40)).is_equal)
+
+    def test_below_threshold_is_serial(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            with mock.patch.object(compare, '_compare_shard') as shard:
+                result = compare.proto_compare(self.actual,
+                                               self.expected,
+                                               executor=executor)
+        shard.assert_not_called()
+        self.assertFalse(result.is_equal)
+
+
+def _make_chain(depth, last_value):
+    root = test_pb2.Node()
+    node = root
+    for i in range(depth):
+        node.value = i
+        node = node.next
+    node.value = last_value
+    return root
+
+
+class IterativeEngineTest(unittest.TestCase):
+
+    def assertSameAsRecursive(self, actual, expected, opts=None):
+        recursive = compare.proto_compare(actual, expected, opts)
+        iterative = compare.proto_compare(
+            actual,
+            expected,
+            opts,
+            engine=compare.ProtoComparisonEngine.ITERATIVE)
+        self.assertEqual(iterative.is_equal, recursive.is_equal)
+        self.assertEqual(
+            [(d.field_path, d.field_keys, d.kind, d.expected, d.actual)
+             for d in iterative.differences],
+            [(d.field_path, d.field_keys, d.kind, d.expected, d.actual)
+             for d in recursive.differences])
+        self.assertEqual(
+            compare.proto_equal(
+                actual,
+                expected,
+                opts,
+                engine=compare.ProtoComparisonEngine.ITERATIVE),
+            recursive.is_equal)
+
+    def test_same_as_recursive(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.bars[0].size = 2
+        actual.bars[1].notes.append('extra')
+        actual.bars.add(progress=0.5)
+        actual.baz.status = test_pb2.Baz.OK
+        actual.mapping[5] = 'changed'
+        actual.mapping[6] = 'added'
+        all_opts = [
+            compare.ProtoComparisonOptions(),
+            compare.ProtoComparisonOptions(
+                scope=compare.ProtoComparisonScope.PARTIAL),
+            compare.ProtoComparisonOptions(
+                repeated_field_comp=compare.RepeatedFieldComparison.AS_SET),
+            compare.ProtoComparisonOptions(
+                float_comp=compare.ProtoFloatComparison.APPROXIMATE),
+            compare.ProtoComparisonOptions(
+                ignore_field_paths={('bars[0]', 'size'), ('mapping[6]',)}),
+        ]
+        for opts in all_opts:
+            with self.subTest(opts=opts):
+                self.assertSameAsRecursive(actual, expected, opts)
+                self.assertSameAsRecursive(expected, actual, opts)
+                self.assertSameAsRecursive(actual, actual, opts)
+
+    def test_same_as_recursive_for_trees(self):
+        expected = text_format.Parse(
+            """
+            value: 1
+            children { value: 2 next { value: 3 } }
+            children { value: 4 children { value: 5 } }
+            """, test_pb2.Node())
+        actual = test_pb2.Node()
+        actual.CopyFrom(expected)
+        actual.children[0].next.value = 6
+        actual.children[1].children.add(value=7)
+        self.assertSameAsRecursive(actual, expected)
+        self.assertSameAsRecursive(test_pb2.Node(), expected)
+
+    def test_deep_nesting(self):
+        depth = 20000
+        expected = _make_chain(depth, 1)
+        actual = _make_chain(depth, 2)
+        engine = compare.ProtoComparisonEngine.ITERATIVE
+        result = compare.proto_compare(actual, expected, engine=engine)
+        self.assertFalse(result.is_equal)
+        diff, = result.differences
+        self.assertEqual(diff.field_path, ('next',) * depth + ('value',))
+        self.assertEqual((diff.expected, diff.actual), (1, 2))
+        self.assertFalse(
+            compare.proto_equal(actual, expected, engine=engine))
+        self.assertTrue(
+            compare.proto_equal(_make_chain(depth, 1),
+                                expected,
+                                engine=engine))
+        # Partial scope walks every message rather than using ==.
+        partial = compare.ProtoComparisonOptions(
+            scope=compare.ProtoComparisonScope.PARTIAL)
+        self.assertTrue(
+            compare.proto_compare(_make_chain(depth, 1),
+                                  expected,
+                                  partial,
+                                  engine=engine).is_equal)
+
+
+class DifferenceBudgetTest(unittest.TestCase):
+
+    def _make_pair(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        for bar in actual.bars:
+            bar.name = 'modified'
+            bar.notes.append('added')
+        actual.baz.status = test_pb2.Baz.OK
+        return actual, expected
+
+    def test_max_differences(self):
+        actual, expected = self._make_pair()
+        full = compare.proto_compare(actual, expected)
+        self.assertEqual(len(full.differences), 5)
+
+        opts = compare.ProtoComparisonOptions(max_differences=2)
+        for engine in compare.ProtoComparisonEngine:
+            with self.subTest(engine):
+                result = compare.proto_compare(actual,
+                                               expected,
+                                               opts,
+                                               engine=engine)
+                self.assertFalse(result.is_equal)
+                self.assertEqual(result.differences, full.differences[:2])
+                self.assertEqual(result.omitted_differences, {
+                    'bars': 2,
+                    'baz': 1
+                })
+                self.assertTrue(
+                    result.explanation.endswith(
+                        '…and 2 more differences under bars\n\n'
+                        '…and 1 more difference under baz\n'),
+                    result.explanation)
+
+    def test_max_explanation_bytes(self):
+        actual, expected = self._make_pair()
+        full = compare.proto_compare(actual, expected)
+        first_line = full.explanation.split('\n')[0] + '\n'
+        opts = compare.ProtoComparisonOptions(
+            max_explanation_bytes=len(first_line) + 1)
+        for engine in compare.ProtoComparisonEngine:
+            with self.subTest(engine):
+                with mock.patch.object(
+                        compare,
+                        '_make_difference',
+                        wraps=compare._make_difference) as make_difference:
+                    result = compare.proto_compare(actual,
+                                                   expected,
+                                                   opts,
+                                                   engine=engine)
+                # Only the difference that did not fit is built past the
+                # budget; the rest are counted.
+                self.assertEqual(make_difference.call_count, 2)
+                self.assertEqual(result.differences, full.differences[:1])
+                self.assertEqual(result.omitted_differences, {
+                    'bars': 3,
+                    'baz': 1
+                })
+                self.assertEqual(
+                    result.explanation, first_line + '\n'
+                    '…and 3 more differences under bars\n\n'
+                    '…and 1 more difference under baz\n')
+
+    def test_equal_messages(self):
+        opts = compare.ProtoComparisonOptions(max_differences=0)
+        result = compare.proto_compare(test_pb2.Foo(), test_pb2.Foo(), opts)
+        self.assertTrue(result.is_equal)
+        self.assertEqual(result.explanation, '')
+
+    def test_invalid_budget(self):
+        with self.assertRaisesRegex(ValueError, 'max_differences'):
+            compare.ProtoComparisonOptions(max_differences=-1)
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def _make_pair(self):
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        expected.bars[1].weights.extend([0.5, 1.5])
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.bars[1].weights.extend([0.5, 1.5])
+        actual.bars[1].notes[0] = 'modified'
+        actual.mapping[7] = 'added'
+        return actual, expected
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(compare.proto_compare(*self._make_pair()).stats)
+
+    def test_collect_stats(self):
+        actual, expected = self._make_pair()
+        opts = compare.ProtoComparisonOptions(
+            float_comp=compare.ProtoFloatComparison.APPROXIMATE)
+        result = compare.proto_compare(actual,
+                                       expected,
+                                       opts,
+                                       collect_stats=True)
+        self.assertFalse(result.is_equal)
+        stats = result.stats
+        self.assertEqual(stats.comparisons, 1)
+        self.assertGreater(stats.total_seconds, 0)
+        self.assertEqual(stats.by_field_path[('bars',)].elements_compared, 2)
+        self.assertEqual(stats.by_field_path[('bars',)].nodes_visited, 2)
+        # Notes of both bars.
+        self.assertEqual(stats.by_field_path[('bars', 'notes')].nodes_visited,
+                         3)
+        self.assertEqual(
+            stats.by_field_path[('bars', 'weights')].float_comparisons, 2)
+        self.assertEqual(stats.by_field_path[('mapping',)].elements_compared,
+                         3)
+        self.assertGreaterEqual(
+            stats.by_field_path[('bars',)].cumulative_seconds,
+            stats.by_field_path[('bars', 'notes')].cumulative_seconds)
+        self.assertEqual(stats.slowest(1)[0][0], ('bars',))
+        self.assertIn('bars.notes', str(stats))
+
+    def test_same_result_as_uninstrumented(self):
+        actual, expected = self._make_pair()
+        self.assertEqual(
+            compare.proto_compare(actual, expected,
+                                  collect_stats=True).explanation,
+            compare.proto_compare(actual, expected).explanation)
+
+    def test_stats_hook(self):
+        totals = profile.ComparisonStats()
+        profile.add_stats_hook(totals.merge)
+        try:
+            compare.proto_compare(*self._make_pair())
+            self.assertFalse(compare.proto_equal(*self._make_pair()))
+        finally:
+            profile.remove_stats_hook(totals.merge)
+        self.assertEqual(totals.comparisons, 2)
+        self.assertEqual(totals.by_field_path[('bars',)].elements_compared, 4)
+        compare.proto_compare(*self._make_pair())
+        self.assertEqual(totals.comparisons, 2)
+
+    def test_iterative_engine_is_not_instrumented(self):
+        with self.assertRaisesRegex(ValueError, 'RECURSIVE'):
+            compare.proto_compare(
+                *self._make_pair(),
+                engine=compare.ProtoComparisonEngine.ITERATIVE,
+                collect_stats=True)
+
+
+class MemoTest(unittest.TestCase):
+
+    def _patch_compare(self):
+        differencer = compare.MessageDifferencer
+        return mock.patch.object(differencer,
+                                 '_compare',
+                                 autospec=True,
+                                 side_effect=differencer._compare)
+
+    def test_identical_messages_are_not_walked(self):
+        foo = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        foo.bars[1].progress = float('nan')
+        with self._patch_compare() as compare_fields:
+            self.assertTrue(
+                compare.proto_compare(foo.baz, foo.baz).is_equal)
+            self.assertTrue(
+                compare.proto_compare(
+                    foo, foo,
+                    compare.ProtoComparisonOptions(
+                        treating_nan_as_equal=True)).is_equal)
+        compare_fields.assert_not_called()
+
+    def test_identical_messages_with_nan(self):
+        foo = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        foo.bars[1].progress = float('nan')
+        for engine in compare.ProtoComparisonEngine:
+            with self.subTest(engine):
+                result = compare.proto_compare(foo, foo, engine=engine)
+                self.assertFalse(result.is_equal)
+                self.assertEqual(
+                    [diff.field_path for diff in result.differences],
+                    [('bars', 'progress')])
+
+    def test_memoized_pairs_are_not_walked(self):
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.bars[0].size = 2
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        comparison_memo = memo.ComparisonMemo()
+        explanation = compare.proto_compare(actual,
+                                            expected,
+                                            memo=comparison_memo).explanation
+        self.assertGreater(len(comparison_memo), 0)
+        with self._patch_compare() as compare_fields:
+            self.assertFalse(
+                compare.proto_equal(actual, expected, memo=comparison_memo))
+            compare_fields.assert_not_called()
+            # Unequal pairs are walked again to explain them.
+            self.assertEqual(
+                compare.proto_compare(actual, expected,
+                                      memo=comparison_memo).explanation,
+                explanation)
+            compare_fields.assert_called()
+
+    def test_options_do_not_share_outcomes(self):
+        actual = test_pb2.Bar(name='a', size=1)
+        expected = test_pb2.Bar(name='a')
+        comparison_memo = memo.ComparisonMemo()
+        self.assertFalse(
+            compare.proto_equal(actual, expected, memo=comparison_memo))
+        self.assertTrue(
+            compare.proto_equal(actual,
+                                expected,
+                                compare.ProtoComparisonOptions(
+                                    scope=compare.ProtoComparisonScope.PARTIAL),
+                                memo=comparison_memo))
+
+    def test_ids_are_not_reused(self):
+        comparison_memo = memo.ComparisonMemo()
+        opts = compare.ProtoComparisonOptions(
+            scope=compare.ProtoComparisonScope.PARTIAL)
+        self.assertFalse(
+            compare.proto_equal(test_pb2.Bar(name='b'),
+                                test_pb2.Bar(name='a'),
+                                opts,
+                                memo=comparison_memo))
+        # The memo keeps the pair alive, so new messages never take its ids.
+        for _ in range(100):
+            self.assertTrue(
+                compare.proto_equal(test_pb2.Bar(name='a', size=1),
+                                    test_pb2.Bar(name='a'),
+                                    opts,
+                                    memo=comparison_memo))
+
+    def test_iterative_engine(self):
+        actual = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        actual.bars[1].notes.append('extra')
+        expected = text_format.Parse(_TEST_PROTO, test_pb2.Foo())
+        opts = compare.ProtoComparisonOptions(
+            float_comp=compare.ProtoFloatComparison.APPROXIMATE)
+        comparison_memo = memo.ComparisonMemo()
+        for _ in range(2):
+            result = compare.proto_compare(
+                actual,
+                expected,
+                opts,
+                engine=compare.ProtoComparisonEngine.ITERATIVE,
+                memo=comparison_memo)
+            self.assertEqual(result.explanation,
+                             compare.proto_compare(actual, expected,
+                                                   opts).explanation)
+        self.assertGreater(len(comparison_memo), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
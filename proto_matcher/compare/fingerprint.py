@@ -0,0 +1,302 @@
+import collections
+import hashlib
+import math
+import struct
+from typing import Any, Hashable, Optional, Tuple
+
+from google.protobuf import message
+
+from proto_matcher.compare import plan
+from proto_matcher.compare.options import ProtoComparisonOptions
+from proto_matcher.compare.options import ProtoComparisonScope
+from proto_matcher.compare.options import ProtoFloatComparison
+from proto_matcher.compare.options import RepeatedFieldComparison
+
+_FieldKind = plan.FieldKind
+
+# Key of every NaN when NaNs are treated as equal.
+_NAN_KEY = ('nan',)
+# Stand-in for every float in approximate keys.
+_FLOAT_KEY = ('float',)
+
+_DIGEST_SIZE = 16
+
+
+class _KeyBuilder():
+
+    def __init__(self):
+        # Greater than zero while inside a field whose element order does not
+        # count, i.e. a map or a repeated field compared AS_SET.
+        self._unordered_depth = 0
+
+    def value_key(self, value: Any, field_plan: plan.FieldPlan) -> Hashable:
+        if field_plan.is_map:
+            self._unordered_depth += 1
+            key = frozenset(
+                (key, self.element_key(map_value, value_plan))
+                for key, map_value in value.items()
+                for value_plan in (field_plan.plan_for_element(key),)
+                if value_plan is not None)
+            self._unordered_depth -= 1
+            return key
+        if field_plan.is_repeated:
+            if (field_plan.opts.repeated_field_comp ==
+                    RepeatedFieldComparison.AS_SET):
+                self._unordered_depth += 1
+                key = frozenset(
+                    collections.Counter(
+                        self.element_key(element, field_plan)
+                        for element in value).items())
+                self._unordered_depth -= 1
+                return key
+            if field_plan.element_plans:
+                return tuple(
+                    self.element_key(element, element_plan)
+                    for i, element in enumerate(value)
+                    for element_plan in (field_plan.plan_for_element(i),)
+                    if element_plan is not None)
+            return tuple(
+                self.element_key(element, field_plan) for element in value)
+        return self.element_key(value, field_plan)
+
+    def element_key(self, value: Any, field_plan: plan.FieldPlan) -> Hashable:
+        if field_plan.kind == _FieldKind.MESSAGE:
+            return self.message_key(value, field_plan.message_plan)
+        if field_plan.kind == _FieldKind.FLOAT:
+            return self.float_key(value, field_plan)
+        return value
+
+    def message_key(self, msg: message.Message,
+                    msg_plan: plan.MessagePlan) -> Hashable:
+        fields_by_number = msg_plan.fields_by_number
+        items = []
+        for field_desc, value in msg.ListFields():
+            field_plan = fields_by_number.get(field_desc.number)
+            if (field_plan is None or field_plan.is_ignored or
+                    self._is_left_out(field_plan)):
+                continue
+            # Fields without presence can still be listed with a value equal to
+            # the default, e.g. -0.0, which compares equal to being unset.
+            if (not field_plan.has_presence and not field_plan.is_repeated and
+                    value == field_desc.default_value):
+                continue
+            key = self.value_key(value, field_plan)
+            # A repeated field or map whose elements are all ignored compares
+            # equal to an unset one.
+            if field_plan.is_repeated and not key:
+                continue
+            items.append((field_desc.number, key))
+        return tuple(items)
+
+    def _is_left_out(self, field_plan: plan.FieldPlan) -> bool:
+        return False
+
+    def float_key(self, value: float, field_plan: plan.FieldPlan) -> Hashable:
+        if math.isnan(value):
+            # Unless treated as equal, a NaN does not even equal itself.
+            return (_NAN_KEY
+                    if field_plan.opts.treating_nan_as_equal else object())
+        return value
+
+
+class _ApproximateKeyBuilder(_KeyBuilder):
+    """Leaves floats out of keys, but buckets the first float it meets."""
+
+    def __init__(self):
+        super().__init__()
+        self.bucket: Optional[Hashable] = None
+
+    def message_key(self, msg: message.Message,
+                    msg_plan: plan.MessagePlan) -> Hashable:
+        # A float field without presence that is approximately 0.0 may or may
+        # not be listed, so these are only used for bucketing, always.
+        for field_plan in msg_plan.implicit_float_fields:
+            self.float_key(getattr(msg, field_plan.name), field_plan)
+        return super().message_key(msg, msg_plan)
+
+    def _is_left_out(self, field_plan: plan.FieldPlan) -> bool:
+        return (field_plan.kind == _FieldKind.FLOAT and
+                not field_plan.is_repeated and not field_plan.has_presence)
+
+    def float_key(self, value: float, field_plan: plan.FieldPlan) -> Hashable:
+        # Floats inside unordered fields are not met in a stable order.
+        if self.bucket is None and not self._unordered_depth:
+            self.bucket = _float_bucket(value, field_plan)
+        return _FLOAT_KEY
+
+
+_EXACT_KEY_BUILDER = _KeyBuilder()
+
+
+def value_key(value: Any, field_plan: plan.FieldPlan) -> Hashable:
+    """Returns a hashable key of a field's value, built bottom-up.
+
+    Values that MessageDifferencer finds equal under FULL scope and EXACT float
+    comparison get equal keys, and vice versa. PARTIAL scope and APPROXIMATE
+    floats can still find values with different keys equal.
+    """
+    return _EXACT_KEY_BUILDER.value_key(value, field_plan)
+
+
+def element_key(value: Any, field_plan: plan.FieldPlan) -> Hashable:
+    """Like value_key, for a single element of a (possibly repeated) field."""
+    return _EXACT_KEY_BUILDER.element_key(value, field_plan)
+
+
+def message_key(msg: message.Message, msg_plan: plan.MessagePlan) -> Hashable:
+    return _EXACT_KEY_BUILDER.message_key(msg, msg_plan)
+
+
+def approximate_message_key(msg: message.Message,
+                            msg_plan: plan.MessagePlan) -> Hashable:
+    """Like message_key, with all floats left out.
+
+    Messages that are approximately equal under FULL scope have equal keys.
+    """
+    return _ApproximateKeyBuilder().message_key(msg, msg_plan)
+
+
+def approximate_element_key(
+        value: Any,
+        field_plan: plan.FieldPlan) -> Tuple[Hashable, Optional[Hashable]]:
+    """Returns the (key, float bucket) of an element under APPROXIMATE floats.
+
+    The key is element_key with all floats left out, so elements that are
+    approximately equal under FULL scope have equal keys. The bucket quantizes
+    the first float in a stable position by its margin: approximately equal
+    elements have integer buckets at most one apart, or equal non-integer
+    buckets. It is None if there is no such float or it can't be quantized.
+    """
+    builder = _ApproximateKeyBuilder()
+    key = builder.element_key(value, field_plan)
+    return key, builder.bucket
+
+
+def proto_fingerprint(msg: message.Message,
+                      opts: Optional[ProtoComparisonOptions] = None) -> int:
+    """Returns a 128-bit fingerprint of |msg| that agrees with proto_compare.
+
+    Messages that proto_compare finds equal under |opts| get equal
+    fingerprints: ignored fields and elements are left out, repeated fields
+    compared AS_SET and maps are hashed as multisets, and every NaN hashes the
+    same. Fingerprints are stable across processes and runtimes, so they can
+    be stored. Equal fingerprints don't prove equality, if only because NaNs
+    are unequal by default; compare candidates to be sure.
+
+    Under APPROXIMATE float comparison, floats are quantized into buckets as
+    wide as the margin, so approximately equal floats on either side of a
+    bucket edge still get different fingerprints, and a float_fraction, which
+    no fixed-width bucket can cover, leaves floats out altogether.
+
+    Raises ValueError for PARTIAL scope, under which equality is not even
+    symmetric.
+    """
+    if not opts:
+        opts = ProtoComparisonOptions()
+    if opts.scope == ProtoComparisonScope.PARTIAL:
+        raise ValueError('Fingerprints cannot agree with PARTIAL comparison')
+    msg_plan = plan.get_message_plan(msg.DESCRIPTOR, opts)
+    # Messages of different types are never equal.
+    full_name = msg.DESCRIPTOR.full_name.encode()
+    digest = hashlib.blake2b(_encode_size(len(full_name)) + full_name,
+                             digest_size=_DIGEST_SIZE)
+    key = _FingerprintKeyBuilder(opts).message_key(msg, msg_plan)
+    digest.update(_encode_key(key))
+    return int.from_bytes(digest.digest(), 'big')
+
+
+class _FingerprintKeyBuilder(_KeyBuilder):
+    """Builds keys that can be encoded stably, to fingerprint them.
+
+    Every NaN gets the same key, and under APPROXIMATE floats, floats are
+    keyed by their bucket.
+    """
+
+    def __init__(self, opts: ProtoComparisonOptions):
+        super().__init__()
+        self._approximate = opts.float_comp == ProtoFloatComparison.APPROXIMATE
+
+    def message_key(self, msg: message.Message,
+                    msg_plan: plan.MessagePlan) -> Hashable:
+        key = super().message_key(msg, msg_plan)
+        if not self._approximate or not msg_plan.implicit_float_fields:
+            return key
+        # A float field without presence that is approximately 0.0 may or may
+        # not be listed, so these are always keyed.
+        return tuple(
+            sorted(key + tuple(
+                (field_plan.desc.number,
+                 self.float_key(getattr(msg, field_plan.name), field_plan))
+                for field_plan in msg_plan.implicit_float_fields),
+                   key=lambda item: item[0]))
+
+    def _is_left_out(self, field_plan: plan.FieldPlan) -> bool:
+        return (self._approximate and field_plan.kind == _FieldKind.FLOAT and
+                not field_plan.is_repeated and not field_plan.has_presence)
+
+    def float_key(self, value: float, field_plan: plan.FieldPlan) -> Hashable:
+        if math.isnan(value):
+            return _NAN_KEY
+        if not self._approximate:
+            # Adding 0.0 turns -0.0, which equals 0.0, into 0.0.
+            return value + 0.0
+        bucket = _float_bucket(value, field_plan)
+        return _FLOAT_KEY if bucket is None else bucket
+
+
+def _encode_key(key: Hashable) -> bytes:
+    """Encodes a key into bytes that are equal for equal keys.
+
+    Every encoding is prefix-free, so encodings of consecutive keys can be
+    concatenated without ambiguity. Sets are encoded in sorted order, so
+    encodings are stable across processes.
+    """
+    if isinstance(key, tuple):
+        return b't' + _encode_size(len(key)) + b''.join(
+            _encode_key(item) for item in key)
+    if isinstance(key, frozenset):
+        items = sorted(_encode_key(item) for item in key)
+        return b'u' + _encode_size(len(items)) + b''.join(items)
+    if isinstance(key, float):
+        return b'f' + struct.pack('<d', key)
+    if isinstance(key, str):
+        key = key.encode()
+    if isinstance(key, bytes):
+        return b's' + _encode_size(len(key)) + key
+    # Integers, bools and enums.
+    return b'i' + _encode_int(int(key))
+
+
+def _encode_int(value: int) -> bytes:
+    # Buckets can be far larger than 64 bits.
+    encoded = str(value).encode()
+    return _encode_size(len(encoded)) + encoded
+
+
+def _encode_size(size: int) -> bytes:
+    """Encodes a non-negative integer as a varint."""
+    encoded = bytearray()
+    while size >= 0x80:
+        encoded.append(size & 0x7f | 0x80)
+        size >>= 7
+    encoded.append(size)
+    return bytes(encoded)
+
+
+def _float_bucket(value: float,
+                  field_plan: plan.FieldPlan) -> Optional[Hashable]:
+    if math.isnan(value):
+        return _NAN_KEY
+    if math.isinf(value):
+        # Infinities are only ever equal to themselves.
+        return (value,)
+    # A relative tolerance grows with the value, which fixed-width buckets
+    # can't cover.
+    if field_plan.float_fraction or field_plan.float_margin <= 0.0:
+        return None
+    quotient = value / field_plan.float_margin
+    if math.isinf(quotient):
+        # Floats this far apart from the margin are only ever equal to
+        # themselves.
+        return (value,)
+    return math.floor(quotient)
@@ -0,0 +1,194 @@
+import math
+import unittest
+
+from google.protobuf import text_format
+
+from proto_matcher.compare import compare
+from proto_matcher.compare import fingerprint
+from proto_matcher.compare import options
+from proto_matcher.compare import plan
+from proto_matcher.testdata import test_pb2
+
+
+def _key(msg, opts=None):
+    msg_plan = plan.get_message_plan(msg.DESCRIPTOR, opts or
+                                     options.ProtoComparisonOptions())
+    return fingerprint.message_key(msg, msg_plan)
+
+
+class MessageKeyTest(unittest.TestCase):
+
+    def test_equal_messages_have_equal_keys(self):
+        self.assertEqual(
+            _key(text_format.Parse('name: "a" notes: "x"', test_pb2.Bar())),
+            _key(text_format.Parse('notes: "x" name: "a"', test_pb2.Bar())))
+        self.assertEqual(_key(test_pb2.Bar(precision=-0.0)),
+                         _key(test_pb2.Bar()))
+
+    def test_different_messages_have_different_keys(self):
+        self.assertNotEqual(_key(test_pb2.Bar(short_id=0)),
+                            _key(test_pb2.Bar(long_id=0)))
+        self.assertNotEqual(
+            _key(text_format.Parse('notes: "x" notes: "y"', test_pb2.Bar())),
+            _key(text_format.Parse('notes: "y" notes: "x"', test_pb2.Bar())))
+
+    def test_repeated_fields_as_set(self):
+        opts = options.ProtoComparisonOptions(
+            repeated_field_comp=options.RepeatedFieldComparison.AS_SET)
+        self.assertEqual(
+            _key(text_format.Parse('notes: "x" notes: "y"', test_pb2.Bar()),
+                 opts),
+            _key(text_format.Parse('notes: "y" notes: "x"', test_pb2.Bar()),
+                 opts))
+        self.assertNotEqual(
+            _key(text_format.Parse('notes: "x" notes: "x"', test_pb2.Bar()),
+                 opts),
+            _key(text_format.Parse('notes: "x"', test_pb2.Bar()), opts))
+
+    def test_ignored_fields(self):
+        opts = options.ProtoComparisonOptions(ignore_field_paths={('name',)})
+        self.assertEqual(_key(test_pb2.Bar(name='a'), opts),
+                         _key(test_pb2.Bar(name='b'), opts))
+
+    def test_fields_emptied_by_ignored_elements(self):
+        opts = options.ProtoComparisonOptions(
+            ignore_field_paths={('mapping[2]',), ('bars[0]',)})
+        self.assertEqual(_key(test_pb2.Foo(mapping={2: 'p'}), opts),
+                         _key(test_pb2.Foo(), opts))
+        self.assertEqual(
+            _key(test_pb2.Foo(bars=[test_pb2.Bar(name='x')]), opts),
+            _key(test_pb2.Foo(), opts))
+
+    def test_nan(self):
+        self.assertNotEqual(_key(test_pb2.Bar(progress=float('nan'))),
+                            _key(test_pb2.Bar(progress=float('nan'))))
+        opts = options.ProtoComparisonOptions(treating_nan_as_equal=True)
+        self.assertEqual(_key(test_pb2.Bar(progress=float('nan')), opts),
+                         _key(test_pb2.Bar(progress=float('nan')), opts))
+
+
+class ProtoFingerprintTest(unittest.TestCase):
+
+    def assertSameFingerprint(self, x, y, opts=None):
+        if opts is None or opts.scope != options.ProtoComparisonScope.PARTIAL:
+            self.assertTrue(compare.proto_equal(x, y, opts))
+        self.assertEqual(fingerprint.proto_fingerprint(x, opts),
+                         fingerprint.proto_fingerprint(y, opts))
+
+    def assertDifferentFingerprint(self, x, y, opts=None):
+        self.assertNotEqual(fingerprint.proto_fingerprint(x, opts),
+                            fingerprint.proto_fingerprint(y, opts))
+
+    def test_equal_messages(self):
+        foo = text_format.Parse(
+            'bars { name: "a" notes: "x" } mapping { key: 1 value: "a" } '
+            'mapping { key: 2 value: "b" }', test_pb2.Foo())
+        same = test_pb2.Foo()
+        same.mapping[2] = 'b'
+        same.mapping[1] = 'a'
+        same.bars.add(notes=['x'], name='a')
+        self.assertSameFingerprint(foo, same)
+        self.assertSameFingerprint(test_pb2.Bar(precision=-0.0),
+                                   test_pb2.Bar())
+        self.assertIsInstance(fingerprint.proto_fingerprint(foo), int)
+
+    def test_different_messages(self):
+        self.assertDifferentFingerprint(test_pb2.Bar(short_id=0),
+                                        test_pb2.Bar(long_id=0))
+        self.assertDifferentFingerprint(test_pb2.Bar(notes=['x', 'y']),
+                                        test_pb2.Bar(notes=['y', 'x']))
+        self.assertDifferentFingerprint(test_pb2.Bar(notes=['xy']),
+                                        test_pb2.Bar(notes=['x', 'y']))
+        self.assertDifferentFingerprint(test_pb2.Foo(), test_pb2.Bar())
+        self.assertDifferentFingerprint(test_pb2.Foo(baz=test_pb2.Baz()),
+                                        test_pb2.Foo())
+
+    def test_repeated_fields_as_set(self):
+        opts = options.ProtoComparisonOptions(
+            repeated_field_comp=options.RepeatedFieldComparison.AS_SET)
+        self.assertSameFingerprint(
+            test_pb2.Foo(bars=[test_pb2.Bar(name='a'),
+                               test_pb2.Bar(notes=['x', 'y'])]),
+            test_pb2.Foo(bars=[test_pb2.Bar(notes=['y', 'x']),
+                               test_pb2.Bar(name='a')]), opts)
+        self.assertDifferentFingerprint(test_pb2.Bar(notes=['x', 'x']),
+                                        test_pb2.Bar(notes=['x']), opts)
+
+    def test_ignored_fields(self):
+        opts = options.ProtoComparisonOptions(
+            ignore_field_paths={('bars', 'name'), ('bars[1]',),
+                                ('mapping[1]',)})
+        self.assertSameFingerprint(
+            test_pb2.Foo(bars=[test_pb2.Bar(name='a', size=1)],
+                         mapping={1: 'a', 2: 'b'}),
+            test_pb2.Foo(bars=[test_pb2.Bar(name='b', size=1),
+                               test_pb2.Bar(size=2)],
+                         mapping={2: 'b'}), opts)
+        self.assertDifferentFingerprint(
+            test_pb2.Foo(bars=[test_pb2.Bar(size=1)]),
+            test_pb2.Foo(bars=[test_pb2.Bar(size=2)]), opts)
+
+    def test_fields_emptied_by_ignored_elements(self):
+        opts = options.ProtoComparisonOptions(
+            ignore_field_paths={('mapping[2]',), ('bars[0]',)})
+        self.assertSameFingerprint(test_pb2.Foo(mapping={2: 'p'}),
+                                   test_pb2.Foo(), opts)
+        self.assertSameFingerprint(
+            test_pb2.Foo(bars=[test_pb2.Bar(name='x')]), test_pb2.Foo(), opts)
+        opts = options.ProtoComparisonOptions(
+            repeated_field_comp=options.RepeatedFieldComparison.AS_SET,
+            ignore_field_paths={('mapping[2]',)})
+        self.assertSameFingerprint(test_pb2.Foo(mapping={2: 'p'}),
+                                   test_pb2.Foo(), opts)
+
+    def test_approximate_floats(self):
+        opts = options.ProtoComparisonOptions(
+            float_comp=options.ProtoFloatComparison.APPROXIMATE,
+            float_margin=0.1)
+        self.assertSameFingerprint(test_pb2.Bar(precision=1.01),
+                                   test_pb2.Bar(precision=1.02), opts)
+        self.assertSameFingerprint(test_pb2.Bar(precision=0.01),
+                                   test_pb2.Bar(), opts)
+        self.assertSameFingerprint(test_pb2.Bar(samples=[0.51, 2.01]),
+                                   test_pb2.Bar(samples=[0.52, 2.02]), opts)
+        self.assertDifferentFingerprint(test_pb2.Bar(precision=1.0),
+                                        test_pb2.Bar(precision=2.0), opts)
+        # Approximately equal, but on either side of a bucket edge.
+        self.assertTrue(
+            compare.proto_equal(test_pb2.Bar(precision=0.99),
+                                test_pb2.Bar(precision=1.01), opts))
+        self.assertDifferentFingerprint(test_pb2.Bar(precision=0.99),
+                                        test_pb2.Bar(precision=1.01), opts)
+
+    def test_float_fraction_leaves_floats_out(self):
+        opts = options.ProtoComparisonOptions(
+            float_comp=options.ProtoFloatComparison.APPROXIMATE,
+            float_fraction=0.1)
+        self.assertEqual(
+            fingerprint.proto_fingerprint(test_pb2.Bar(precision=1.0), opts),
+            fingerprint.proto_fingerprint(test_pb2.Bar(precision=5.0), opts))
+
+    def test_nan(self):
+        opts = options.ProtoComparisonOptions(treating_nan_as_equal=True)
+        self.assertSameFingerprint(test_pb2.Bar(samples=[math.nan]),
+                                   test_pb2.Bar(samples=[-math.nan]), opts)
+        # Stable, even though NaN is not equal to itself by default.
+        self.assertEqual(
+            fingerprint.proto_fingerprint(test_pb2.Bar(progress=math.nan)),
+            fingerprint.proto_fingerprint(test_pb2.Bar(progress=math.nan)))
+
+    def test_stable(self):
+        foo = text_format.Parse('bars { name: "a" size: 3 samples: 0.5 }',
+                                test_pb2.Foo())
+        self.assertEqual(fingerprint.proto_fingerprint(foo),
+                         0x78800a92e81f8b91bcc07342b24f21b5)
+
+    def test_partial_scope(self):
+        opts = options.ProtoComparisonOptions(
+            scope=options.ProtoComparisonScope.PARTIAL)
+        with self.assertRaisesRegex(ValueError, 'PARTIAL'):
+            fingerprint.proto_fingerprint(test_pb2.Foo(), opts)
+
+
+if __name__ == '__main__':
+    unittest.main()
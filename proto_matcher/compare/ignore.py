@@ -0,0 +1,145 @@
+import functools
+import re
+from typing import AbstractSet, Dict, Optional, Tuple
+
+# Matches any field name, or any element of a repeated or map field.
+WILDCARD = '*'
+
+# A path segment: a field name or wildcard, optionally followed by an element
+# selector, e.g. 'bars', '*', 'bars[0]' or 'mapping["key"]'.
+_SEGMENT_RE = re.compile(r'^(?P<name>[^\[\]]+)(?:\[(?P<selector>.*)\])?$')
+
+
+class IgnoreTrie():
+    """Ignored field paths below one message, compiled into a trie.
+
+    A node is ignored as a whole, or has children by field name (including
+    WILDCARD) and, for repeated and map fields, by element selector. Nodes
+    are not modified once compiled; they compare and hash by content, so plans
+    keyed by equal tries are shared.
+    """
+
+    def __init__(self):
+        self.is_ignored = False
+        self._children: Dict[str, 'IgnoreTrie'] = {}
+        # Raw selector text, e.g. '0' or '"key"', to node.
+        self._elements: Dict[str, 'IgnoreTrie'] = {}
+        self._hash: Optional[int] = None
+        # Memoized merges, which keeps lookups from building new nodes.
+        self._field_cache: Dict[str, 'IgnoreTrie'] = {}
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.is_ignored or self._children or self._elements)
+
+    @property
+    def element_selectors(self) -> Dict[str, 'IgnoreTrie']:
+        """Nodes of single elements, by raw selector text."""
+        return self._elements
+
+    def field(self, name: str) -> 'IgnoreTrie':
+        """Returns the node of field |name|, including wildcard rules."""
+        node = self._field_cache.get(name)
+        if node is None:
+            node = _merge(self._children.get(name, EMPTY),
+                          self._children.get(WILDCARD, EMPTY))
+            self._field_cache[name] = node
+        return node
+
+    def values(self) -> 'IgnoreTrie':
+        """Returns the node that applies to every element of a field."""
+        if not self._elements:
+            return self
+        values = IgnoreTrie()
+        values.is_ignored = self.is_ignored
+        values._children = self._children
+        return values
+
+    def element(self, selector: str) -> 'IgnoreTrie':
+        """Returns the node of the element picked by |selector|."""
+        return _merge(self.values(), self._elements.get(selector, EMPTY))
+
+    def _add(self, segments: Tuple[str, ...]):
+        node = self
+        for segment in segments:
+            match = _SEGMENT_RE.match(segment)
+            if match is None:
+                # Not a pattern; only matches a field named exactly this.
+                name, selector = segment, None
+            else:
+                name, selector = match.group('name'), match.group('selector')
+            node = node._children.setdefault(name, IgnoreTrie())
+            if selector is not None and selector.strip() != WILDCARD:
+                node = node._elements.setdefault(selector.strip(),
+                                                 IgnoreTrie())
+        node.is_ignored = True
+
+    def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
+        if not isinstance(other, IgnoreTrie):
+            return NotImplemented
+        return (self.is_ignored == other.is_ignored and
+                self._children == other._children and
+                self._elements == other._elements)
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            self._hash = hash(
+                (self.is_ignored, frozenset(self._children.items()),
+                 frozenset(self._elements.items())))
+        return self._hash
+
+    def __getstate__(self):
+        # Caches are rebuilt on demand, e.g. after being sent to a worker.
+        return (self.is_ignored, self._children, self._elements)
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.is_ignored, self._children, self._elements = state
+
+    def __repr__(self) -> str:
+        return (f'IgnoreTrie(is_ignored={self.is_ignored}, '
+                f'children={self._children!r}, elements={self._elements!r})')
+
+
+EMPTY = IgnoreTrie()
+
+
+@functools.lru_cache(maxsize=256)
+def compile_ignore_paths(paths: AbstractSet[Tuple[str, ...]]) -> IgnoreTrie:
+    """Compiles ignored field paths into a trie.
+
+    Each path is a tuple of segments. A segment is a field name or WILDCARD,
+    optionally followed by an element selector in brackets: an index of a
+    repeated field, a key of a map field, or WILDCARD, e.g.
+    ('bars[0]', 'size'), ('mapping["key"]',) or ('*', 'size').
+    """
+    if not paths:
+        return EMPTY
+    root = IgnoreTrie()
+    for path in paths:
+        if path:
+            root._add(tuple(path))
+    return root
+
+
+def _merge(x: IgnoreTrie, y: IgnoreTrie) -> IgnoreTrie:
+    if y.is_empty or x is y:
+        return x
+    if x.is_empty:
+        return y
+    merged = IgnoreTrie()
+    merged.is_ignored = x.is_ignored or y.is_ignored
+    merged._children = _merge_nodes(x._children, y._children)
+    merged._elements = _merge_nodes(x._elements, y._elements)
+    return merged
+
+
+def _merge_nodes(xs: Dict[str, IgnoreTrie],
+                 ys: Dict[str, IgnoreTrie]) -> Dict[str, IgnoreTrie]:
+    merged = dict(xs)
+    for key, node in ys.items():
+        merged[key] = _merge(merged[key], node) if key in merged else node
+    return merged
+
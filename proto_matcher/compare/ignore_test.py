@@ -0,0 +1,58 @@
+import pickle
+import unittest
+
+from proto_matcher.compare import ignore
+
+
+class IgnoreTrieTest(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertIs(ignore.compile_ignore_paths(frozenset()), ignore.EMPTY)
+        self.assertTrue(ignore.EMPTY.field('bars').is_empty)
+
+    def test_fields(self):
+        trie = ignore.compile_ignore_paths(
+            frozenset({('baz',), ('bars', 'size')}))
+        self.assertTrue(trie.field('baz').is_ignored)
+        self.assertFalse(trie.field('bars').is_ignored)
+        self.assertTrue(trie.field('bars').field('size').is_ignored)
+        self.assertTrue(trie.field('mapping').is_empty)
+        # Lookups are memoized, so plans keyed by nodes are shared.
+        self.assertIs(trie.field('bars'), trie.field('bars'))
+
+    def test_wildcard(self):
+        trie = ignore.compile_ignore_paths(
+            frozenset({('*', 'size'), ('bars', 'name')}))
+        bars = trie.field('bars')
+        self.assertTrue(bars.field('size').is_ignored)
+        self.assertTrue(bars.field('name').is_ignored)
+        self.assertTrue(trie.field('baz').field('size').is_ignored)
+        self.assertFalse(trie.field('baz').field('name').is_ignored)
+
+    def test_element_selectors(self):
+        trie = ignore.compile_ignore_paths(
+            frozenset({('bars[1]',), ('bars[0]', 'size'), ('bars', 'name'),
+                       ('notes[*]',)}))
+        bars = trie.field('bars')
+        self.assertFalse(bars.is_ignored)
+        self.assertEqual(set(bars.element_selectors), {'0', '1'})
+        self.assertTrue(bars.element('1').is_ignored)
+        first = bars.element('0')
+        self.assertTrue(first.field('size').is_ignored)
+        self.assertTrue(first.field('name').is_ignored)
+        self.assertFalse(bars.values().field('size').is_ignored)
+        self.assertTrue(bars.values().field('name').is_ignored)
+        self.assertTrue(trie.field('notes').is_ignored)
+
+    def test_equal_tries_hash_equal(self):
+        paths = frozenset({('bars[0]', 'size'), ('*', 'name')})
+        trie = ignore.compile_ignore_paths(paths)
+        restored = pickle.loads(pickle.dumps(trie))
+        self.assertIsNot(restored, trie)
+        self.assertEqual(restored, trie)
+        self.assertEqual(hash(restored), hash(trie))
+        self.assertEqual(restored.field('bars'), trie.field('bars'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import collections
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from google.protobuf import descriptor
+from google.protobuf import message
+
+from proto_matcher.compare import compare
+from proto_matcher.compare import fingerprint
+from proto_matcher.compare import plan
+from proto_matcher.compare.options import ProtoComparisonOptions
+from proto_matcher.compare.options import ProtoComparisonScope
+from proto_matcher.compare.options import ProtoFloatComparison
+
+_FieldKind = plan.FieldKind
+
+# Names of the fields of a partial key.
+_Signature = Tuple[str, ...]
+
+
+class ExpectationIndex():
+    """Expected messages of one type, indexed to find those a message equals.
+
+    Under FULL scope, expectations are indexed by a key that equal messages
+    share: proto_fingerprint for EXACT floats, or a key without floats for
+    APPROXIMATE ones. Under PARTIAL scope, only the fields set in an
+    expectation count, so expectations are grouped by which singular,
+    non-float fields they set, and indexed by the values of those fields. A
+    lookup then costs one key per group, plus a comparison per candidate.
+    """
+
+    def __init__(self, desc: descriptor.Descriptor,
+                 expectations: Sequence[message.Message],
+                 opts: ProtoComparisonOptions):
+        self._expectations = list(expectations)
+        self._opts = opts
+        self._plan = plan.get_message_plan(desc, opts)
+        self._desc = desc
+        self._is_partial = opts.scope == ProtoComparisonScope.PARTIAL
+        if self._is_partial:
+            self._key_fields = {
+                field_plan.name: field_plan
+                for field_plan in self._plan.fields
+                if not field_plan.is_repeated and not field_plan.is_ignored and
+                field_plan.kind in (_FieldKind.SCALAR, _FieldKind.ENUM)
+            }
+            # Indices of expectations by their signature, then their key.
+            self._partial_index: Dict[_Signature, Dict[
+                Tuple[Any, ...], List[int]]] = collections.defaultdict(
+                    lambda: collections.defaultdict(list))
+            for i, expected in enumerate(self._expectations):
+                signature = self._signature(expected)
+                self._partial_index[signature][self._partial_key(
+                    expected, signature)].append(i)
+        else:
+            self._full_index: Dict[Hashable, List[int]] = (
+                collections.defaultdict(list))
+            for i, expected in enumerate(self._expectations):
+                self._full_index[self._full_key(expected)].append(i)
+
+    def __len__(self) -> int:
+        return len(self._expectations)
+
+    def candidates(self, actual: message.Message) -> List[int]:
+        """Returns the indices of the expectations |actual| may equal.
+
+        Any expectation that |actual| equals is among them.
+        """
+        if not self._is_partial:
+            return list(self._full_index.get(self._full_key(actual), ()))
+        found = []
+        for signature, index in self._partial_index.items():
+            found.extend(index.get(self._partial_key(actual, signature), ()))
+        found.sort()
+        return found
+
+    def find(self, actual: message.Message) -> Optional[int]:
+        """Returns the index of the first expectation |actual| equals."""
+        # Made per lookup, so that stats hooks added since are honored.
+        differencer = compare.make_differencer(
+            compare.ProtoComparisonEngine.RECURSIVE,
+            self._opts,
+            self._desc,
+            explain=False)
+        for i in self.candidates(actual):
+            if differencer.compare(self._expectations[i], actual).is_equal:
+                return i
+        return None
+
+    def nearest(
+        self, actual: message.Message
+    ) -> Optional[Tuple[int, compare.ProtoComparisonResult]]:
+        """Returns the expectation with the fewest differences to |actual|.
+
+        Looks among the candidates first, and among all expectations if there
+        are none. Returns None if there are no expectations.
+        """
+        indices = self.candidates(actual) or range(len(self._expectations))
+        nearest = None
+        for i in indices:
+            result = compare.proto_compare(actual, self._expectations[i],
+                                           self._opts)
+            if nearest is None or (len(result.differences) < len(
+                    nearest[1].differences)):
+                nearest = (i, result)
+        return nearest
+
+    def _full_key(self, msg: message.Message) -> Hashable:
+        if self._opts.float_comp == ProtoFloatComparison.APPROXIMATE:
+            return fingerprint.approximate_message_key(msg, self._plan)
+        return fingerprint.proto_fingerprint(msg, self._opts)
+
+    def _signature(self, expected: message.Message) -> _Signature:
+        # As in the comparison, fields without presence only count when set to
+        # a non-default value.
+        return tuple(field_desc.name
+                     for field_desc, _ in expected.ListFields()
+                     if field_desc.name in self._key_fields)
+
+    def _partial_key(self, msg: message.Message,
+                     signature: _Signature) -> Tuple[Any, ...]:
+        # A field tracking presence that is unset differs from any value.
+        return tuple(None if self._key_fields[name].has_presence and
+                     not msg.HasField(name) else getattr(msg, name)
+                     for name in signature)
@@ -0,0 +1,97 @@
+import unittest
+
+from google.protobuf import text_format
+
+from proto_matcher.compare import index
+from proto_matcher.compare import options
+from proto_matcher.compare import profile
+from proto_matcher.testdata import test_pb2
+
+
+def _bars(*texts):
+    return [text_format.Parse(text, test_pb2.Bar()) for text in texts]
+
+
+def _index(expectations, **changes):
+    return index.ExpectationIndex(test_pb2.Bar.DESCRIPTOR, expectations,
+                                  options.ProtoComparisonOptions(**changes))
+
+
+class ExpectationIndexTest(unittest.TestCase):
+
+    def test_full_exact(self):
+        expectations = _bars('name: "a"', 'name: "b" notes: "x"', 'name: "b"')
+        expectation_index = _index(expectations)
+        self.assertEqual(
+            expectation_index.find(text_format.Parse('name: "b"',
+                                                     test_pb2.Bar())), 2)
+        self.assertEqual(expectation_index.candidates(test_pb2.Bar(name='c')),
+                         [])
+        self.assertIsNone(expectation_index.find(test_pb2.Bar(name='c')))
+
+    def test_full_approximate(self):
+        expectations = _bars('name: "a" progress: 0.5', 'name: "b"')
+        expectation_index = _index(
+            expectations, float_comp=options.ProtoFloatComparison.APPROXIMATE)
+        self.assertEqual(
+            expectation_index.find(test_pb2.Bar(name='a', progress=0.5000001)),
+            0)
+        self.assertEqual(
+            expectation_index.candidates(test_pb2.Bar(name='a', progress=2.0)),
+            [0])
+        self.assertIsNone(
+            expectation_index.find(test_pb2.Bar(name='a', progress=2.0)))
+
+    def test_partial(self):
+        expectations = _bars('name: "a"', 'name: "a" size: 1', 'size: 2',
+                             'notes: "x"', 'short_id: 0')
+        expectation_index = _index(
+            expectations, scope=options.ProtoComparisonScope.PARTIAL)
+        actual = test_pb2.Bar(name='a', size=1, description='extra')
+        self.assertEqual(expectation_index.candidates(actual), [0, 1, 3])
+        self.assertEqual(expectation_index.find(actual), 0)
+        self.assertEqual(expectation_index.find(test_pb2.Bar(size=2)), 2)
+        self.assertEqual(expectation_index.find(test_pb2.Bar(short_id=0)), 4)
+        # Unset, short_id differs from the expected 0.
+        self.assertIsNone(expectation_index.find(test_pb2.Bar(long_id=0)))
+
+    def test_ignored_fields_are_not_keys(self):
+        expectations = _bars('name: "a" size: 1')
+        expectation_index = _index(expectations,
+                                   scope=options.ProtoComparisonScope.PARTIAL,
+                                   ignore_field_paths={('name',)})
+        self.assertEqual(expectation_index.find(test_pb2.Bar(size=1)), 0)
+
+    def test_fields_emptied_by_ignored_elements(self):
+        expectation_index = index.ExpectationIndex(
+            test_pb2.Foo.DESCRIPTOR, [test_pb2.Foo()],
+            options.ProtoComparisonOptions(
+                ignore_field_paths={('mapping[2]',)}))
+        self.assertEqual(
+            expectation_index.find(test_pb2.Foo(mapping={2: 'p'})), 0)
+        self.assertIsNone(
+            expectation_index.find(test_pb2.Foo(mapping={1: 'p'})))
+
+    def test_nearest(self):
+        expectations = _bars('name: "a" size: 1 notes: "x"',
+                             'name: "b" size: 2')
+        expectation_index = _index(expectations)
+        i, result = expectation_index.nearest(test_pb2.Bar(name='b', size=3))
+        self.assertEqual(i, 1)
+        self.assertEqual(len(result.differences), 1)
+        self.assertIn('size', result.explanation)
+        self.assertIsNone(_index([]).nearest(test_pb2.Bar()))
+
+    def test_stats_hook(self):
+        expectation_index = _index(_bars('name: "a"', 'name: "b"'))
+        totals = profile.ComparisonStats()
+        profile.add_stats_hook(totals.merge)
+        try:
+            self.assertEqual(expectation_index.find(test_pb2.Bar(name='b')), 1)
+        finally:
+            profile.remove_stats_hook(totals.merge)
+        self.assertEqual(totals.comparisons, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
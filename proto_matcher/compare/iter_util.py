@@ -1,30 +1,61 @@
+import itertools
+import operator
 from typing import Any, Callable, Iterable, Iterator, Optional, TypeVar, Tuple
 
 T = TypeVar("T")
 
 KeyFn = Callable[[T], Any]
 
+# Marks an exhausted input of a merge.
+_END = object()
+
 
 def zip_pairs(
         xs: Iterable[T],
         ys: Iterable[T],
-        key: Optional[KeyFn] = None
+        key: Optional[KeyFn] = None,
+        presorted: bool = False
 ) -> Iterator[Tuple[Optional[T], Optional[T]]]:
+    """Pairs up the elements of |xs| and |ys|.
+
+    Without |key|, elements are paired by position, and the extra elements of
+    the longer input are paired with None. With |key|, elements with equal keys
+    are paired in a merge-join, in key order, and elements without a partner
+    are paired with None.
+
+    Both inputs are consumed lazily, so they may be unbounded streams, unless
+    they have to be sorted by |key| first: pass |presorted| if they already
+    are. |key| is called once per element.
+    """
     if not key:
-        key = lambda x: 0
-
-    xs = list(reversed(sorted(xs, key=key)))
-    ys = list(reversed(sorted(ys, key=key)))
-
-    while xs or ys:
-        if not xs:
-            yield None, ys.pop()
-            continue
-        if not ys:
-            yield xs.pop(), None
-            continue
-
-        x_key = key(xs[-1])
-        y_key = key(ys[-1])
-        yield (xs.pop() if x_key <= y_key else None,
-               ys.pop() if y_key <= x_key else None)
+        return itertools.zip_longest(xs, ys)
+    keyed_xs = ((key(x), x) for x in xs)
+    keyed_ys = ((key(y), y) for y in ys)
+    if not presorted:
+        keyed_xs = iter(sorted(keyed_xs, key=operator.itemgetter(0)))
+        keyed_ys = iter(sorted(keyed_ys, key=operator.itemgetter(0)))
+    return _merge_join(keyed_xs, keyed_ys)
+
+
+def _merge_join(
+    keyed_xs: Iterator[Tuple[Any, T]], keyed_ys: Iterator[Tuple[Any, T]]
+) -> Iterator[Tuple[Optional[T], Optional[T]]]:
+    x = next(keyed_xs, _END)
+    y = next(keyed_ys, _END)
+    while x is not _END and y is not _END:
+        if x[0] < y[0]:
+            yield x[1], None
+            x = next(keyed_xs, _END)
+        elif y[0] < x[0]:
+            yield None, y[1]
+            y = next(keyed_ys, _END)
+        else:
+            yield x[1], y[1]
+            x = next(keyed_xs, _END)
+            y = next(keyed_ys, _END)
+    while x is not _END:
+        yield x[1], None
+        x = next(keyed_xs, _END)
+    while y is not _END:
+        yield None, y[1]
+        y = next(keyed_ys, _END)
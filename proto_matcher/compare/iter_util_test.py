@@ -0,0 +1,47 @@
+import itertools
+import unittest
+
+from proto_matcher.compare import iter_util
+
+
+class ZipPairsTest(unittest.TestCase):
+
+    def test_by_position(self):
+        self.assertEqual(list(iter_util.zip_pairs([3, 1, 2], [3, 2])),
+                         [(3, 3), (1, 2), (2, None)])
+        self.assertEqual(list(iter_util.zip_pairs([], [1])), [(None, 1)])
+
+    def test_by_key(self):
+        self.assertEqual(
+            list(iter_util.zip_pairs([3, 1, 5, 1], [1, 4, 3],
+                                     key=lambda x: x)),
+            [(1, 1), (1, None), (3, 3), (None, 4), (5, None)])
+
+    def test_key_is_called_once_per_element(self):
+        calls = []
+
+        def key(x):
+            calls.append(x)
+            return x
+
+        list(iter_util.zip_pairs([3, 1, 2], [2, 4], key=key))
+        self.assertCountEqual(calls, [3, 1, 2, 2, 4])
+
+    def test_presorted_streams(self):
+        evens = itertools.count(0, 2)
+        threes = itertools.count(0, 3)
+        pairs = iter_util.zip_pairs(evens,
+                                    threes,
+                                    key=lambda x: x,
+                                    presorted=True)
+        self.assertEqual(list(itertools.islice(pairs, 6)),
+                         [(0, 0), (2, None), (None, 3), (4, None), (6, 6),
+                          (8, None)])
+
+    def test_by_position_is_lazy(self):
+        pairs = iter_util.zip_pairs(itertools.count(), itertools.count(10))
+        self.assertEqual(list(itertools.islice(pairs, 2)), [(0, 10), (1, 11)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+from typing import Dict, Optional, Tuple
+
+from google.protobuf import message
+
+from proto_matcher.compare import plan
+
+# (id(expected), id(actual), id(plan)) of a comparison.
+_Key = Tuple[int, int, int]
+
+
+class ComparisonMemo():
+    """Whether pairs of messages were found equal, by the pairs' identity.
+
+    Given to one comparison, a memo settles pairs of submessages met more than
+    once without walking them again; shared by the comparisons of a batch, it
+    also settles pairs met in earlier comparisons, e.g. expectations reused
+    against the same actual messages. Outcomes are keyed by the plan of the
+    comparison too, so comparisons with different options can share a memo.
+
+    A memo holds references to the messages and plans it keys on, so that
+    their ids are not reused by other objects while it lives. Messages must not
+    be modified while in a memo.
+    """
+
+    def __init__(self):
+        self._outcomes: Dict[_Key, Tuple[bool, message.Message,
+                                         message.Message,
+                                         plan.MessagePlan]] = {}
+
+    def __len__(self) -> int:
+        return len(self._outcomes)
+
+    def get(self, expected: message.Message, actual: message.Message,
+            msg_plan: plan.MessagePlan) -> Optional[bool]:
+        """Returns whether the messages were found equal, or None if they
+        were never compared.
+        """
+        outcome = self._outcomes.get((id(expected), id(actual), id(msg_plan)))
+        return None if outcome is None else outcome[0]
+
+    def put(self, expected: message.Message, actual: message.Message,
+            msg_plan: plan.MessagePlan, is_equal: bool):
+        self._outcomes[(id(expected), id(actual),
+                        id(msg_plan))] = (is_equal, expected, actual, msg_plan)
+
+    def clear(self):
+        self._outcomes.clear()
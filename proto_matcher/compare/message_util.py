@@ -0,0 +1,19 @@
+from google.protobuf import descriptor
+from google.protobuf import descriptor_pool
+from google.protobuf import message
+from google.protobuf import message_factory
+
+
+def parse_message(full_name: str, serialized: bytes) -> message.Message:
+    """Parses a message of a type in the default descriptor pool."""
+    desc = descriptor_pool.Default().FindMessageTypeByName(full_name)
+    msg = get_message_class(desc)()
+    msg.ParseFromString(serialized)
+    return msg
+
+
+def get_message_class(desc: descriptor.Descriptor):
+    if hasattr(message_factory, 'GetMessageClass'):
+        return message_factory.GetMessageClass(desc)
+    # Older runtimes only have the (since deprecated) factory method.
+    return message_factory.MessageFactory().GetPrototype(desc)
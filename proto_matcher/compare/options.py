@@ -0,0 +1,46 @@
+import dataclasses
+import enum
+from typing import AbstractSet, Optional, Tuple
+
+
+class RepeatedFieldComparison(enum.Enum):
+    AS_LIST = enum.auto()
+    AS_SET = enum.auto()
+
+
+class ProtoComparisonScope(enum.Enum):
+    FULL = enum.auto()
+    PARTIAL = enum.auto()
+
+
+class ProtoFloatComparison(enum.Enum):
+    EXACT = enum.auto()
+    APPROXIMATE = enum.auto()
+
+
+@dataclasses.dataclass(frozen=True)
+class ProtoComparisonOptions:
+    repeated_field_comp: RepeatedFieldComparison = RepeatedFieldComparison.AS_LIST
+    scope: ProtoComparisonScope = ProtoComparisonScope.FULL
+    ignore_field_paths: AbstractSet[Tuple[str, ...]] = frozenset()
+    treating_nan_as_equal: bool = False
+    float_comp: ProtoFloatComparison = ProtoFloatComparison.EXACT
+    # |float_margin| and |float_fraction| are only used when
+    # float_comp = APPROXIMATE.
+    float_margin: Optional[float] = None
+    float_fraction: Optional[float] = None
+    # Caps on the differences recorded, and on the bytes of the explanation.
+    # Differences past either are only counted, by top-level field, and the
+    # explanation ends with a summary of them.
+    max_differences: Optional[int] = None
+    max_explanation_bytes: Optional[int] = None
+
+    def __post_init__(self):
+        for name in ('max_differences', 'max_explanation_bytes'):
+            if (getattr(self, name) or 0) < 0:
+                raise ValueError(f'Invalid {name} {getattr(self, name)}')
+        # Options are used as keys of the shared comparison plan cache, so
+        # they have to stay hashable: freeze whatever collection was given.
+        object.__setattr__(
+            self, 'ignore_field_paths',
+            frozenset(tuple(path) for path in self.ignore_field_paths or ()))
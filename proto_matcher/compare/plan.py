@@ -0,0 +1,296 @@
+import dataclasses
+import enum
+import functools
+import sys
+from typing import Any, Dict, Optional, Tuple
+
+from google.protobuf import descriptor
+
+from proto_matcher.compare import ignore
+from proto_matcher.compare.options import ProtoComparisonOptions
+from proto_matcher.compare.options import ProtoComparisonScope
+from proto_matcher.compare.options import ProtoFloatComparison
+from proto_matcher.compare.options import RepeatedFieldComparison
+
+_FieldDescriptor = descriptor.FieldDescriptor
+_FLT_EPSILON = 1.19209e-07
+_DBL_EPSILON = sys.float_info.epsilon
+
+# Upper bound on the number of compiled plans kept around. A plan exists per
+# (message type, options, ignored paths below it), which stays small for the
+# usual handful of message types under test.
+_PLAN_CACHE_SIZE = 1024
+
+
+class FieldKind(enum.Enum):
+    SCALAR = enum.auto()
+    ENUM = enum.auto()
+    FLOAT = enum.auto()
+    MESSAGE = enum.auto()
+
+
+@dataclasses.dataclass
+class FieldPlan:
+    """How to compare one field, resolved once from its descriptor."""
+    desc: _FieldDescriptor
+    name: str
+    kind: FieldKind
+    is_repeated: bool
+    is_map: bool
+    is_ignored: bool
+    # Whether the field tracks presence (HasField) rather than only a value.
+    has_presence: bool
+    # Only meaningful for FLOAT fields.
+    float_margin: float = 0.0
+    float_fraction: float = 0.0
+    # Only set for map fields.
+    map_key: Optional['FieldPlan'] = None
+    map_value: Optional['FieldPlan'] = None
+    # Used to resolve |message_plan| lazily, which keeps recursive message
+    # types from compiling forever.
+    opts: Optional[ProtoComparisonOptions] = dataclasses.field(default=None,
+                                                               repr=False)
+    # Ignored paths below the values of this field.
+    ignore_trie: ignore.IgnoreTrie = dataclasses.field(default=ignore.EMPTY,
+                                                       repr=False)
+    # Only set for repeated and map fields with ignored paths picking single
+    # elements: plans of those elements by index or map key, None if ignored.
+    element_plans: Optional[Dict[Any, Optional['FieldPlan']]] = (
+        dataclasses.field(default=None, repr=False))
+    _message_plan: Optional['MessagePlan'] = dataclasses.field(default=None,
+                                                               repr=False)
+
+    @property
+    def message_plan(self) -> 'MessagePlan':
+        if self._message_plan is None:
+            self._message_plan = _get_plan(self.desc.message_type, self.opts,
+                                           self.ignore_trie)
+        return self._message_plan
+
+    def plan_for_element(self, key: Any) -> Optional['FieldPlan']:
+        """Returns the plan of the element at |key|, an index or a map key.
+
+        For maps, this is a plan of the value. Returns None if the element is
+        ignored.
+        """
+        default = self.map_value if self.is_map else self
+        if not self.element_plans:
+            return default
+        return self.element_plans.get(key, default)
+
+
+@dataclasses.dataclass
+class MessagePlan:
+    """Precomputed per-field comparators for one message type."""
+    desc: descriptor.Descriptor
+    fields: Tuple[FieldPlan, ...]
+    fields_by_number: Dict[int, FieldPlan]
+    # Singular float fields without presence, which ListFields() skips when
+    # they hold 0.0.
+    implicit_float_fields: Tuple[FieldPlan, ...]
+    # False when no option can make a difference anywhere below this message,
+    # i.e. the comparison is the same as the runtime's own ==.
+    options_affect_subtree: bool = True
+
+
+def get_message_plan(
+        desc: descriptor.Descriptor,
+        opts: ProtoComparisonOptions,
+        ignore_trie: Optional[ignore.IgnoreTrie] = None) -> MessagePlan:
+    """Returns the plan of |desc| under |opts|.
+
+    |ignore_trie| holds the ignored paths relative to |desc|, e.g. a
+    FieldPlan's |ignore_trie| for its message type, and defaults to the
+    compiled ignored paths of |opts|.
+    """
+    if ignore_trie is None:
+        ignore_trie = ignore.compile_ignore_paths(opts.ignore_field_paths)
+    return _get_plan(desc, opts, ignore_trie)
+
+
+def has_float_fields(desc: descriptor.Descriptor) -> bool:
+    """Whether |desc| or any message type below it has a float field."""
+    return _get_subtree_traits(desc).has_float
+
+
+@functools.lru_cache(maxsize=_PLAN_CACHE_SIZE)
+def _get_plan(desc: descriptor.Descriptor, opts: ProtoComparisonOptions,
+              ignore_trie: ignore.IgnoreTrie) -> MessagePlan:
+    # |ignore_trie| is relative to |desc|, so sub-messages that no ignored
+    # path reaches share the same plan.
+    fields = tuple(
+        _compile_field_plan(field_desc, opts, ignore_trie)
+        for field_desc in desc.fields)
+    return MessagePlan(
+        desc=desc,
+        fields=fields,
+        fields_by_number={
+            field_plan.desc.number: field_plan for field_plan in fields
+        },
+        implicit_float_fields=tuple(
+            field_plan for field_plan in fields
+            if field_plan.kind == FieldKind.FLOAT and
+            not field_plan.is_repeated and not field_plan.has_presence and
+            not field_plan.is_ignored),
+        options_affect_subtree=_options_affect_subtree(desc, opts,
+                                                       ignore_trie),
+    )
+
+
+@dataclasses.dataclass(frozen=True)
+class _SubtreeTraits:
+    has_float: bool
+    has_repeated: bool
+
+
+def _options_affect_subtree(desc: descriptor.Descriptor,
+                            opts: ProtoComparisonOptions,
+                            ignore_trie: ignore.IgnoreTrie) -> bool:
+    if not ignore_trie.is_empty or opts.scope == ProtoComparisonScope.PARTIAL:
+        return True
+    traits = _get_subtree_traits(desc)
+    if (opts.repeated_field_comp == RepeatedFieldComparison.AS_SET and
+            traits.has_repeated):
+        return True
+    if ((opts.float_comp == ProtoFloatComparison.APPROXIMATE or
+         opts.treating_nan_as_equal) and traits.has_float):
+        return True
+    return False
+
+
+@functools.lru_cache(maxsize=_PLAN_CACHE_SIZE)
+def _get_subtree_traits(desc: descriptor.Descriptor) -> _SubtreeTraits:
+    has_float = False
+    has_repeated = False
+    visited = {desc}
+    pending = [desc]
+    while pending:
+        for field_desc in pending.pop().fields:
+            kind = _get_field_kind(field_desc)
+            has_float = has_float or kind == FieldKind.FLOAT
+            # Set semantics do not apply to maps.
+            has_repeated = has_repeated or (
+                field_desc.label == _FieldDescriptor.LABEL_REPEATED and
+                not _is_map(field_desc))
+            if (kind == FieldKind.MESSAGE and
+                    field_desc.message_type not in visited):
+                visited.add(field_desc.message_type)
+                pending.append(field_desc.message_type)
+    return _SubtreeTraits(has_float=has_float, has_repeated=has_repeated)
+
+
+def _compile_field_plan(field_desc: _FieldDescriptor,
+                        opts: ProtoComparisonOptions,
+                        ignore_trie: ignore.IgnoreTrie) -> FieldPlan:
+    name = field_desc.name
+    field_trie = ignore_trie.field(name)
+    field_plan = FieldPlan(
+        desc=field_desc,
+        name=name,
+        kind=_get_field_kind(field_desc),
+        is_repeated=field_desc.label == _FieldDescriptor.LABEL_REPEATED,
+        is_map=_is_map(field_desc),
+        is_ignored=field_trie.is_ignored,
+        has_presence=_has_presence(field_desc),
+        opts=opts,
+        ignore_trie=field_trie.values(),
+    )
+    if field_plan.kind == FieldKind.FLOAT:
+        fraction = opts.float_fraction or 0.0
+        margin = (opts.float_margin or
+                  _get_float_comparison_epsilon(field_desc))
+        if (opts.float_comp == ProtoFloatComparison.APPROXIMATE and
+                not (fraction >= 0.0 and fraction < 1.0 and margin >= .0)):
+            raise ValueError(f'Invalid fraction {fraction} or margin {margin}')
+        field_plan.float_fraction = fraction
+        field_plan.float_margin = margin
+    if field_plan.is_map:
+        entry_desc = field_desc.message_type
+        # Map values are reported under the map field itself, so ignored paths
+        # below the map apply to the value.
+        field_plan.map_key = _compile_field_plan(
+            entry_desc.fields_by_name['key'], opts, ignore.EMPTY)
+        field_plan.map_value = _compile_field_plan(
+            entry_desc.fields_by_name['value'], opts, ignore.EMPTY)
+        field_plan.map_value.ignore_trie = field_plan.ignore_trie
+    # Selectors on singular fields never pick anything.
+    if (field_trie.element_selectors and field_plan.is_repeated and
+            not field_plan.is_ignored):
+        _compile_element_plans(field_plan, field_trie)
+    return field_plan
+
+
+def _compile_element_plans(field_plan: FieldPlan,
+                           field_trie: ignore.IgnoreTrie):
+    if (not field_plan.is_map and field_plan.opts.repeated_field_comp
+            == RepeatedFieldComparison.AS_SET):
+        raise ValueError(
+            f'Elements of {field_plan.name} are picked by index, which is '
+            'meaningless when comparing repeated fields as sets')
+    base_plan = field_plan.map_value if field_plan.is_map else field_plan
+    key_desc = field_plan.map_key.desc if field_plan.is_map else None
+    field_plan.element_plans = {}
+    for selector in field_trie.element_selectors:
+        element_trie = field_trie.element(selector)
+        key = _parse_selector(selector, key_desc)
+        field_plan.element_plans[key] = None if element_trie.is_ignored else (
+            dataclasses.replace(base_plan,
+                                ignore_trie=element_trie,
+                                element_plans=None,
+                                _message_plan=None))
+
+
+def _parse_selector(selector: str,
+                    key_desc: Optional[_FieldDescriptor]) -> Any:
+    """Parses an element selector into an index, or a key of |key_desc|."""
+    try:
+        if key_desc is None or key_desc.cpp_type in (
+                _FieldDescriptor.CPPTYPE_INT32, _FieldDescriptor.CPPTYPE_INT64,
+                _FieldDescriptor.CPPTYPE_UINT32,
+                _FieldDescriptor.CPPTYPE_UINT64):
+            return int(selector)
+        if key_desc.cpp_type == _FieldDescriptor.CPPTYPE_BOOL:
+            return {'true': True, 'false': False}[selector.lower()]
+    except (KeyError, ValueError):
+        raise ValueError(f'Invalid element selector [{selector}]') from None
+    # String keys may be quoted.
+    if len(selector) >= 2 and selector[0] == selector[-1] in ('"', "'"):
+        selector = selector[1:-1]
+    if key_desc.type == _FieldDescriptor.TYPE_BYTES:
+        return selector.encode()
+    return selector
+
+
+def _get_field_kind(field_desc: _FieldDescriptor) -> FieldKind:
+    if field_desc.cpp_type == _FieldDescriptor.CPPTYPE_MESSAGE:
+        return FieldKind.MESSAGE
+    if field_desc.cpp_type in (_FieldDescriptor.CPPTYPE_DOUBLE,
+                               _FieldDescriptor.CPPTYPE_FLOAT):
+        return FieldKind.FLOAT
+    if field_desc.enum_type is not None:
+        return FieldKind.ENUM
+    return FieldKind.SCALAR
+
+
+def _is_map(field_desc: _FieldDescriptor) -> bool:
+    return (field_desc.message_type is not None and
+            field_desc.message_type.GetOptions().map_entry)
+
+
+def _has_presence(field_desc: _FieldDescriptor) -> bool:
+    if hasattr(field_desc, 'has_presence'):
+        return field_desc.has_presence
+    # Older runtimes lack |has_presence|; derive it from the descriptor.
+    if field_desc.label == _FieldDescriptor.LABEL_REPEATED:
+        return False
+    return (field_desc.cpp_type == _FieldDescriptor.CPPTYPE_MESSAGE or
+            field_desc.containing_oneof is not None or
+            field_desc.containing_type.file.syntax == 'proto2')
+
+
+def _get_float_comparison_epsilon(field_desc: _FieldDescriptor) -> float:
+    if field_desc.cpp_type == _FieldDescriptor.CPPTYPE_DOUBLE:
+        return _DBL_EPSILON * 32
+    if field_desc.cpp_type == _FieldDescriptor.CPPTYPE_FLOAT:
+        return _FLT_EPSILON * 32
+    raise TypeError('Float comparison called on non-float types')
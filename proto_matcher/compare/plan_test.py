@@ -0,0 +1,103 @@
+import dataclasses
+import unittest
+
+from proto_matcher.compare import options
+from proto_matcher.compare import plan
+from proto_matcher.testdata import test_pb2
+
+
+class ProtoComparisonOptionsTest(unittest.TestCase):
+
+    def test_options_are_hashable(self):
+        opts = options.ProtoComparisonOptions(ignore_field_paths={('baz',)})
+        same_opts = options.ProtoComparisonOptions(
+            ignore_field_paths=[('baz',)])
+        self.assertEqual(opts, same_opts)
+        self.assertEqual(hash(opts), hash(same_opts))
+        self.assertEqual(opts.ignore_field_paths, frozenset({('baz',)}))
+
+    def test_options_are_frozen(self):
+        opts = options.ProtoComparisonOptions()
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            opts.scope = options.ProtoComparisonScope.PARTIAL
+
+
+class MessagePlanTest(unittest.TestCase):
+
+    def test_plan_is_cached(self):
+        msg_plan = plan.get_message_plan(test_pb2.Foo.DESCRIPTOR,
+                                         options.ProtoComparisonOptions())
+        self.assertIs(
+            msg_plan,
+            plan.get_message_plan(test_pb2.Foo.DESCRIPTOR,
+                                  options.ProtoComparisonOptions()))
+
+    def test_field_kinds(self):
+        msg_plan = plan.get_message_plan(test_pb2.Foo.DESCRIPTOR,
+                                         options.ProtoComparisonOptions())
+        bars, baz, mapping = msg_plan.fields
+        self.assertEqual(bars.kind, plan.FieldKind.MESSAGE)
+        self.assertTrue(bars.is_repeated)
+        self.assertFalse(bars.is_map)
+        self.assertEqual(baz.kind, plan.FieldKind.MESSAGE)
+        self.assertFalse(baz.is_repeated)
+        self.assertEqual(baz.message_plan.fields[0].kind, plan.FieldKind.ENUM)
+        self.assertTrue(mapping.is_map)
+        self.assertEqual(mapping.map_key.kind, plan.FieldKind.SCALAR)
+        self.assertEqual(mapping.map_value.kind, plan.FieldKind.SCALAR)
+
+    def test_float_epsilon(self):
+        msg_plan = plan.get_message_plan(
+            test_pb2.Bar.DESCRIPTOR,
+            options.ProtoComparisonOptions(float_fraction=0.5))
+        fields = {f.name: f for f in msg_plan.fields}
+        self.assertEqual(fields['progress'].kind, plan.FieldKind.FLOAT)
+        self.assertGreater(fields['progress'].float_margin,
+                           fields['precision'].float_margin)
+        self.assertEqual(fields['progress'].float_fraction, 0.5)
+
+    def test_ignored_fields(self):
+        opts = options.ProtoComparisonOptions(
+            ignore_field_paths={('baz',), ('bars', 'size')})
+        msg_plan = plan.get_message_plan(test_pb2.Foo.DESCRIPTOR, opts)
+        bars, baz, mapping = msg_plan.fields
+        self.assertFalse(bars.is_ignored)
+        self.assertTrue(baz.is_ignored)
+        self.assertFalse(mapping.is_ignored)
+        self.assertEqual(
+            [f.name for f in bars.message_plan.fields if f.is_ignored],
+            ['size'])
+
+    def test_options_affect_subtree(self):
+        default_plan = plan.get_message_plan(test_pb2.Foo.DESCRIPTOR,
+                                             options.ProtoComparisonOptions())
+        self.assertFalse(default_plan.options_affect_subtree)
+
+        approx_plan = plan.get_message_plan(
+            test_pb2.Foo.DESCRIPTOR,
+            options.ProtoComparisonOptions(
+                float_comp=options.ProtoFloatComparison.APPROXIMATE))
+        bars, baz, _ = approx_plan.fields
+        self.assertTrue(approx_plan.options_affect_subtree)
+        self.assertTrue(bars.message_plan.options_affect_subtree)
+        self.assertFalse(baz.message_plan.options_affect_subtree)
+
+        ignoring_plan = plan.get_message_plan(
+            test_pb2.Foo.DESCRIPTOR,
+            options.ProtoComparisonOptions(
+                ignore_field_paths={('bars', 'size')}))
+        bars, baz, _ = ignoring_plan.fields
+        self.assertTrue(bars.message_plan.options_affect_subtree)
+        self.assertFalse(baz.message_plan.options_affect_subtree)
+
+        as_set_plan = plan.get_message_plan(
+            test_pb2.Foo.DESCRIPTOR,
+            options.ProtoComparisonOptions(
+                repeated_field_comp=options.RepeatedFieldComparison.AS_SET))
+        bars, baz, _ = as_set_plan.fields
+        self.assertTrue(bars.message_plan.options_affect_subtree)
+        self.assertFalse(baz.message_plan.options_affect_subtree)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import dataclasses
+from typing import Callable, Dict, List, Tuple
+
+# Receives the stats of each instrumented comparison.
+StatsHook = Callable[['ComparisonStats'], None]
+
+_stats_hooks: List[StatsHook] = []
+
+
+@dataclasses.dataclass
+class FieldStats:
+    """What comparing the values at one field path cost."""
+    # Values compared at the path, including elements and map keys and
+    # values.
+    nodes_visited: int = 0
+    # Elements of repeated fields, or entries of maps, at the path.
+    elements_compared: int = 0
+    float_comparisons: int = 0
+    # Time spent comparing the field, including the fields below it.
+    cumulative_seconds: float = 0.0
+
+    def merge(self, other: 'FieldStats'):
+        self.nodes_visited += other.nodes_visited
+        self.elements_compared += other.elements_compared
+        self.float_comparisons += other.float_comparisons
+        self.cumulative_seconds += other.cumulative_seconds
+
+
+@dataclasses.dataclass
+class ComparisonStats:
+    """Stats of one or more comparisons, by field path.
+
+    Field paths are tuples of field names, as in ignore_field_paths, so all
+    elements of a repeated field or map count towards the same path.
+    """
+    by_field_path: Dict[Tuple[str, ...],
+                        FieldStats] = dataclasses.field(default_factory=dict)
+    comparisons: int = 0
+    total_seconds: float = 0.0
+
+    def field(self, field_path: Tuple[str, ...]) -> FieldStats:
+        stats = self.by_field_path.get(field_path)
+        if stats is None:
+            stats = self.by_field_path[field_path] = FieldStats()
+        return stats
+
+    def merge(self, other: 'ComparisonStats'):
+        """Adds |other| to these stats, e.g. as a stats hook."""
+        for field_path, stats in other.by_field_path.items():
+            self.field(field_path).merge(stats)
+        self.comparisons += other.comparisons
+        self.total_seconds += other.total_seconds
+
+    def slowest(self, n: int = 10) -> List[Tuple[Tuple[str, ...], FieldStats]]:
+        """Returns the |n| field paths with the most cumulative time."""
+        return sorted(self.by_field_path.items(),
+                      key=lambda item: item[1].cumulative_seconds,
+                      reverse=True)[:n]
+
+    def __str__(self) -> str:
+        lines = [
+            f'{self.comparisons} comparisons in {self.total_seconds:.6f}s',
+            f'{"field path":<40} {"nodes":>10} {"elements":>10} '
+            f'{"floats":>10} {"cum. s":>10}'
+        ]
+        for field_path, stats in self.slowest(len(self.by_field_path)):
+            lines.append(f'{".".join(field_path):<40} '
+                         f'{stats.nodes_visited:>10} '
+                         f'{stats.elements_compared:>10} '
+                         f'{stats.float_comparisons:>10} '
+                         f'{stats.cumulative_seconds:>10.6f}')
+        return '\n'.join(lines)
+
+
+def add_stats_hook(hook: StatsHook):
+    """Instruments every comparison in the process, and passes its stats to
+    |hook|.
+
+    E.g. to aggregate the stats of all comparisons:
+
+        totals = ComparisonStats()
+        add_stats_hook(totals.merge)
+    """
+    _stats_hooks.append(hook)
+
+
+def remove_stats_hook(hook: StatsHook):
+    _stats_hooks.remove(hook)
+
+
+def has_stats_hooks() -> bool:
+    return bool(_stats_hooks)
+
+
+def report(stats: ComparisonStats):
+    """Passes |stats| to every hook."""
+    for hook in list(_stats_hooks):
+        hook(stats)
@@ -0,0 +1,212 @@
+import collections
+import contextlib
+import dataclasses
+import mmap
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple, Type
+
+from google.protobuf import message
+
+from proto_matcher.compare import compare
+from proto_matcher.compare import iter_util
+from proto_matcher.compare import plan
+from proto_matcher.compare.options import ProtoComparisonOptions
+
+# (index in its file, start offset, end offset) of a record's bytes.
+_Span = Tuple[int, int, int]
+# (key, index in its file, bytes, parsed message) of a record.
+_KeyedRecord = Tuple[Any, int, bytes, message.Message]
+
+
+@dataclasses.dataclass
+class RecordComparison:
+    """A record that differs between two record files."""
+    # ADDED if the record is only in the actual file, DELETED if it is only in
+    # the expected one, MODIFIED otherwise.
+    kind: compare.DifferenceKind
+    # Position of the record in each file, None if the file lacks it.
+    actual_index: Optional[int]
+    expected_index: Optional[int]
+    # Value of the key field, if records are matched by key.
+    key: Any = None
+    # Only set for MODIFIED records.
+    result: Optional[compare.ProtoComparisonResult] = None
+
+
+def compare_streams(actual_path: str,
+                    expected_path: str,
+                    message_type: Type[message.Message],
+                    opts: Optional[ProtoComparisonOptions] = None,
+                    key_field: Optional[str] = None,
+                    presorted: bool = False) -> Iterator[RecordComparison]:
+    """Compares two files of varint length-delimited |message_type| records.
+
+    Both files are memory-mapped, and records are decoded lazily and compared
+    by one MessageDifferencer. Without |key_field|, records are matched by
+    position. With it, records are matched by the value of that top-level
+    field: pass |presorted| if both files are sorted by it, which merges them
+    in bounded memory. Otherwise the expected file is indexed by key first,
+    which keeps the keys and offsets of its records in memory, but not the
+    records themselves.
+
+    Yields a RecordComparison per record that differs, in the order of the
+    actual file, or in key order if |presorted|. Records with identical bytes
+    are equal without being parsed, unless a NaN could make them unequal.
+    """
+    if not opts:
+        opts = ProtoComparisonOptions()
+    differencer = compare.make_differencer(
+        compare.ProtoComparisonEngine.RECURSIVE, opts, message_type.DESCRIPTOR)
+    # Identical encodings parse to equal messages, unless they hold a NaN that
+    # is not equal to itself.
+    bytes_may_differ_from_messages = (
+        not opts.treating_nan_as_equal and
+        plan.has_float_fields(message_type.DESCRIPTOR))
+
+    def compare_records(
+            actual: Optional[bytes],
+            expected: Optional[bytes],
+            actual_index: Optional[int],
+            expected_index: Optional[int],
+            key: Any = None,
+            actual_msg: Optional[message.Message] = None,
+            expected_msg: Optional[message.Message] = None
+    ) -> Optional[RecordComparison]:
+        """Compares two records, reusing those already parsed."""
+        if actual is None or expected is None:
+            kind = (compare.DifferenceKind.DELETED
+                    if actual is None else compare.DifferenceKind.ADDED)
+            return RecordComparison(kind, actual_index, expected_index, key)
+        if actual == expected and not bytes_may_differ_from_messages:
+            return None
+        if actual_msg is None:
+            actual_msg = _parse(message_type, actual)
+        if expected_msg is None:
+            expected_msg = _parse(message_type, expected)
+        result = differencer.compare(expected_msg, actual_msg)
+        if result.is_equal:
+            return None
+        return RecordComparison(compare.DifferenceKind.MODIFIED, actual_index,
+                                expected_index, key, result)
+
+    with _map_file(actual_path) as actual_map, \
+            _map_file(expected_path) as expected_map:
+        if key_field is None:
+            pairs = iter_util.zip_pairs(_iter_spans(actual_map),
+                                        _iter_spans(expected_map))
+            for actual, expected in pairs:
+                comparison = compare_records(
+                    actual and _slice(actual_map, actual),
+                    expected and _slice(expected_map, expected),
+                    actual and actual[0], expected and expected[0])
+                if comparison:
+                    yield comparison
+            return
+
+        parse = lambda data: _parse(message_type, data)
+        get_key = lambda msg: getattr(msg, key_field)
+        if presorted:
+            keyed_actual = _iter_keyed_records(actual_map, parse, get_key)
+            keyed_expected = _iter_keyed_records(expected_map, parse, get_key)
+            pairs = iter_util.zip_pairs(keyed_actual,
+                                        keyed_expected,
+                                        key=lambda record: record[0],
+                                        presorted=True)
+            for actual, expected in pairs:
+                comparison = compare_records(
+                    actual and actual[2], expected and expected[2],
+                    actual and actual[1], expected and expected[1],
+                    (actual or expected)[0], actual and actual[3],
+                    expected and expected[3])
+                if comparison:
+                    yield comparison
+            return
+
+        # Spans of the expected records by key, in file order. Only spans are
+        # kept, so that memory does not grow with the records; matched
+        # expected records are parsed again.
+        expected_spans: Dict[Any, Deque[_Span]] = {}
+        for span in _iter_spans(expected_map):
+            key = get_key(parse(_slice(expected_map, span)))
+            expected_spans.setdefault(key, collections.deque()).append(span)
+        for key, index, actual, actual_msg in _iter_keyed_records(
+                actual_map, parse, get_key):
+            spans = expected_spans.get(key)
+            if spans:
+                span = spans.popleft()
+                comparison = compare_records(actual,
+                                             _slice(expected_map, span),
+                                             index,
+                                             span[0],
+                                             key,
+                                             actual_msg=actual_msg)
+            else:
+                comparison = compare_records(actual, None, index, None, key)
+            if comparison:
+                yield comparison
+        for key, spans in expected_spans.items():
+            for span in spans:
+                yield RecordComparison(compare.DifferenceKind.DELETED, None,
+                                       span[0], key)
+
+
+def _parse(message_type: Type[message.Message],
+           data: bytes) -> message.Message:
+    msg = message_type()
+    msg.ParseFromString(data)
+    return msg
+
+
+@contextlib.contextmanager
+def _map_file(path: str) -> Iterator[Any]:
+    """Memory-maps |path| read-only; an empty file maps to b''."""
+    with open(path, 'rb') as f:
+        # Empty files can't be memory-mapped.
+        if not f.seek(0, 2):
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def _slice(data: Any, span: _Span) -> bytes:
+    # Copies, so no view outlives the mapping.
+    return data[span[1]:span[2]]
+
+
+def _iter_spans(data: Any) -> Iterator[_Span]:
+    """Yields the span of each varint length-delimited record in |data|."""
+    pos = 0
+    index = 0
+    while pos < len(data):
+        size, pos = _decode_varint(data, pos)
+        end = pos + size
+        if end > len(data):
+            raise ValueError(f'Record {index} is truncated: expected {size} '
+                             f'bytes at offset {pos}, got {len(data) - pos}')
+        yield index, pos, end
+        pos = end
+        index += 1
+
+
+def _iter_keyed_records(
+        data: Any, parse: Callable[[bytes], message.Message],
+        get_key: Callable[[message.Message], Any]) -> Iterator[_KeyedRecord]:
+    """Yields (key, index, bytes, parsed message) of each record in |data|."""
+    for span in _iter_spans(data):
+        record = _slice(data, span)
+        msg = parse(record)
+        yield get_key(msg), span[0], record, msg
+
+
+def _decode_varint(data: Any, pos: int) -> Tuple[int, int]:
+    """Returns the varint at |pos| in |data|, and the offset after it."""
+    value = 0
+    shift = 0
+    while pos < len(data) and shift < 64:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+    raise ValueError(f'Invalid or truncated record size at offset {pos}')
@@ -0,0 +1,119 @@
+import math
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from google.protobuf.internal import encoder
+
+from proto_matcher.compare import compare
+from proto_matcher.compare import profile
+from proto_matcher.compare import stream
+from proto_matcher.compare.options import ProtoComparisonOptions
+from proto_matcher.testdata import test_pb2
+
+
+def _node(value, child=0):
+    node = test_pb2.Node(value=value)
+    if child:
+        node.children.add(value=child)
+    return node
+
+
+class CompareStreamsTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+
+    def _write(self, name, msgs):
+        path = os.path.join(self._dir.name, name)
+        with open(path, 'wb') as f:
+            for msg in msgs:
+                data = msg.SerializeToString()
+                f.write(encoder._VarintBytes(len(data)) + data)
+        return path
+
+    def _compare(self, actual, expected, **kwargs):
+        return list(
+            stream.compare_streams(self._write('actual', actual),
+                                   self._write('expected', expected),
+                                   test_pb2.Node, **kwargs))
+
+    def test_lockstep(self):
+        diffs = self._compare([_node(1), _node(2, 3), _node(3)],
+                              [_node(1), _node(2, 4)])
+        self.assertEqual([(d.kind, d.actual_index, d.expected_index)
+                          for d in diffs],
+                         [(compare.DifferenceKind.MODIFIED, 1, 1),
+                          (compare.DifferenceKind.ADDED, 2, None)])
+        self.assertEqual([d.field_path for d in diffs[0].result.differences],
+                         [('children', 'value')])
+
+    def test_empty_files(self):
+        self.assertEqual(self._compare([], []), [])
+        diffs = self._compare([], [_node(1)])
+        self.assertEqual([(d.kind, d.expected_index) for d in diffs],
+                         [(compare.DifferenceKind.DELETED, 0)])
+
+    def test_keyed_presorted(self):
+        diffs = self._compare([_node(1), _node(2, 5), _node(4)],
+                              [_node(2, 6), _node(3), _node(4)],
+                              key_field='value',
+                              presorted=True)
+        self.assertEqual(
+            [(d.kind, d.key, d.actual_index, d.expected_index) for d in diffs],
+            [(compare.DifferenceKind.ADDED, 1, 0, None),
+             (compare.DifferenceKind.MODIFIED, 2, 1, 0),
+             (compare.DifferenceKind.DELETED, 3, None, 1)])
+
+    def test_keyed_unsorted(self):
+        diffs = self._compare([_node(4), _node(2, 5), _node(1)],
+                              [_node(3), _node(2, 6), _node(4)],
+                              key_field='value')
+        self.assertEqual(
+            [(d.kind, d.key, d.actual_index, d.expected_index) for d in diffs],
+            [(compare.DifferenceKind.MODIFIED, 2, 1, 1),
+             (compare.DifferenceKind.ADDED, 1, 2, None),
+             (compare.DifferenceKind.DELETED, 3, None, 0)])
+
+    def test_equal_bytes_are_not_parsed(self):
+        with mock.patch.object(compare.MessageDifferencer,
+                               'compare') as compare_mock:
+            self.assertEqual(
+                self._compare([_node(1, 2)] * 3, [_node(1, 2)] * 3), [])
+        compare_mock.assert_not_called()
+
+    def test_equal_bytes_with_nan(self):
+        nan = test_pb2.Bar(precision=math.nan)
+        actual = self._write('actual', [nan])
+        expected = self._write('expected', [nan])
+        diffs = list(stream.compare_streams(actual, expected, test_pb2.Bar))
+        self.assertEqual([d.kind for d in diffs],
+                         [compare.DifferenceKind.MODIFIED])
+        self.assertEqual(
+            list(
+                stream.compare_streams(
+                    actual, expected, test_pb2.Bar,
+                    ProtoComparisonOptions(treating_nan_as_equal=True))), [])
+
+    def test_stats_hook(self):
+        totals = profile.ComparisonStats()
+        profile.add_stats_hook(totals.merge)
+        try:
+            self._compare([_node(1, 2)], [_node(1, 3)])
+        finally:
+            profile.remove_stats_hook(totals.merge)
+        self.assertEqual(totals.comparisons, 1)
+
+    def test_truncated_record(self):
+        path = self._write('actual', [_node(1)])
+        with open(path, 'ab') as f:
+            f.write(b'\x05\x08')
+        with self.assertRaisesRegex(ValueError, 'truncated'):
+            list(stream.compare_streams(path, path, test_pb2.Node))
+
+
+if __name__ == '__main__':
+    unittest.main()
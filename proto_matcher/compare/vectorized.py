@@ -0,0 +1,46 @@
+from typing import List, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is an optional extra; comparisons fall back.
+    np = None
+
+from proto_matcher.compare import plan
+from proto_matcher.compare.options import ProtoFloatComparison
+
+# Below this many elements, converting to arrays costs more than comparing
+# element by element.
+_MIN_VECTORIZED_SIZE = 64
+
+
+def can_compare_floats(expected: Sequence[float],
+                       actual: Sequence[float]) -> bool:
+    return (np is not None and
+            min(len(expected), len(actual)) >= _MIN_VECTORIZED_SIZE)
+
+
+def mismatched_float_indices(expected: Sequence[float],
+                             actual: Sequence[float],
+                             field_plan: plan.FieldPlan) -> List[int]:
+    """Compares two repeated float fields element-wise, in bulk.
+
+    Applies the same rules as MessageDifferencer does to a single pair of
+    floats. Returns the indices, below the shorter length, of unequal elements.
+    """
+    size = min(len(expected), len(actual))
+    xs = np.fromiter(expected, dtype=np.float64, count=size)
+    ys = np.fromiter(actual, dtype=np.float64, count=size)
+    opts = field_plan.opts
+    with np.errstate(invalid='ignore', over='ignore'):
+        equal = xs == ys
+        if opts.treating_nan_as_equal:
+            equal |= np.isnan(xs) & np.isnan(ys)
+        if opts.float_comp == ProtoFloatComparison.APPROXIMATE:
+            tolerance = np.maximum(
+                field_plan.float_margin,
+                field_plan.float_fraction *
+                np.maximum(np.abs(xs), np.abs(ys)))
+            # Unequal infinities are never approximately equal.
+            equal |= (np.isfinite(xs) & np.isfinite(ys) &
+                      (np.abs(xs - ys) <= tolerance))
+    return np.flatnonzero(~equal).tolist()
@@ -0,0 +1,84 @@
+import math
+import unittest
+from unittest import mock
+
+from proto_matcher.compare import compare
+from proto_matcher.compare import vectorized
+from proto_matcher.testdata import test_pb2
+
+
+def _compare_without_numpy(actual, expected, opts=None):
+    with mock.patch.object(vectorized, 'np', None):
+        return compare.proto_compare(actual, expected, opts=opts)
+
+
+@unittest.skipIf(vectorized.np is None, 'NumPy is not installed')
+class VectorizedFloatComparisonTest(unittest.TestCase):
+
+    def setUp(self):
+        values = [i / 7.0 for i in range(1000)]
+        values[10] = math.nan
+        values[20] = math.inf
+        values[30] = -math.inf
+        self.expected = test_pb2.Bar(samples=values, weights=values)
+        self.actual = test_pb2.Bar(samples=values, weights=values)
+
+    def assertSameAsWithoutNumpy(self, opts=None):
+        result = compare.proto_compare(self.actual, self.expected, opts=opts)
+        fallback_result = _compare_without_numpy(self.actual, self.expected,
+                                                 opts=opts)
+        self.assertEqual(result.is_equal, fallback_result.is_equal)
+        self.assertEqual(result.explanation, fallback_result.explanation)
+        return result
+
+    def test_exact(self):
+        self.actual.samples[5] += 1e-9
+        self.actual.weights[6] += 1.0
+        result = self.assertSameAsWithoutNumpy()
+        self.assertFalse(result.is_equal)
+        self.assertEqual([diff.field_path for diff in result.differences],
+                         [('samples',), ('samples',), ('weights',),
+                          ('weights',)])
+        self.assertEqual(result.differences[0].expected,
+                         self.expected.samples[5])
+        self.assertEqual(result.differences[0].actual, self.actual.samples[5])
+        self.assertTrue(math.isnan(result.differences[1].expected))
+
+    def test_nan_as_equal(self):
+        opts = compare.ProtoComparisonOptions(treating_nan_as_equal=True)
+        self.actual.samples[5] += 1e-9
+        self.assertFalse(self.assertSameAsWithoutNumpy(opts).is_equal)
+        self.actual.samples[5] = self.expected.samples[5]
+        self.actual.samples[6] = self.expected.samples[6]
+        self.assertTrue(compare.proto_equal(self.actual, self.expected, opts))
+
+    def test_approximate(self):
+        self.actual.samples[5] += 1e-9
+        self.actual.samples[6] += 1.0
+        self.actual.samples[20] = 1e300
+        for opts in [
+                compare.ProtoComparisonOptions(
+                    treating_nan_as_equal=True,
+                    float_comp=compare.ProtoFloatComparison.APPROXIMATE,
+                    float_margin=1e-6),
+                compare.ProtoComparisonOptions(
+                    float_comp=compare.ProtoFloatComparison.APPROXIMATE,
+                    float_fraction=0.5),
+        ]:
+            self.assertFalse(self.assertSameAsWithoutNumpy(opts).is_equal)
+
+    def test_different_sizes(self):
+        self.actual.samples.append(1.0)
+        del self.actual.weights[-2:]
+        result = self.assertSameAsWithoutNumpy(
+            compare.ProtoComparisonOptions(treating_nan_as_equal=True))
+        self.assertEqual([diff.kind for diff in result.differences], [
+            compare.DifferenceKind.ADDED,
+            compare.DifferenceKind.DELETED,
+            compare.DifferenceKind.DELETED,
+        ])
+        self.assertFalse(compare.proto_equal(self.actual, self.expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import hashlib
+import math
+import os
+import tempfile
+from typing import Iterator, Optional, Type
+
+from google.protobuf import descriptor
+from google.protobuf import message
+from google.protobuf import text_format
+
+# Directory of cached parses, if not next to the golden files, e.g. when the
+# goldens live in a read-only tree.
+CACHE_DIR_ENV = 'PROTO_MATCHER_GOLDEN_CACHE_DIR'
+
+_CACHE_SUFFIX = '.binpb'
+# Cache files start with the key of the parsed golden, the fingerprint of the
+# serialized message after it, then a byte telling whether the message holds
+# a NaN.
+_KEY_SIZE = 16
+_FINGERPRINT_SIZE = hashlib.sha256().digest_size
+_HEADER_SIZE = _KEY_SIZE + _FINGERPRINT_SIZE + 1
+
+_FieldDescriptor = descriptor.FieldDescriptor
+
+
+def fingerprint(msg: message.Message) -> bytes:
+    """Fingerprint of the deterministic serialization of |msg|.
+
+    Messages with equal fingerprints are equal under any options, except that
+    a NaN float field is never equal to itself unless treated so.
+    """
+    # Partial, as an expectation need not set every required field.
+    return hashlib.sha256(
+        msg.SerializePartialToString(deterministic=True)).digest()
+
+
+class Golden():
+    """A text proto golden file, parsed as one message type.
+
+    Parses are cached on disk as binary serializations, one file per golden.
+    The file records a hash of the golden's content and the message type's
+    schema, so a changed golden or schema is parsed again, and its cache
+    overwritten. The fingerprint of the parse is read without
+    parsing the cached message, which is only parsed once |message| is
+    accessed.
+
+    A message with the same fingerprint equals the golden, unless the golden
+    holds a NaN (|has_nan|) and NaNs are not treated as equal.
+    """
+
+    def __init__(self,
+                 path: str,
+                 proto_type: Type[message.Message],
+                 cache_dir: Optional[str] = None):
+        self.path = path
+        self._proto_type = proto_type
+        with open(path, 'rb') as f:
+            self._text = f.read()
+        self._cache_path = os.path.join(
+            cache_dir or os.environ.get(CACHE_DIR_ENV) or
+            os.path.dirname(path),
+            os.path.basename(path) + _CACHE_SUFFIX)
+        self._key = self._cache_key()
+        self._message: Optional[message.Message] = None
+        self.fingerprint: Optional[bytes] = None
+        self.has_nan = False
+        if not self._read_header():
+            self._parse_text()
+
+    @property
+    def message(self) -> message.Message:
+        if self._message is None:
+            msg = self._proto_type()
+            try:
+                with open(self._cache_path, 'rb') as f:
+                    contents = f.read()
+                # Another process may have cached another parse since.
+                if contents[:_HEADER_SIZE] != self._header():
+                    raise OSError('Stale cache')
+                msg.ParseFromString(contents[_HEADER_SIZE:])
+            except (OSError, message.DecodeError):
+                # The cache went away or is corrupt; parse the text again.
+                self._parse_text()
+            else:
+                self._message = msg
+        return self._message
+
+    def _cache_key(self) -> bytes:
+        key = hashlib.sha256(self._text)
+        key.update(self._proto_type.DESCRIPTOR.full_name.encode())
+        # Imported files define field types of the message too.
+        for file_desc in _iter_files(self._proto_type.DESCRIPTOR.file):
+            key.update(file_desc.serialized_pb)
+        return key.digest()[:_KEY_SIZE]
+
+    def _header(self) -> bytes:
+        return self._key + self.fingerprint + bytes([self.has_nan])
+
+    def _read_header(self) -> bool:
+        try:
+            with open(self._cache_path, 'rb') as f:
+                header = f.read(_HEADER_SIZE)
+        except OSError:
+            return False
+        if len(header) != _HEADER_SIZE or header[:_KEY_SIZE] != self._key:
+            return False
+        self.fingerprint = header[_KEY_SIZE:-1]
+        self.has_nan = bool(header[-1])
+        return True
+
+    def _parse_text(self):
+        self._message = text_format.Parse(self._text.decode('utf-8'),
+                                          self._proto_type())
+        serialized = self._message.SerializePartialToString(
+            deterministic=True)
+        self.fingerprint = hashlib.sha256(serialized).digest()
+        self.has_nan = _has_nan(self._message)
+        self._write_cache(self._header() + serialized)
+
+    def _write_cache(self, contents: bytes):
+        cache_dir = os.path.dirname(self._cache_path)
+        # Written to a temporary file then renamed, so that concurrent test
+        # processes never read a partial cache.
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(contents)
+                os.replace(tmp_path, self._cache_path)
+            except OSError:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            # Caching is best effort; goldens still parse without it.
+            pass
+
+
+def _iter_files(
+        file_desc: descriptor.FileDescriptor
+) -> Iterator[descriptor.FileDescriptor]:
+    """Yields |file_desc| and the files it transitively imports, once each."""
+    seen = set()
+    pending = [file_desc]
+    while pending:
+        file_desc = pending.pop()
+        if file_desc.name in seen:
+            continue
+        seen.add(file_desc.name)
+        yield file_desc
+        pending.extend(reversed(file_desc.dependencies))
+
+
+def _has_nan(msg: message.Message) -> bool:
+    pending = [msg]
+    while pending:
+        for field_desc, value in pending.pop().ListFields():
+            is_repeated = field_desc.label == _FieldDescriptor.LABEL_REPEATED
+            values = value if is_repeated else [value]
+            if (field_desc.message_type is not None and
+                    field_desc.message_type.GetOptions().map_entry):
+                field_desc = field_desc.message_type.fields_by_name['value']
+                values = value.values()
+            if field_desc.cpp_type == _FieldDescriptor.CPPTYPE_MESSAGE:
+                pending.extend(values)
+            elif (field_desc.cpp_type in (_FieldDescriptor.CPPTYPE_DOUBLE,
+                                          _FieldDescriptor.CPPTYPE_FLOAT) and
+                  any(math.isnan(v) for v in values)):
+                return True
+    return False
@@ -0,0 +1,169 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from google.protobuf import descriptor_pb2
+from google.protobuf import descriptor_pool
+from google.protobuf import text_format
+
+from proto_matcher.compare import message_util
+from proto_matcher.matcher import golden
+from proto_matcher.testdata import test_pb2
+
+_GOLDEN = """
+bars {
+    short_id: -123
+    name: "a bar"
+}
+mapping {
+    key: 5
+    value: "haha"
+}
+"""
+
+# A proto2 message with a required field, whose |dep| is of a type in an
+# imported file.
+_REQUIRED_PROTO = """
+name: "proto_matcher/matcher/required.proto"
+package: "proto_matcher.matcher"
+syntax: "proto2"
+dependency: "proto_matcher/matcher/dep.proto"
+message_type {
+    name: "R"
+    field { name: "req" number: 1 label: LABEL_REQUIRED type: TYPE_STRING }
+    field { name: "opt" number: 2 label: LABEL_OPTIONAL type: TYPE_STRING }
+    field {
+        name: "dep" number: 3 label: LABEL_OPTIONAL type: TYPE_MESSAGE
+        type_name: ".proto_matcher.matcher.Dep"
+    }
+}
+"""
+
+_DEP_PROTO = """
+name: "proto_matcher/matcher/dep.proto"
+package: "proto_matcher.matcher"
+syntax: "proto2"
+message_type {
+    name: "Dep"
+    field { name: "%s" number: 1 label: LABEL_OPTIONAL type: TYPE_STRING }
+}
+"""
+
+
+def _required_class(dep_field_name='value'):
+    pool = descriptor_pool.DescriptorPool()
+    for text in (_DEP_PROTO % dep_field_name, _REQUIRED_PROTO):
+        pool.Add(text_format.Parse(text,
+                                   descriptor_pb2.FileDescriptorProto()))
+    return message_util.get_message_class(
+        pool.FindMessageTypeByName('proto_matcher.matcher.R'))
+
+
+class GoldenTest(unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self._dir = tmp_dir.name
+        self._path = self._write_golden(_GOLDEN)
+
+    def _write_golden(self, text):
+        path = os.path.join(self._dir, 'foo.textproto')
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def _cache_files(self, cache_dir=None):
+        return [
+            name for name in os.listdir(cache_dir or self._dir)
+            if name.endswith('.binpb')
+        ]
+
+    def test_parse_is_cached(self):
+        expected = text_format.Parse(_GOLDEN, test_pb2.Foo())
+        first = golden.Golden(self._path, test_pb2.Foo)
+        self.assertEqual(first.message, expected)
+        self.assertEqual(len(self._cache_files()), 1)
+
+        with mock.patch.object(golden.text_format, 'Parse') as parse:
+            second = golden.Golden(self._path, test_pb2.Foo)
+            self.assertEqual(second.fingerprint, golden.fingerprint(expected))
+            self.assertEqual(second.message, expected)
+        parse.assert_not_called()
+
+    def test_changed_golden_is_parsed_again(self):
+        golden.Golden(self._path, test_pb2.Foo)
+        self._write_golden(_GOLDEN + 'baz { status: OK }')
+        changed = golden.Golden(self._path, test_pb2.Foo)
+        self.assertEqual(changed.message.baz.status, test_pb2.Baz.OK)
+        self.assertEqual(self._cache_files(), ['foo.textproto.binpb'])
+
+    def test_changed_golden_overwrites_cache(self):
+        for text in ('baz { status: OK }', 'bars { name: "x" }'):
+            self._write_golden(_GOLDEN + text)
+            golden.Golden(self._path, test_pb2.Foo)
+        self.assertEqual(self._cache_files(), ['foo.textproto.binpb'])
+        with mock.patch.object(golden.text_format, 'Parse') as parse:
+            self.assertEqual(
+                golden.Golden(self._path, test_pb2.Foo).message.bars[-1].name,
+                'x')
+        parse.assert_not_called()
+
+    def test_cache_replaced_by_another_parse(self):
+        golden.Golden(self._path, test_pb2.Foo)
+        # Only reads the header of the cache.
+        cached = golden.Golden(self._path, test_pb2.Foo)
+        self._write_golden(_GOLDEN + 'baz { status: OK }')
+        golden.Golden(self._path, test_pb2.Foo)
+        self.assertEqual(cached.message,
+                         text_format.Parse(_GOLDEN, test_pb2.Foo()))
+
+    def test_missing_required_fields(self):
+        r_class = _required_class()
+        path = self._write_golden('opt: "x"')
+        for _ in range(2):
+            parsed = golden.Golden(path, r_class)
+            self.assertEqual(parsed.message, r_class(opt='x'))
+            self.assertEqual(parsed.fingerprint,
+                             golden.fingerprint(r_class(opt='x')))
+
+    def test_changed_imported_schema_is_parsed_again(self):
+        path = self._write_golden('dep { value: "x" }')
+        golden.Golden(path, _required_class())
+        with self.assertRaises(text_format.ParseError):
+            golden.Golden(path, _required_class('renamed'))
+
+    def test_cache_dir(self):
+        cache_dir = os.path.join(self._dir, 'cache')
+        with mock.patch.dict(os.environ, {golden.CACHE_DIR_ENV: cache_dir}):
+            golden.Golden(self._path, test_pb2.Foo)
+        self.assertEqual(len(self._cache_files(cache_dir)), 1)
+        self.assertEqual(self._cache_files(), [])
+
+    def test_corrupt_cache(self):
+        golden.Golden(self._path, test_pb2.Foo)
+        cache_path = os.path.join(self._dir, self._cache_files()[0])
+        with open(cache_path, 'ab') as f:
+            f.write(b'\xff')
+        self.assertEqual(
+            golden.Golden(self._path, test_pb2.Foo).message,
+            text_format.Parse(_GOLDEN, test_pb2.Foo()))
+
+    def test_has_nan(self):
+        self.assertFalse(golden.Golden(self._path, test_pb2.Foo).has_nan)
+        self._write_golden(_GOLDEN + 'bars { samples: [1.0, nan] }')
+        self.assertTrue(golden.Golden(self._path, test_pb2.Foo).has_nan)
+        # Read back from the cache.
+        self.assertTrue(golden.Golden(self._path, test_pb2.Foo).has_nan)
+
+    def test_unwritable_cache_dir(self):
+        with mock.patch.object(golden.os, 'replace', side_effect=OSError):
+            parsed = golden.Golden(self._path, test_pb2.Foo)
+        self.assertEqual(parsed.message.mapping[5], 'haha')
+        self.assertEqual(os.listdir(self._dir), ['foo.textproto'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,7 @@
-from typing import Optional, Set, Tuple, Union
+import dataclasses
+import functools
+import warnings
+from typing import Any, Dict, Optional, Sequence, Set, Tuple, Type, Union
 
 from google.protobuf import message
 from google.protobuf import text_format
@@ -8,73 +11,238 @@ from hamcrest.core.helpers.wrap_matcher import wrap_matcher
 from hamcrest.core.matcher import Matcher
 
 from proto_matcher.compare import proto_compare, ProtoComparisonOptions
+from proto_matcher.compare import ExpectationIndex
+from proto_matcher.compare import proto_equal
 from proto_matcher.compare import ProtoComparisonScope
 from proto_matcher.compare import ProtoFloatComparison
 from proto_matcher.compare import RepeatedFieldComparison
+from proto_matcher.matcher import golden
 
 _ProtoValue = Union[str, message.Message]
 
 _ProtoMatcher = BaseMatcher[message.Message]
 
+# Upper bound on the number of parsed text expectations shared by matchers.
+_PARSED_TEXT_CACHE_SIZE = 256
+
+
+class _MutableOptions():
+    """Options of a matcher that can be set as attributes, as they used to."""
+
+    def __init__(self, matcher: '_EqualsProto'):
+        object.__setattr__(self, '_matcher', matcher)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._matcher.options(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        self._matcher.replace_options(**{name: value})
+
 
 class _EqualsProto(_ProtoMatcher):
 
     def __init__(self, msg: _ProtoValue):
         self._msg = msg
         self._opts = ProtoComparisonOptions()
+        # Text expectations parsed as each message type they were matched
+        # against.
+        self._parsed: Dict[Type[message.Message], message.Message] = {}
 
-    def mut_options(self) -> ProtoComparisonOptions:
+    def options(self) -> ProtoComparisonOptions:
         return self._opts
 
+    def replace_options(self, **changes: Any):
+        self._opts = dataclasses.replace(self._opts, **changes)
+
+    def mut_options(self) -> _MutableOptions:
+        """Deprecated: use options() and replace_options() instead."""
+        warnings.warn(
+            'mut_options() is deprecated, use options() and '
+            'replace_options() instead',
+            DeprecationWarning,
+            stacklevel=2)
+        return _MutableOptions(self)
+
     def matches(self,
                 item: message.Message,
                 mismatch_description: Optional[Description] = None) -> bool:
-        expected = self._msg
-        if isinstance(self._msg, str):
-            proto_type = type(item)
-            expected = text_format.Parse(self._msg, proto_type())
+        expected = self._get_expected(type(item))
+        # proto_equal stops at the first difference, so differences are only
+        # collected and explained when a mismatch is described.
+        if proto_equal(item, expected, opts=self._opts):
+            return True
+        if mismatch_description is not None:
+            self._describe_differences(item, expected, mismatch_description)
+        return False
+
+    def describe_mismatch(self, item: message.Message,
+                          mismatch_description: Description):
+        self._describe_differences(item, self._get_expected(type(item)),
+                                   mismatch_description)
+
+    def _describe_differences(self, item: message.Message,
+                              expected: message.Message,
+                              mismatch_description: Description):
         cmp_result = proto_compare(item, expected, opts=self._opts)
-        if not cmp_result.is_equal and mismatch_description:
+        if not cmp_result.is_equal:
             mismatch_description.append_text(cmp_result.explanation)
-        return cmp_result.is_equal
+
+    def _get_expected(
+            self, proto_type: Type[message.Message]) -> message.Message:
+        if not isinstance(self._msg, str):
+            return self._msg
+        expected = self._parsed.get(proto_type)
+        if expected is None:
+            expected = _parse_text_proto(self._msg, proto_type)
+            self._parsed[proto_type] = expected
+        return expected
+
+    def describe_to(self, description: Description):
+        description.append_text(f"a protobuf of:\n{self._msg}")
+
+
+class _EqualsProtoFile(_EqualsProto):
+
+    def __init__(self, path: str, cache_dir: Optional[str] = None):
+        super().__init__(path)
+        self._cache_dir = cache_dir
+        self._goldens: Dict[Type[message.Message], golden.Golden] = {}
+
+    def matches(self,
+                item: message.Message,
+                mismatch_description: Optional[Description] = None) -> bool:
+        # An item serialized exactly as the golden is equal to it, which
+        # skips parsing the cached golden and walking both.
+        parsed = self._get_golden(type(item))
+        if ((self._opts.treating_nan_as_equal or not parsed.has_nan) and
+                golden.fingerprint(item) == parsed.fingerprint):
+            return True
+        return super().matches(item, mismatch_description)
+
+    def _get_golden(self, proto_type: Type[message.Message]) -> golden.Golden:
+        parsed = self._goldens.get(proto_type)
+        if parsed is None:
+            parsed = golden.Golden(self._msg, proto_type, self._cache_dir)
+            self._goldens[proto_type] = parsed
+        return parsed
+
+    def _get_expected(
+            self, proto_type: Type[message.Message]) -> message.Message:
+        return self._get_golden(proto_type).message
+
+    def describe_to(self, description: Description):
+        description.append_text(f"a protobuf as in golden file {self._msg}")
+
+
+class _EqualsAnyProto(_ProtoMatcher):
+
+    def __init__(self, msgs: Sequence[_ProtoValue]):
+        self._msgs = list(msgs)
+        self._opts = ProtoComparisonOptions()
+        # Expectations indexed as each message type and options they were
+        # matched with.
+        self._indexes: Dict[Tuple[Type[message.Message],
+                                  ProtoComparisonOptions],
+                            ExpectationIndex] = {}
+
+    def options(self) -> ProtoComparisonOptions:
+        return self._opts
+
+    def replace_options(self, **changes: Any):
+        self._opts = dataclasses.replace(self._opts, **changes)
+
+    def _matches(self, item: message.Message) -> bool:
+        return self._get_index(type(item)).find(item) is not None
 
     def describe_mismatch(self, item: message.Message,
                           mismatch_description: Description):
-        self.matches(item, mismatch_description)
+        # Differences from every expectation would drown the useful ones, so
+        # only those from the nearest expectation are explained.
+        nearest = self._get_index(type(item)).nearest(item)
+        if nearest is None:
+            mismatch_description.append_text('no expectations')
+            return
+        i, cmp_result = nearest
+        if cmp_result.is_equal:
+            # An equal result has nothing to explain.
+            mismatch_description.append_text(f'equal to expectation #{i}')
+            return
+        mismatch_description.append_text(
+            f'nearest to expectation #{i}:\n{cmp_result.explanation}')
+
+    def _get_index(self,
+                   proto_type: Type[message.Message]) -> ExpectationIndex:
+        index = self._indexes.get((proto_type, self._opts))
+        if index is None:
+            index = ExpectationIndex(proto_type.DESCRIPTOR, [
+                _parse_text_proto(msg, proto_type)
+                if isinstance(msg, str) else msg for msg in self._msgs
+            ], self._opts)
+            self._indexes[(proto_type, self._opts)] = index
+        return index
 
     def describe_to(self, description: Description):
-        description.append_text(f"a protobuf of:\n{self._msg}")
+        description.append_text(
+            f"any of {len(self._msgs)} protobufs, the first being:\n"
+            f"{self._msgs[0] if self._msgs else None}")
+
+
+@functools.lru_cache(maxsize=_PARSED_TEXT_CACHE_SIZE)
+def _parse_text_proto(text: str,
+                      proto_type: Type[message.Message]) -> message.Message:
+    # Keyed by the message class rather than its full name, so that classes of
+    # the same name from different descriptor pools don't collide. Comparison
+    # never modifies the parsed message, which is shared across matchers.
+    return text_format.Parse(text, proto_type())
 
 
 def equals_proto(expected: message.Message) -> _ProtoMatcher:
     return _EqualsProto(expected)
 
 
+def equals_proto_file(path: str,
+                      cache_dir: Optional[str] = None) -> _ProtoMatcher:
+    """Matches the text proto in the golden file at |path|.
+
+    Parses are cached on disk in |cache_dir|, or next to the golden by
+    default; see golden.Golden.
+    """
+    return _EqualsProtoFile(path, cache_dir)
+
+
+def equals_any_proto(expected: Sequence[_ProtoValue]) -> _ProtoMatcher:
+    """Matches a message equal to any of the |expected| ones.
+
+    Expectations are indexed, so that each match only compares against the
+    few that may be equal; see compare.ExpectationIndex.
+    """
+    return _EqualsAnyProto(expected)
+
+
 def partially(matcher: _ProtoMatcher) -> _ProtoMatcher:
-    matcher.mut_options().scope = ProtoComparisonScope.PARTIAL
+    matcher.replace_options(scope=ProtoComparisonScope.PARTIAL)
     return matcher
 
 
 def approximately(matcher: _ProtoMatcher,
                   float_margin: Optional[float] = None,
                   float_fraction: Optional[float] = None) -> _ProtoMatcher:
-    opts = matcher.mut_options()
-    opts.float_comp = ProtoFloatComparison.APPROXIMATE
+    changes = {'float_comp': ProtoFloatComparison.APPROXIMATE}
     if float_margin:
-        opts.float_margin = float_margin
+        changes['float_margin'] = float_margin
     if float_fraction:
-        opts.float_fraction = float_fraction
+        changes['float_fraction'] = float_fraction
+    matcher.replace_options(**changes)
     return matcher
 
 
 def ignoring_field_paths(field_paths: Set[Tuple[str]],
                          matcher: _ProtoMatcher) -> _ProtoMatcher:
-    opts = matcher.mut_options()
-    opts.ignore_field_paths = field_paths
+    matcher.replace_options(ignore_field_paths=field_paths)
     return matcher
 
 
 def ignoring_repeated_field_ordering(matcher: _ProtoMatcher) -> _ProtoMatcher:
-    opts = matcher.mut_options()
-    opts.repeated_field_comp = RepeatedFieldComparison.AS_SET
+    matcher.replace_options(
+        repeated_field_comp=RepeatedFieldComparison.AS_SET)
     return matcher
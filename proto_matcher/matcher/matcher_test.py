@@ -1,9 +1,16 @@
+import os
+import tempfile
 import unittest
+from unittest import mock
 
 from hamcrest import *
+from hamcrest.core.string_description import StringDescription
 from google.protobuf import text_format
 
+from proto_matcher.matcher import matcher
 from proto_matcher.matcher.matcher import equals_proto
+from proto_matcher.matcher.matcher import equals_proto_file
+from proto_matcher.matcher.matcher import equals_any_proto
 from proto_matcher.matcher.matcher import approximately
 from proto_matcher.matcher.matcher import ignoring_field_paths
 from proto_matcher.matcher.matcher import ignoring_repeated_field_ordering
@@ -200,6 +207,104 @@ class ProtoCompareTest(unittest.TestCase):
         assert_that(actual,
                     ignoring_repeated_field_ordering(equals_proto(expected)))
 
+    def test_text_proto_is_parsed_once(self):
+        text = _TEST_PROTO + 'mapping { key: 20 value: "parsed once" }'
+        actual = self._get_test_proto()
+        with mock.patch.object(matcher.text_format,
+                               'Parse',
+                               wraps=text_format.Parse) as parse:
+            for _ in range(3):
+                assert_that(actual, not_(equals_proto(text)))
+        parse.assert_called_once()
+
+    def test_differences_are_only_collected_on_mismatch(self):
+        expected = self._get_test_proto()
+        with mock.patch.object(matcher,
+                               'proto_compare',
+                               wraps=compare.proto_compare) as proto_compare:
+            assert_that(self._get_test_proto(), equals_proto(expected))
+            proto_compare.assert_not_called()
+            expected.baz.Clear()
+            with self.assertRaisesRegex(AssertionError, 'modified: baz.status'):
+                assert_that(self._get_test_proto(), equals_proto(expected))
+            proto_compare.assert_called_once()
+
+    def _write_golden(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        path = os.path.join(tmp_dir.name, 'foo.textproto')
+        with open(path, 'w') as f:
+            f.write(_TEST_PROTO)
+        return path
+
+    def test_golden_file(self):
+        path = self._write_golden()
+        assert_that(self._get_test_proto(), equals_proto_file(path))
+        actual = self._get_test_proto()
+        actual.baz.Clear()
+        with self.assertRaisesRegex(AssertionError, 'baz.status'):
+            assert_that(actual, equals_proto_file(path))
+        actual = self._get_test_proto()
+        actual.bars[0].description = 'extra'
+        assert_that(actual, not_(equals_proto_file(path)))
+        assert_that(actual, partially(equals_proto_file(path)))
+
+    def test_golden_file_accepts_same_serialization_without_walk(self):
+        path = self._write_golden()
+        # Primes the cache.
+        assert_that(self._get_test_proto(), equals_proto_file(path))
+        with mock.patch.object(matcher,
+                               'proto_equal',
+                               wraps=compare.proto_equal) as proto_equal:
+            assert_that(self._get_test_proto(), equals_proto_file(path))
+        proto_equal.assert_not_called()
+
+    def test_mut_options(self):
+        partial_matcher = equals_proto('baz { status: ERROR }')
+        with self.assertWarns(DeprecationWarning):
+            opts = partial_matcher.mut_options()
+        opts.scope = compare.ProtoComparisonScope.PARTIAL
+        self.assertEqual(partial_matcher.options().scope,
+                         compare.ProtoComparisonScope.PARTIAL)
+        self.assertEqual(opts.scope, compare.ProtoComparisonScope.PARTIAL)
+        assert_that(self._get_test_proto(), partial_matcher)
+
+    def test_equals_any_proto(self):
+        expected = self._get_test_proto()
+        expected.baz.Clear()
+        expectations = ['baz { status: OK }', expected]
+        assert_that(self._get_test_proto(), not_(equals_any_proto([])))
+        assert_that(self._get_test_proto(),
+                    not_(equals_any_proto(expectations)))
+        assert_that(self._get_test_proto(),
+                    partially(equals_any_proto(expectations)))
+        assert_that(test_pb2.Foo(baz=test_pb2.Baz(status=test_pb2.Baz.OK)),
+                    equals_any_proto(expectations))
+
+    def test_equals_any_proto_explains_nearest(self):
+        expected = self._get_test_proto()
+        expected.baz.Clear()
+        with self.assertRaisesRegex(
+                AssertionError, 'nearest to expectation #1:\nmodified: baz'):
+            assert_that(self._get_test_proto(),
+                        equals_any_proto(['bars {}', expected]))
+
+    def test_equals_any_proto_ignoring_elements(self):
+        expected = test_pb2.Foo()
+        actual = test_pb2.Foo(mapping={2: 'p'})
+        assert_that(
+            actual,
+            ignoring_field_paths({('mapping[2]',)},
+                                 equals_any_proto([expected])))
+        assert_that(actual, not_(equals_any_proto([expected])))
+
+    def test_equals_any_proto_describes_equal_nearest(self):
+        description = StringDescription()
+        equals_any_proto(['baz { status: OK }']).describe_mismatch(
+            test_pb2.Foo(baz=test_pb2.Baz(status=test_pb2.Baz.OK)),
+            description)
+        self.assertEqual(str(description), 'equal to expectation #0')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -13,6 +13,10 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/dayfine/proto-matcher",
     packages=setuptools.find_packages(),
+    extras_require={
+        # Vectorized comparison of large repeated float fields.
+        "numpy": ["numpy"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: Apache Software License",